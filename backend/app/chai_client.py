@@ -1,18 +1,72 @@
 import aiohttp
 import asyncio
+import hashlib
+import json
 import logging
-from typing import Dict, List, Optional
+import time
+from typing import AsyncIterator, Dict, List, Optional
 import backoff
 from datetime import datetime
+from functools import lru_cache
+
+from .circuit_breaker import CircuitBreaker, CircuitOpenError, LatencyWindow
+from .history_buffer import EncodedHistory, encode_entry
+from .prompts import PromptRegistry, registry
+from .metrics import upstream_request_duration, upstream_retries
+from .tracing import record, span
+from .rate_limiter import AdaptiveRateLimiter, RateLimitExceeded, parse_retry_after
+from .response_cache import ResponseCache
+from .singleflight import SingleFlight
 
 logger = logging.getLogger(__name__)
 
+DEFAULT_BASE_URL = "http://guanaco-submitter.guanaco-backend.k2.chaiverse.com"
+
+
+@lru_cache(maxsize=1024)
+def _encode_prefix(memory: str, prompt: str, bot_name: str, user_name: str) -> bytes:
+    """Encode everything in the request body that precedes the chat_history entries"""
+    head = json.dumps({
+        "memory": memory,
+        "prompt": prompt,
+        "bot_name": bot_name,
+        "user_name": user_name
+    }, ensure_ascii=False)
+    return f'{head[:-1]}, "chat_history": ['.encode("utf-8")
+
+
+class ChaiAPIError(Exception):
+    """An error reported by the CHAI API; status is None if the response never completed"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+def _is_upstream_failure(e: BaseException) -> bool:
+    """Whether an error says the upstream is unhealthy, as opposed to rejecting this request"""
+    if isinstance(e, ChaiAPIError):
+        return e.status is None or e.status >= 500
+    if isinstance(e, aiohttp.ClientResponseError):
+        return e.status >= 500
+    return isinstance(e, (aiohttp.ClientError, asyncio.TimeoutError))
+
 
 class ChaiAPIClient:
     """Async client for interacting with CHAI's chat API"""
 
-    def __init__(self, api_key: str):
-        self.base_url = "http://guanaco-submitter.guanaco-backend.k2.chaiverse.com"
+    def __init__(
+            self,
+            api_key: str,
+            base_url: Optional[str] = None,
+            response_cache: Optional[ResponseCache] = None,
+            rate_limiter: Optional[AdaptiveRateLimiter] = None,
+            circuit_breaker: Optional[CircuitBreaker] = None,
+            hedge_percentile: Optional[float] = None,
+            hedge_min_delay: float = 0.05,
+            prompts: Optional[PromptRegistry] = None
+    ):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
         self.endpoint = "/endpoints/onsite/chat"
         self.headers = {
             "Authorization": f"Bearer {api_key}",
@@ -20,11 +74,27 @@ class ChaiAPIClient:
         }
         self.session: Optional[aiohttp.ClientSession] = None
         self.timeout = aiohttp.ClientTimeout(total=30)
+        # Streams can legitimately outlive the total timeout, so only bound the gap between chunks
+        self.stream_timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=30)
+        # Opt-in exact-match cache of replies; None disables it
+        self.response_cache = response_cache
+        self.inflight = SingleFlight()
+        # Paces calls to the upstream quota; 429s slow it down instead of failing the caller
+        self.rate_limiter = rate_limiter or AdaptiveRateLimiter()
+        self.max_throttled_tries = 5
+        # Fails fast while the upstream is down instead of waiting out timeouts
+        self.circuit_breaker = circuit_breaker or CircuitBreaker()
+        # Latency of successful upstream calls; drives the hedging delay
+        self.latency = LatencyWindow()
+        # Send a duplicate request once a call outlives this percentile of recent latencies; None disables it
+        self.hedge_percentile = hedge_percentile
+        self.hedge_min_delay = hedge_min_delay
+        self.hedges = 0
+        self.hedge_wins = 0
 
-        # Default safety prompt
-        self.safety_prompt = """You are a helpful, harmless, and honest AI friend. 
-        Always respond in a safe and appropriate manner. Be respectful and considerate in your responses.
-        """
+        # Persona templates and the per-prompt cache of what is sent upstream
+        self.prompts = prompts or registry
+        self.safety_prompt = self.prompts.safety_prompt
 
     async def initialize(self):
         """Initialize the aiohttp session"""
@@ -50,12 +120,6 @@ class ChaiAPIClient:
     async def __aexit__(self, exc_type, exc_val, exc_tb):
         await self.close()
 
-    @backoff.on_exception(
-        backoff.expo,
-        (aiohttp.ClientError, asyncio.TimeoutError),
-        max_tries=3,
-        max_time=60
-    )
     async def send_message(
             self,
             data: Dict,
@@ -71,90 +135,346 @@ class ChaiAPIClient:
         Returns:
             Dictionary with the API response
         """
+        bot_name = data.get("bot_name", "Assistant")
+
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.key(data, user_message)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Response cache hit for bot: {bot_name}")
+                return {
+                    "response": cached,
+                    "bot_name": bot_name,
+                    "timestamp": datetime.utcnow().isoformat(),
+                    "cached": True
+                }
+
+        # Identical requests already in flight (double submits, retries) share one upstream call
+        with span("encode"):
+            body = self._encode_request(data, user_message)
+        bot_response = await self.inflight.do(
+            hashlib.sha256(body).hexdigest(),
+            lambda: self._call(body, bot_name)
+        )
+
+        if cache_key is not None:
+            self.response_cache.put(cache_key, bot_response)
+
+        return {
+            "response": bot_response,
+            "bot_name": bot_name,
+            "timestamp": datetime.utcnow().isoformat(),
+            "cached": False
+        }
+
+    async def _call(self, body: bytes, bot_name: str) -> str:
+        """Make one logical upstream call behind the circuit breaker"""
+        self.circuit_breaker.before_call()
+        try:
+            bot_response = await self._hedged_post(body, bot_name)
+        except asyncio.CancelledError:
+            self.circuit_breaker.release()
+            raise
+        except Exception as e:
+            if _is_upstream_failure(e):
+                self.circuit_breaker.record_failure()
+            else:
+                # Rejected by the rate limiter or the upstream (4xx, 429): says nothing about its health
+                self.circuit_breaker.release()
+            raise
+        self.circuit_breaker.record_success()
+        return bot_response
+
+    def _hedge_delay(self) -> Optional[float]:
+        """How long to wait before hedging, or None to not hedge this call"""
+        # Too few samples to trust the percentile, or already queueing for quota
+        if self.hedge_percentile is None or len(self.latency) < 20 or self.rate_limiter.waiting:
+            return None
+        return max(self.hedge_min_delay, self.latency.percentile(self.hedge_percentile))
+
+    async def _hedged_post(self, body: bytes, bot_name: str) -> str:
+        """POST upstream, firing a duplicate if the first attempt is slower than usual; the first reply wins"""
+        delay = self._hedge_delay()
+        if delay is None:
+            return await self._post(body, bot_name)
+
+        primary = asyncio.ensure_future(self._post(body, bot_name))
+        pending = {primary}
+        try:
+            done, pending = await asyncio.wait(pending, timeout=delay)
+            if done:
+                return primary.result()
+
+            self.hedges += 1
+            logger.info(f"No reply after {delay:.3f}s, hedging request for bot: {bot_name}")
+            hedge = asyncio.ensure_future(self._post(body, bot_name))
+            pending = {primary, hedge}
+            error = None
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self.hedge_wins += 1
+                        return task.result()
+                    error = task.exception()
+            raise error
+        finally:
+            for task in pending:
+                task.cancel()
+
+    @backoff.on_exception(
+        backoff.expo,
+        (aiohttp.ClientError, asyncio.TimeoutError),
+        max_tries=3,
+        max_time=60,
+        on_backoff=lambda details: upstream_retries.labels("error").inc()
+    )
+    async def _post(self, body: bytes, bot_name: str) -> str:
+        """POST an encoded request body upstream and return the bot's reply"""
         if not self.session:
             await self.initialize()
 
-        # Prepare the request data
-        request_data = {
-            "memory": data.get("memory", ""),
-            "prompt": self._prepare_prompt(data.get("prompt", "")),
-            "bot_name": data.get("bot_name", "Assistant"),
-            "user_name": data.get("user_name", "User"),
-            "chat_history": data.get("chat_history", [])
-        }
+        for attempt in range(1, self.max_throttled_tries + 1):
+            # Raises RateLimitExceeded once the queue for a slot gets too long
+            with span("rate_limit"):
+                await self.rate_limiter.acquire()
+            logger.info(f"Sending request to CHAI API for bot: {bot_name}")
+            started = time.perf_counter()
+            status = "error"
 
-        # If user_message is provided, append it to chat history
-        if user_message:
-            request_data["chat_history"].append({
-                "sender": request_data["user_name"],
-                "message": user_message
-            })
+            try:
+                async with self.session.post(
+                        f"{self.base_url}{self.endpoint}",
+                        headers=self.headers,
+                        data=body
+                ) as response:
+                    status = str(response.status)
+                    if response.status == 429:
+                        retry_after = parse_retry_after(response.headers.get("Retry-After"))
+                        self.rate_limiter.on_throttle(retry_after)
+                        logger.warning(
+                            f"CHAI API throttled request (retry after {retry_after}s), "
+                            f"rate now {self.rate_limiter.rate:.2f}/s"
+                        )
+                        if attempt < self.max_throttled_tries:
+                            upstream_retries.labels("throttled").inc()
+                            continue
+
+                    response.raise_for_status()
+                    result = await response.json()
+                    self.rate_limiter.on_success()
+                    self.latency.observe(time.perf_counter() - started)
+
+                    # Extract the bot's response
+                    bot_response = self._extract_output(result)
+
+                    logger.info(f"Received response from CHAI API: {len(bot_response)} chars")
+
+                    return bot_response
+
+            except aiohttp.ClientResponseError as e:
+                self._raise_api_error(e)
+            except (RateLimitExceeded, CircuitOpenError):
+                # Expected refusals; the router turns them into 429/503
+                raise
+            except Exception as e:
+                if isinstance(e, asyncio.TimeoutError):
+                    status = "timeout"
+                logger.error(f"Unexpected error calling CHAI API: {e}")
+                raise
+            finally:
+                upstream_request_duration.labels("send", status).observe(time.perf_counter() - started)
+                record("upstream_attempt", started, attempt=attempt, status=status)
 
-        logger.info(f"Sending request to CHAI API for bot: {request_data['bot_name']}")
+    async def stream_message(
+            self,
+            data: Dict,
+            user_message: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Stream the bot's reply from the CHAI API as it is generated
+
+        The upstream is asked for Server-Sent Events; if it answers with a plain
+        JSON body instead, the whole reply is yielded as a single chunk.
+
+        Args:
+            data: Dictionary containing prompt, bot_name, user_name, chat_history
+            user_message: Optional current user message to append to history
+
+        Yields:
+            Text chunks of the bot's response, in order
+        """
+        cache_key = None
+        if self.response_cache is not None:
+            cache_key = self.response_cache.key(data, user_message)
+            cached = self.response_cache.get(cache_key)
+            if cached is not None:
+                logger.info(f"Response cache hit for bot: {data.get('bot_name', 'Assistant')}")
+                yield cached
+                return
+
+        if not self.session:
+            await self.initialize()
+
+        body = self._encode_request(data, user_message)
+        self.circuit_breaker.before_call()
 
+        chunks = []
+        total_chars = 0
         try:
+            with span("rate_limit"):
+                await self.rate_limiter.acquire()
+
+            logger.info(f"Streaming request to CHAI API for bot: {data.get('bot_name', 'Assistant')}")
+            started = time.monotonic()
             async with self.session.post(
                     f"{self.base_url}{self.endpoint}",
-                    headers=self.headers,
-                    json=request_data
+                    headers={**self.headers, "Accept": "text/event-stream, application/json"},
+                    data=body,
+                    timeout=self.stream_timeout
             ) as response:
+                # Streams are timed to the response headers; their full length depends on the reply
+                upstream_request_duration.labels("stream", str(response.status)).observe(time.monotonic() - started)
+                if response.status == 429:
+                    self.rate_limiter.on_throttle(parse_retry_after(response.headers.get("Retry-After")))
                 response.raise_for_status()
-                result = await response.json()
+                self.rate_limiter.on_success()
 
-                # Extract the bot's response
-                bot_response = result.get("model_output", result.get("response", result.get("message", "")))
+                if response.content_type == "text/event-stream":
+                    async for chunk in self._iter_sse(response):
+                        total_chars += len(chunk)
+                        if cache_key is not None:
+                            chunks.append(chunk)
+                        yield chunk
+                else:
+                    bot_response = self._extract_output(await response.json(content_type=None))
+                    total_chars = len(bot_response)
+                    chunks.append(bot_response)
+                    if bot_response:
+                        yield bot_response
 
-                logger.info(f"Received response from CHAI API: {len(bot_response)} chars")
+                logger.info(f"Streamed response from CHAI API: {total_chars} chars")
 
-                return {
-                    "response": bot_response,
-                    "bot_name": request_data["bot_name"],
-                    "timestamp": datetime.utcnow().isoformat()
-                }
+            # Only a stream that ran to completion is worth caching
+            if cache_key is not None:
+                self.response_cache.put(cache_key, "".join(chunks))
+
+            self.circuit_breaker.record_success()
 
         except aiohttp.ClientResponseError as e:
-            logger.error(f"CHAI API error: {e.status} - {e.message}")
-            if e.status == 401:
-                raise Exception("Invalid API key")
-            elif e.status == 429:
-                raise Exception("Rate limit exceeded")
-            else:
-                raise Exception(f"API error: {e.message}")
+            self._stream_failed(e)
+            self._raise_api_error(e)
+        except aiohttp.ClientPayloadError as e:
+            self._stream_failed(e)
+            logger.error(f"CHAI API stream interrupted after {total_chars} chars: {e}")
+            raise ChaiAPIError("Stream interrupted")
+        except (asyncio.CancelledError, GeneratorExit):
+            self.circuit_breaker.release()
+            raise
+        except (RateLimitExceeded, CircuitOpenError):
+            self.circuit_breaker.release()
+            raise
         except Exception as e:
-            logger.error(f"Unexpected error calling CHAI API: {e}")
+            self._stream_failed(e)
+            logger.error(f"Unexpected error streaming from CHAI API: {e}")
             raise
 
+    def _stream_failed(self, e: BaseException):
+        if _is_upstream_failure(e):
+            self.circuit_breaker.record_failure()
+        else:
+            self.circuit_breaker.release()
+
+    async def _iter_sse(self, response: aiohttp.ClientResponse) -> AsyncIterator[str]:
+        """Yield text chunks from a Server-Sent Events response body"""
+        async for raw_line in response.content:
+            line = raw_line.decode("utf-8").rstrip("\r\n")
+            if not line.startswith("data:"):
+                continue
+
+            payload = line[5:].strip()
+            if payload == "[DONE]":
+                return
+
+            try:
+                event = json.loads(payload)
+            except ValueError:
+                # Plain-text frames carry the chunk verbatim
+                if payload:
+                    yield payload
+                continue
+
+            if isinstance(event, dict):
+                chunk = event.get("delta", event.get("token", self._extract_output(event)))
+            else:
+                chunk = str(event)
+            if chunk:
+                yield chunk
+
+    def _encode_request(self, data: Dict, user_message: Optional[str] = None) -> bytes:
+        """
+        Encode the upstream request body from session data
+
+        chat_history may be a plain list of {"sender", "message"} dicts or an
+        EncodedHistory, whose already-encoded entries are spliced in as-is so
+        the cost of a turn does not grow with the length of the conversation.
+        """
+        user_name = data.get("user_name", "User")
+        prefix = _encode_prefix(
+            data.get("memory", ""),
+            self._prepare_prompt(data.get("prompt", "")),
+            data.get("bot_name", "Assistant"),
+            user_name
+        )
+
+        # If user_message is provided, append it to chat history
+        suffix = (encode_entry(user_name, user_message),) if user_message else ()
+
+        history = data.get("chat_history", [])
+        if isinstance(history, EncodedHistory):
+            entries = history.join(*suffix)
+        else:
+            entries = b",".join(
+                [encode_entry(entry["sender"], entry["message"]) for entry in history] + list(suffix)
+            )
+
+        return b"".join((prefix, entries, b"]}"))
+
+    def stats(self) -> Dict:
+        """Upstream health and latency figures"""
+        return {
+            "circuit": self.circuit_breaker.stats(),
+            "latency": self.latency.stats(),
+            "hedges": self.hedges,
+            "hedge_wins": self.hedge_wins,
+            "rate_limiter": self.rate_limiter.stats(),
+        }
+
+    def _extract_output(self, result: Dict) -> str:
+        """Extract the bot's reply from an upstream response body"""
+        return result.get("model_output", result.get("response", result.get("message", "")))
+
+    def _raise_api_error(self, e: aiohttp.ClientResponseError):
+        """Translate an upstream HTTP error into the client's error messages"""
+        logger.error(f"CHAI API error: {e.status} - {e.message}")
+        if e.status == 401:
+            raise ChaiAPIError("Invalid API key", e.status)
+        elif e.status == 429:
+            raise ChaiAPIError("Rate limit exceeded", e.status)
+        else:
+            raise ChaiAPIError(f"API error: {e.message}", e.status)
+
     def _prepare_prompt(self, custom_prompt: str) -> str:
         """Prepare the prompt with safety instructions"""
-        if custom_prompt:
-            return f"{self.safety_prompt}\n\n{custom_prompt}"
-        return self.safety_prompt
+        return self.prompts.upstream(custom_prompt)
 
     def create_personality_prompt(
             self,
             personality_type: str,
-            custom_traits: Optional[List[str]] = None
+            custom_traits: Optional[List[str]] = None,
+            custom_prompt: Optional[str] = None
     ) -> str:
         """Create a personality-specific prompt for human personas"""
-
-        base_prompts = {
-            "friendly": "You are a warm, outgoing person who loves meeting new people. You're naturally cheerful, use casual language, and genuinely enjoy conversations. You share personal experiences and ask engaging questions about others' lives.",
-            "professional": "You are a successful professional with strong communication skills. You speak with confidence and clarity, share insights from your career, and maintain appropriate boundaries while being personable.",
-            "creative": "You are an artistic and imaginative person who sees the world differently. You love discussing ideas, sharing creative projects, and inspiring others to think outside the box. You often reference art, music, or literature.",
-            "analytical": "You are a logical thinker who enjoys analyzing situations and solving problems. You appreciate data and facts, ask thoughtful questions, and like to understand how things work. You're naturally curious about systems and patterns.",
-            "empathetic": "You are a deeply caring person who connects emotionally with others. You're a great listener, validate feelings, and offer genuine support. You share your own vulnerabilities and create safe spaces for others.",
-            "humorous": "You are naturally funny and love making people laugh. You use appropriate humor, share amusing stories from your life, and can lighten the mood in any conversation. You're quick-witted but never mean-spirited.",
-            "adventurous": "You are someone who loves new experiences and exploring the world. You're always planning your next trip, trying new activities, and encouraging others to step out of their comfort zones. You share exciting stories from your adventures.",
-            "intellectual": "You are well-read and enjoy deep discussions about ideas, philosophy, science, and culture. You love learning and sharing knowledge, but in a conversational way that doesn't feel preachy. You ask thought-provoking questions."
-        }
-
-        prompt = base_prompts.get(
-            personality_type,
-            "You are a helpful AI friend."
-        )
-
-        if custom_traits:
-            traits_str = ", ".join(custom_traits)
-            prompt += f"\n\nAdditional traits: {traits_str}"
-
-        return f"{self.safety_prompt}\n\n{prompt}"
\ No newline at end of file
+        return self.prompts.persona(personality_type, custom_traits, custom_prompt)
\ No newline at end of file
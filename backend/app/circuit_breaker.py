@@ -0,0 +1,122 @@
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream that is known to be failing"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Upstream unavailable")
+        self.retry_after = retry_after
+
+
+class CircuitBreaker:
+    """
+    Closed/open/half-open circuit breaker
+
+    After failure_threshold consecutive failures the circuit opens and every
+    call fails fast with CircuitOpenError. Once recovery_time has passed it
+    goes half-open and lets up to half_open_max trial calls through: a
+    success closes it again, a failure re-opens it for another
+    recovery_time.
+    """
+
+    def __init__(
+            self,
+            failure_threshold: int = 5,
+            recovery_time: float = 30.0,
+            half_open_max: int = 1
+    ):
+        self.failure_threshold = failure_threshold
+        self.recovery_time = recovery_time
+        self.half_open_max = half_open_max
+        self.state = CLOSED
+        self.failures = 0
+        self.opened = 0
+        self.fast_failures = 0
+        self._opened_at = 0.0
+        self._trials = 0
+
+    def before_call(self):
+        """Admit a call or raise CircuitOpenError"""
+        if self.state == OPEN:
+            remaining = self._opened_at + self.recovery_time - time.monotonic()
+            if remaining > 0:
+                self.fast_failures += 1
+                raise CircuitOpenError(remaining)
+            self.state = HALF_OPEN
+            self._trials = 0
+
+        if self.state == HALF_OPEN:
+            if self._trials >= self.half_open_max:
+                self.fast_failures += 1
+                raise CircuitOpenError(self.recovery_time)
+            self._trials += 1
+
+    def record_success(self):
+        self.state = CLOSED
+        self.failures = 0
+        self._trials = 0
+
+    def record_failure(self):
+        self.failures += 1
+        if self.state == HALF_OPEN or self.failures >= self.failure_threshold:
+            if self.state != OPEN:
+                self.opened += 1
+            self.state = OPEN
+            self._opened_at = time.monotonic()
+            self._trials = 0
+
+    def release(self):
+        """Give back an admitted call that was abandoned before it succeeded or failed"""
+        if self.state == HALF_OPEN and self._trials > 0:
+            self._trials -= 1
+
+    def stats(self) -> Dict:
+        return {
+            "state": self.state,
+            "consecutive_failures": self.failures,
+            "opened": self.opened,
+            "fast_failures": self.fast_failures,
+        }
+
+
+class LatencyWindow:
+    """Rolling window of the most recent latency samples, in seconds"""
+
+    def __init__(self, size: int = 1000):
+        self._samples: Deque[float] = deque(maxlen=size)
+        self._sorted: Optional[List[float]] = None
+        self.count = 0
+
+    def __len__(self) -> int:
+        return len(self._samples)
+
+    def observe(self, seconds: float):
+        self._samples.append(seconds)
+        self._sorted = None
+        self.count += 1
+
+    def percentile(self, q: float) -> Optional[float]:
+        """The q-th percentile (0-100) of the window, or None if it is empty"""
+        if not self._samples:
+            return None
+        if self._sorted is None:
+            self._sorted = sorted(self._samples)
+        # Nearest-rank percentile
+        rank = math.ceil(q / 100 * len(self._sorted))
+        return self._sorted[min(len(self._sorted), max(1, rank)) - 1]
+
+    def stats(self) -> Dict:
+        return {
+            "samples": self.count,
+            "p50": self.percentile(50),
+            "p95": self.percentile(95),
+            "p99": self.percentile(99),
+        }
@@ -0,0 +1,192 @@
+import asyncio
+import logging
+import time
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Close code sent to a consumer dropped for falling behind or going silent ("try again later")
+CLOSE_EVICTED = 1013
+
+
+class Connection:
+    """
+    One chat WebSocket and its bounded outgoing queue
+
+    Frames are written by a dedicated sender task, so a slow client only
+    ever fills its own queue instead of stalling whoever produced the frame.
+    """
+
+    def __init__(self, websocket: WebSocket, session_id: str, max_queue: int):
+        self.websocket = websocket
+        self.session_id = session_id
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue)
+        self.last_seen = time.monotonic()
+        # Turns this connection is running; it cannot answer pings meanwhile
+        self.busy = 0
+        self.closed = False
+        self._sender = asyncio.create_task(self._send_loop())
+
+    def seen(self):
+        self.last_seen = time.monotonic()
+
+    def offer(self, frame: Dict[str, Any]) -> bool:
+        """Queue a frame without waiting; False if the queue is full"""
+        if self.closed:
+            return False
+        try:
+            self.queue.put_nowait(frame)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    async def send(self, frame: Dict[str, Any], timeout: float) -> bool:
+        """Queue a frame, waiting up to timeout for room; False if the client did not drain in time"""
+        if self.closed:
+            return False
+        try:
+            await asyncio.wait_for(self.queue.put(frame), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    async def _send_loop(self):
+        try:
+            while True:
+                frame = await self.queue.get()
+                await self.websocket.send_json(frame)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.info(f"WebSocket send failed for session {self.session_id}: {e}")
+            self.closed = True
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        if self.closed and self._sender.done():
+            return
+        self.closed = True
+        self._sender.cancel()
+        try:
+            await self._sender
+        except asyncio.CancelledError:
+            pass
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception:
+            # Already closed by the client
+            pass
+
+
+class ConnectionManager:
+    """
+    Every open chat WebSocket, grouped by session
+
+    Any number of sockets (browser tabs) may follow one session; each
+    committed turn is broadcast to all of them. A heartbeat task pings every
+    socket and drops those that have not been heard from within
+    ping_timeout. A socket whose send queue is full when a broadcast arrives
+    is evicted rather than allowed to hold the others back.
+
+    When workers share a store, publish is set to relay broadcasts to the
+    other workers, which hand them to deliver for their own sockets.
+    """
+
+    def __init__(
+            self,
+            max_queue: int = 256,
+            send_timeout: float = 5.0,
+            ping_interval: float = 20.0,
+            ping_timeout: float = 60.0
+    ):
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+        self.ping_interval = ping_interval
+        self.ping_timeout = ping_timeout
+        self.evicted = 0
+        self._sessions: Dict[str, Set[Connection]] = {}
+        self._heartbeat: Optional[asyncio.Task] = None
+        self.publish: Optional[Callable[[str, Dict[str, Any]], Awaitable[None]]] = None
+
+    def __len__(self) -> int:
+        return sum(len(connections) for connections in self._sessions.values())
+
+    async def connect(self, websocket: WebSocket, session_id: str) -> Connection:
+        await websocket.accept()
+        connection = Connection(websocket, session_id, self.max_queue)
+        self._sessions.setdefault(session_id, set()).add(connection)
+        if self._heartbeat is None or self._heartbeat.done():
+            self._heartbeat = asyncio.create_task(self._run_heartbeat())
+        return connection
+
+    async def disconnect(self, connection: Connection, code: int = 1000, reason: str = ""):
+        connections = self._sessions.get(connection.session_id)
+        if connections is not None:
+            connections.discard(connection)
+            if not connections:
+                del self._sessions[connection.session_id]
+        await connection.close(code, reason)
+
+    def evict(self, connection: Connection, reason: str):
+        """Drop a connection that cannot keep up; the client may reconnect"""
+        if connection.closed:
+            return
+        self.evicted += 1
+        logger.warning(f"Evicting WebSocket for session {connection.session_id}: {reason}")
+        connection.closed = True
+        asyncio.create_task(self.disconnect(connection, CLOSE_EVICTED, reason))
+
+    async def send(self, connection: Connection, frame: Dict[str, Any]) -> bool:
+        """Send to one connection with backpressure, evicting it if it stays full past send_timeout"""
+        if await connection.send(frame, self.send_timeout):
+            return True
+        self.evict(connection, "send queue full")
+        return False
+
+    def listeners(self, session_id: str, exclude: Optional[Connection] = None) -> List[Connection]:
+        return [c for c in self._sessions.get(session_id, ()) if c is not exclude and not c.closed]
+
+    async def broadcast(self, session_id: str, frame: Dict[str, Any], exclude: Optional[Connection] = None) -> int:
+        """Queue a frame for every socket following session_id, on any worker; returns how many here accepted it"""
+        if self.publish is not None:
+            await self.publish(session_id, frame)
+        return self.deliver(session_id, frame, exclude)
+
+    def deliver(self, session_id: str, frame: Dict[str, Any], exclude: Optional[Connection] = None) -> int:
+        """Queue a frame for this worker's sockets following session_id"""
+        delivered = 0
+        for connection in self.listeners(session_id, exclude):
+            if connection.offer(frame):
+                delivered += 1
+            else:
+                self.evict(connection, "slow consumer")
+        return delivered
+
+    async def _run_heartbeat(self):
+        while self._sessions:
+            await asyncio.sleep(self.ping_interval)
+            now = time.monotonic()
+            for connections in list(self._sessions.values()):
+                for connection in list(connections):
+                    if connection.busy:
+                        continue
+                    if now - connection.last_seen > self.ping_timeout:
+                        self.evict(connection, "heartbeat timeout")
+                    elif not connection.offer({"type": "ping"}):
+                        self.evict(connection, "slow consumer")
+
+    async def close(self):
+        if self._heartbeat is not None:
+            self._heartbeat.cancel()
+            try:
+                await self._heartbeat
+            except asyncio.CancelledError:
+                pass
+            self._heartbeat = None
+        for connections in list(self._sessions.values()):
+            for connection in list(connections):
+                await self.disconnect(connection, 1001, "Server shutting down")
+
+    def stats(self) -> Dict[str, int]:
+        return {"connections": len(self), "sessions": len(self._sessions), "evicted": self.evicted}
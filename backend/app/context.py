@@ -0,0 +1,138 @@
+import math
+from typing import Dict, Iterable, Optional
+
+from .models import ChatSession, Bot
+from .history_buffer import EncodedHistory, HistoryBuffer, history_buffer
+
+
+class HistoryWindow:
+    """The slice of a session's history selected for one upstream request"""
+
+    def __init__(self, chat_history: EncodedHistory, total: int, tokens: int, budget: int):
+        self.chat_history = chat_history
+        self.total = total
+        self.tokens = tokens
+        self.budget = budget
+
+    @property
+    def sent(self) -> int:
+        return len(self.chat_history)
+
+    @property
+    def trimmed(self) -> int:
+        return self.total - self.sent
+
+    def stats(self) -> Dict[str, int]:
+        """How much history was sent and how much was left out"""
+        return {
+            "total": self.total,
+            "sent": self.sent,
+            "trimmed": self.trimmed,
+            "tokens": self.tokens,
+            "budget": self.budget,
+        }
+
+    def headers(self) -> Dict[str, str]:
+        """Response headers describing how much history was sent"""
+        return {f"X-History-{key.title()}": str(value) for key, value in self.stats().items()}
+
+
+class ContextBudgeter:
+    """
+    Selects the most recent turns of a conversation that fit a token budget
+
+    Cost is estimated from character counts (chars_per_token=1 turns the
+    budget into a plain character budget). Pinned messages are always sent
+    and are paid for first; the remaining budget is filled with the longest
+    run of newest messages that fits.
+    """
+
+    def __init__(
+            self,
+            max_tokens: int = 2048,
+            chars_per_token: float = 4.0,
+            message_overhead: int = 4
+    ):
+        self.max_tokens = max_tokens
+        self.chars_per_token = chars_per_token
+        self.message_overhead = message_overhead
+
+    def cost(self, text: str) -> int:
+        """Estimated token cost of a piece of text"""
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def message_cost(self, sender: str, content: str) -> int:
+        """Estimated token cost of one chat_history entry"""
+        return self.message_overhead + self.cost(sender) + self.cost(content)
+
+    def window(
+            self,
+            buffer: HistoryBuffer,
+            budget: Optional[int] = None,
+            pinned: Iterable[int] = (),
+            reserve: int = 0,
+            floor: int = 0
+    ) -> HistoryWindow:
+        """
+        Pick the history to send upstream
+
+        Args:
+            buffer: Pre-encoded session history, oldest first
+            budget: Token budget overriding max_tokens
+            pinned: Indices of messages that must always be included
+            reserve: Tokens already spoken for (e.g. the new user message)
+            floor: Index the recent window may not reach below (e.g. already summarized turns)
+
+        Returns:
+            HistoryWindow with the selected entries in chronological order
+        """
+        budget = budget or self.max_tokens
+        total = len(buffer)
+
+        pinned_indices = sorted({i for i in pinned if 0 <= i < total})
+        pinned_costs = [(i, buffer.cost(i, i + 1)) for i in pinned_indices]
+        pinned_cost = sum(cost for _, cost in pinned_costs)
+        available = budget - reserve - pinned_cost
+
+        def suffix_cost(start: int) -> int:
+            # Pinned entries inside the suffix are already paid for
+            return buffer.cost(start) - sum(cost for i, cost in pinned_costs if i >= start)
+
+        # Suffix cost only grows as the window reaches further back, so bisect for its start
+        lo, hi = min(floor, total), total
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if suffix_cost(mid) <= available:
+                hi = mid
+            else:
+                lo = mid + 1
+        start = lo
+
+        ranges = [(i, i + 1) for i in pinned_indices if i < start] + [(start, total)]
+        return HistoryWindow(
+            EncodedHistory(buffer, ranges),
+            total,
+            pinned_cost + suffix_cost(start),
+            budget
+        )
+
+
+def session_budget(budgeter: ContextBudgeter, session: ChatSession, bot: Optional[Bot] = None) -> int:
+    """Resolve the token budget for a session: session override, then bot, then the budgeter's default"""
+    return session.context_budget or (bot.context_budget if bot else None) or budgeter.max_tokens
+
+
+def history_window(
+        budgeter: ContextBudgeter,
+        session: ChatSession,
+        user_message: str = "",
+        bot: Optional[Bot] = None
+) -> HistoryWindow:
+    """Select the history to send upstream for the next turn of a session"""
+    return budgeter.window(
+        history_buffer(session, budgeter.message_cost),
+        budget=session_budget(budgeter, session, bot),
+        pinned=session.pinned_messages,
+        reserve=budgeter.cost(user_message) + budgeter.cost(session.memory) + budgeter.message_overhead,
+        floor=session.memory_upto
+    )
@@ -1,23 +1,279 @@
-from typing import Dict
+from typing import Dict, Optional
+import asyncio
+import json
 import os
+import logging
+import tempfile
 from functools import lru_cache
 import backend.app.main as main_module
 from fastapi import HTTPException
+from redis.asyncio import Redis
+from redis.exceptions import RedisError
 
-from .models import ChatSession, Bot
+from .session_store import (
+    SessionStore,
+    BotStore,
+    InMemorySessionStore,
+    InMemoryBotStore,
+    SpillingSessionStore
+)
+from .sqlite_store import SqliteWriter, SqliteSessionStore, SqliteBotStore
+from .redis_store import (
+    EVENTS_CHANNEL,
+    TURNS_CHANNEL,
+    UNLOCK_CHANNEL,
+    WORKER_ID,
+    EventSubscriber,
+    RedisSessionStore,
+    RedisBotStore,
+    SharedSessionQueue,
+    connect
+)
+from .memory import MemoryCompactor, load_summarizer
+from .context import ContextBudgeter
+from .session_queue import SessionQueue
+from .connections import ConnectionManager
 
-chat_sessions: Dict[str, ChatSession] = {}
-bot_storage: Dict[str, Bot] = {}
+logger = logging.getLogger(__name__)
+
+chat_sessions: Optional[SessionStore] = None
+bot_storage: Optional[BotStore] = None
+sqlite_writer: Optional[SqliteWriter] = None
+memory_compactor: Optional[MemoryCompactor] = None
+context_budgeter: Optional[ContextBudgeter] = None
+session_queue = SessionQueue()
+connection_manager: Optional[ConnectionManager] = None
+redis_client: Optional[Redis] = None
+event_subscriber: Optional[EventSubscriber] = None
 
 
 @lru_cache()
 def get_settings():
     """Get application settings"""
     return {
-        "api_key": os.getenv("CHAI_API_KEY", "CR_14d43f2bf78b4b0590c2a8b87f354746")
+        "api_key": os.getenv("CHAI_API_KEY", "CR_14d43f2bf78b4b0590c2a8b87f354746"),
+        # Point at a local mock (backend/tools/mock_upstream.py) for offline load tests
+        "api_base_url": os.getenv("CHAI_API_BASE_URL"),
+        "session_store": os.getenv("CHAI_SESSION_STORE", "sqlite"),
+        # Shared by every worker when CHAI_SESSION_STORE=redis (see backend/tools/resp_server.py for a local stand-in)
+        "redis_url": os.getenv("CHAI_REDIS_URL", "redis://127.0.0.1:6379/0"),
+        "redis_lock_lease": float(os.getenv("CHAI_REDIS_LOCK_LEASE", "30")),
+        # How long a turn waits for a session another worker is busy with before failing with 503
+        "redis_lock_timeout": float(os.getenv("CHAI_REDIS_LOCK_TIMEOUT", "60")),
+        # Durable state lives outside the source tree unless pointed elsewhere
+        "data_dir": os.getenv(
+            "CHAI_DATA_DIR",
+            os.path.join(os.getenv("XDG_DATA_HOME", os.path.expanduser("~/.local/share")), "chai-chatbot")
+        ),
+        "database_path": os.getenv("CHAI_DATABASE_PATH"),
+        "spill_dir": os.getenv("CHAI_SPILL_DIR", os.path.join(tempfile.gettempdir(), "chai_sessions")),
+        "hot_max_sessions": int(os.getenv("CHAI_HOT_MAX_SESSIONS", "1000")),
+        "hot_max_bytes": int(os.getenv("CHAI_HOT_MAX_BYTES", str(64 * 1024 * 1024))),
+        "memory_summarizer": os.getenv("CHAI_MEMORY_SUMMARIZER", "extractive"),
+        "memory_compact_after": int(os.getenv("CHAI_MEMORY_COMPACT_AFTER", "40")),
+        "memory_keep_recent": int(os.getenv("CHAI_MEMORY_KEEP_RECENT", "12")),
+        "response_cache": os.getenv("CHAI_RESPONSE_CACHE", "false").lower() in ("1", "true", "yes"),
+        "response_cache_ttl": float(os.getenv("CHAI_RESPONSE_CACHE_TTL", "300")),
+        "response_cache_max_entries": int(os.getenv("CHAI_RESPONSE_CACHE_MAX_ENTRIES", "10000")),
+        "response_cache_max_bytes": int(os.getenv("CHAI_RESPONSE_CACHE_MAX_BYTES", str(32 * 1024 * 1024))),
+        "response_cache_history_turns": int(os.getenv("CHAI_RESPONSE_CACHE_HISTORY_TURNS", "4")),
+        "upstream_rate": float(os.getenv("CHAI_UPSTREAM_RATE", "10")),
+        "upstream_min_rate": float(os.getenv("CHAI_UPSTREAM_MIN_RATE", "0.5")),
+        "upstream_max_rate": float(os.getenv("CHAI_UPSTREAM_MAX_RATE", "100")),
+        "upstream_burst": float(os.getenv("CHAI_UPSTREAM_BURST", "10")),
+        "upstream_max_wait": float(os.getenv("CHAI_UPSTREAM_MAX_WAIT", "10")),
+        "circuit_failure_threshold": int(os.getenv("CHAI_CIRCUIT_FAILURE_THRESHOLD", "5")),
+        "circuit_recovery_time": float(os.getenv("CHAI_CIRCUIT_RECOVERY_TIME", "30")),
+        # Percentile of recent upstream latency after which to hedge (e.g. 95); unset disables hedging
+        "hedge_percentile": float(os.environ["CHAI_HEDGE_PERCENTILE"]) if os.getenv("CHAI_HEDGE_PERCENTILE") else None,
+        "hedge_min_delay": float(os.getenv("CHAI_HEDGE_MIN_DELAY", "0.05")),
+        # File path or Zipkin-compatible collector URL to export request traces to; unset disables export
+        "trace_export": os.getenv("CHAI_TRACE_EXPORT"),
+        "trace_sample_rate": float(os.getenv("CHAI_TRACE_SAMPLE_RATE", "1.0")),
+        "ws_max_queue": int(os.getenv("CHAI_WS_MAX_QUEUE", "256")),
+        "ws_send_timeout": float(os.getenv("CHAI_WS_SEND_TIMEOUT", "5")),
+        "ws_ping_interval": float(os.getenv("CHAI_WS_PING_INTERVAL", "20")),
+        "ws_ping_timeout": float(os.getenv("CHAI_WS_PING_TIMEOUT", "60")),
+        # Default token budget for the history sent upstream; sessions and bots may override it
+        "context_budget": int(os.getenv("CHAI_CONTEXT_BUDGET", "2048")),
+        "context_chars_per_token": float(os.getenv("CHAI_CONTEXT_CHARS_PER_TOKEN", "4"))
     }
 
 
+def init_stores():
+    """Create the session and bot stores selected by CHAI_SESSION_STORE (sqlite, spill, memory or redis)"""
+    global chat_sessions, bot_storage, sqlite_writer, redis_client, session_queue
+    if chat_sessions is not None:
+        return
+
+    settings = get_settings()
+    if settings["session_store"] == "sqlite":
+        database_path = settings["database_path"] or os.path.join(settings["data_dir"], "chai_chat.db")
+        os.makedirs(os.path.dirname(os.path.abspath(database_path)), exist_ok=True)
+        sqlite_writer = SqliteWriter(database_path)
+        chat_sessions = SqliteSessionStore(
+            sqlite_writer,
+            max_sessions=settings["hot_max_sessions"],
+            max_bytes=settings["hot_max_bytes"]
+        )
+        bot_storage = SqliteBotStore(sqlite_writer)
+    elif settings["session_store"] == "spill":
+        chat_sessions = SpillingSessionStore(
+            settings["spill_dir"],
+            max_sessions=settings["hot_max_sessions"],
+            max_bytes=settings["hot_max_bytes"]
+        )
+        bot_storage = InMemoryBotStore()
+    elif settings["session_store"] == "memory":
+        chat_sessions = InMemorySessionStore()
+        bot_storage = InMemoryBotStore()
+    elif settings["session_store"] == "redis":
+        # The only store several workers can share; turns also lock their session in Redis
+        redis_client = connect(settings["redis_url"])
+        chat_sessions = RedisSessionStore(
+            redis_client,
+            max_sessions=settings["hot_max_sessions"],
+            max_bytes=settings["hot_max_bytes"]
+        )
+        bot_storage = RedisBotStore(redis_client)
+        session_queue = SharedSessionQueue(
+            redis_client,
+            lease=settings["redis_lock_lease"],
+            lock_timeout=settings["redis_lock_timeout"]
+        )
+    else:
+        raise ValueError(f"Unknown session store: {settings['session_store']}")
+
+    logger.info(f"Session store initialized: {settings['session_store']}")
+
+
+async def close_stores():
+    """Flush pending writes and release the stores"""
+    global chat_sessions, bot_storage, sqlite_writer, redis_client, session_queue
+    if chat_sessions is not None:
+        chat_sessions.close()
+        bot_storage.close()
+    if sqlite_writer is not None:
+        sqlite_writer.close()
+    if redis_client is not None:
+        await redis_client.aclose()
+        session_queue = SessionQueue()
+    chat_sessions = bot_storage = sqlite_writer = redis_client = None
+
+
+def _deliver_turn(data: bytes):
+    event = json.loads(data)
+    if event["origin"] != WORKER_ID:
+        get_connection_manager().deliver(event["session_id"], event["frame"])
+
+
+async def _publish_turn(session_id: str, frame: Dict):
+    try:
+        await redis_client.publish(TURNS_CHANNEL, json.dumps({
+            "origin": WORKER_ID,
+            "session_id": session_id,
+            "frame": frame
+        }))
+    except RedisError as e:
+        # The turn is already committed; only other workers' sockets miss it
+        logger.warning(f"Could not publish turn on session {session_id}: {e}")
+
+
+async def start_event_bus():
+    """With the redis store, load the shared session summaries and subscribe to the other workers' changes, turns and lock releases"""
+    global event_subscriber
+    if redis_client is None or event_subscriber is not None:
+        return
+    # Fails startup if Redis is unreachable
+    await chat_sessions.load_summaries()
+    event_subscriber = EventSubscriber(
+        get_settings()["redis_url"],
+        {
+            EVENTS_CHANNEL: chat_sessions.handle_event,
+            TURNS_CHANNEL: _deliver_turn,
+            UNLOCK_CHANNEL: session_queue.handle_unlock
+        },
+        # Summaries published while unsubscribed were missed
+        on_subscribe=chat_sessions.load_summaries
+    )
+    event_subscriber.start()
+    get_connection_manager().publish = _publish_turn
+    try:
+        await asyncio.wait_for(event_subscriber.ready.wait(), 5)
+    except asyncio.TimeoutError:
+        logger.warning("Event bus not subscribed yet; other workers' changes may arrive late")
+
+
+async def stop_event_bus():
+    global event_subscriber
+    if event_subscriber is not None:
+        await event_subscriber.close()
+        event_subscriber = None
+    if connection_manager is not None:
+        connection_manager.publish = None
+
+
+def get_memory_compactor() -> Optional[MemoryCompactor]:
+    """Get the session memory compactor, or None when CHAI_MEMORY_SUMMARIZER=none"""
+    global memory_compactor
+    settings = get_settings()
+    if memory_compactor is None and settings["memory_summarizer"] != "none":
+        memory_compactor = MemoryCompactor(
+            load_summarizer(settings["memory_summarizer"]),
+            get_session_queue,
+            compact_after=settings["memory_compact_after"],
+            keep_recent=settings["memory_keep_recent"]
+        )
+    return memory_compactor
+
+
+async def close_memory_compactor():
+    """Stop the background compaction worker"""
+    global memory_compactor
+    if memory_compactor is not None:
+        await memory_compactor.close()
+        memory_compactor = None
+
+
+def get_context_budgeter() -> ContextBudgeter:
+    """Get the budgeter that trims history to the context budget"""
+    global context_budgeter
+    if context_budgeter is None:
+        settings = get_settings()
+        context_budgeter = ContextBudgeter(
+            max_tokens=settings["context_budget"],
+            chars_per_token=settings["context_chars_per_token"]
+        )
+    return context_budgeter
+
+
+def get_session_queue() -> SessionQueue:
+    """Get the per-session turn queue"""
+    return session_queue
+
+
+def get_connection_manager() -> ConnectionManager:
+    """Get the registry of open chat WebSockets"""
+    global connection_manager
+    if connection_manager is None:
+        settings = get_settings()
+        connection_manager = ConnectionManager(
+            max_queue=settings["ws_max_queue"],
+            send_timeout=settings["ws_send_timeout"],
+            ping_interval=settings["ws_ping_interval"],
+            ping_timeout=settings["ws_ping_timeout"]
+        )
+    return connection_manager
+
+
+async def close_connection_manager():
+    """Close every open chat WebSocket"""
+    global connection_manager
+    if connection_manager is not None:
+        await connection_manager.close()
+        connection_manager = None
+
+
 def get_chai_client():
     """Get the global CHAI client instance"""
     if main_module.chai_client is None:
@@ -25,11 +281,15 @@ def get_chai_client():
     return main_module.chai_client
 
 
-def get_chat_sessions() -> Dict[str, ChatSession]:
+def get_chat_sessions() -> SessionStore:
     """Get the chat sessions storage"""
+    if chat_sessions is None:
+        init_stores()
     return chat_sessions
 
 
-def get_bot_storage() -> Dict[str, Bot]:
+def get_bot_storage() -> BotStore:
     """Get the bot storage"""
-    return bot_storage
\ No newline at end of file
+    if bot_storage is None:
+        init_stores()
+    return bot_storage
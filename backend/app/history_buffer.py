@@ -0,0 +1,112 @@
+import json
+from array import array
+from typing import Callable, Iterable, List, Optional, Tuple
+
+from .message_log import MessageLog
+from .models import ChatSession
+
+
+def encode_entry(sender: str, message: str) -> bytes:
+    """Encode one chat_history entry exactly as it appears in the upstream body"""
+    return json.dumps({"sender": sender, "message": message}, ensure_ascii=False).encode("utf-8")
+
+
+class EncodedHistory:
+    """
+    A selection of entries from a HistoryBuffer, ready to splice into a request body
+
+    Only entry ranges are held; the bytes are read out of the (append-only)
+    buffer when the body is built, so no slice of it is pinned across an await.
+    """
+
+    def __init__(self, buffer: "HistoryBuffer", ranges: List[Tuple[int, int]]):
+        self.buffer = buffer
+        self.ranges = [(start, end) for start, end in ranges if end > start]
+
+    def __len__(self) -> int:
+        return sum(end - start for start, end in self.ranges)
+
+    def join(self, *suffix: bytes) -> bytes:
+        """The comma-separated entries followed by any extra encoded entries"""
+        parts = [self.buffer.slice(start, end) for start, end in self.ranges]
+        if suffix:
+            parts.extend(suffix)
+        elif parts:
+            # Entries are stored comma-terminated; drop the final separator
+            parts[-1] = parts[-1][:-1]
+        joined = b"".join(parts)
+        for part in parts:
+            if isinstance(part, memoryview):
+                part.release()
+        return joined
+
+    def tail(self, n: int) -> bytes:
+        """The last n selected entries, comma-terminated"""
+        parts = []
+        for start, end in reversed(self.ranges):
+            if n <= 0:
+                break
+            first = max(start, end - n)
+            parts.append(bytes(self.buffer.slice(first, end)))
+            n -= end - first
+        return b"".join(reversed(parts))
+
+    def to_list(self) -> List[dict]:
+        """Decode back into the plain list-of-dicts form"""
+        return json.loads(b"[" + self.join() + b"]")
+
+
+class HistoryBuffer:
+    """
+    Append-only, pre-encoded chat_history of one session
+
+    Each message is JSON-encoded once, when it is appended, into a single
+    contiguous bytearray. Entry offsets and running token costs are kept in
+    flat arrays, so any suffix of the history is one zero-copy slice and its
+    cost is a subtraction.
+    """
+
+    def __init__(self, cost: Callable[[str, str], int]):
+        self._cost = cost
+        self._data = bytearray()
+        self._offsets = array("Q", [0])
+        self._costs = array("Q", [0])
+        # The message log this buffer mirrors; a cleared session gets a new log
+        self.source: Optional[MessageLog] = None
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def append(self, sender: str, content: str):
+        """Encode and append one message"""
+        self._data += encode_entry(sender, content)
+        self._data += b","
+        self._offsets.append(len(self._data))
+        self._costs.append(self._costs[-1] + self._cost(sender, content))
+
+    def extend(self, entries: Iterable[Tuple[str, str]]):
+        for sender, content in entries:
+            self.append(sender, content)
+
+    def cost(self, start: int, end: Optional[int] = None) -> int:
+        """Total cost of entries [start, end)"""
+        end = len(self) if end is None else end
+        return self._costs[end] - self._costs[start]
+
+    def slice(self, start: int, end: Optional[int] = None) -> memoryview:
+        """Encoded entries [start, end) without copying"""
+        end = len(self) if end is None else end
+        return memoryview(self._data)[self._offsets[start]:self._offsets[end]]
+
+
+def history_buffer(session: ChatSession, cost: Callable[[str, str], int]) -> HistoryBuffer:
+    """Return the session's history buffer, encoding only messages it has not seen yet"""
+    buffer = session._history
+    if buffer is None or buffer.source is not session.messages or len(buffer) > len(session.messages):
+        buffer = HistoryBuffer(cost)
+        buffer.source = session.messages
+        session._history = buffer
+
+    if len(buffer) < len(session.messages):
+        buffer.extend(session.messages.entries(len(buffer)))
+    return buffer
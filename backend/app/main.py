@@ -1,18 +1,45 @@
 from fastapi import FastAPI, HTTPException, WebSocket, WebSocketDisconnect
 from fastapi.middleware.cors import CORSMiddleware
-from contextlib import asynccontextmanager
+from contextlib import aclosing, asynccontextmanager
 from typing import Dict
+import math
 import os
 import logging
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse
 from datetime import datetime
-
-from .chai_client import ChaiAPIClient
-from .models import (
-    ChatMessage,
-    ChatSession
+from pydantic import ValidationError
+
+# Import through the top-level "app" package, like the routers do, so that
+# module-level state and classes are shared with them rather than duplicated
+from app.chai_client import ChaiAPIClient
+from app.circuit_breaker import CircuitBreaker, CircuitOpenError
+from app.connections import Connection
+from app.rate_limiter import AdaptiveRateLimiter, RateLimitExceeded
+from app.redis_store import SessionLockTimeout
+from app.response_cache import ResponseCache
+from app.metrics import (
+    REGISTRY,
+    Gauge,
+    MetricsMiddleware,
+    websocket_messages
 )
+from app.models import SendMessageRequest
+from app import tracing
 from routers import chat
+from app import dependencies
+from app.dependencies import (
+    get_settings,
+    get_bot_storage,
+    get_chat_sessions,
+    get_connection_manager,
+    get_session_queue,
+    init_stores,
+    close_stores,
+    close_connection_manager,
+    start_event_bus,
+    stop_event_bus,
+    close_memory_compactor
+)
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,13 +55,49 @@ async def lifespan(app: FastAPI):
     # Startup
     global chai_client
     api_key = os.getenv("CHAI_API_KEY", "CR_14d43f2bf78b4b0590c2a8b87f354746")
-    chai_client = ChaiAPIClient(api_key)
+    settings = get_settings()
+    response_cache = None
+    if settings["response_cache"]:
+        response_cache = ResponseCache(
+            max_entries=settings["response_cache_max_entries"],
+            max_bytes=settings["response_cache_max_bytes"],
+            ttl=settings["response_cache_ttl"],
+            history_turns=settings["response_cache_history_turns"]
+        )
+    rate_limiter = AdaptiveRateLimiter(
+        rate=settings["upstream_rate"],
+        min_rate=settings["upstream_min_rate"],
+        max_rate=settings["upstream_max_rate"],
+        burst=settings["upstream_burst"],
+        max_wait=settings["upstream_max_wait"]
+    )
+    circuit_breaker = CircuitBreaker(
+        failure_threshold=settings["circuit_failure_threshold"],
+        recovery_time=settings["circuit_recovery_time"]
+    )
+    chai_client = ChaiAPIClient(
+        api_key,
+        base_url=settings["api_base_url"],
+        response_cache=response_cache,
+        rate_limiter=rate_limiter,
+        circuit_breaker=circuit_breaker,
+        hedge_percentile=settings["hedge_percentile"],
+        hedge_min_delay=settings["hedge_min_delay"]
+    )
     await chai_client.initialize()
     logger.info("CHAI API client initialized")
+    init_stores()
+    await start_event_bus()
+    tracing.configure(settings["trace_export"], settings["trace_sample_rate"])
     yield
     # Shutdown
+    await stop_event_bus()
+    await close_connection_manager()
+    await tracing.close()
+    await close_memory_compactor()
     await chai_client.close()
     logger.info("CHAI API client closed")
+    await close_stores()
 
 
 # Create FastAPI app
@@ -54,9 +117,78 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# In-memory storage for sessions (replace with Redis in production)
-chat_sessions: Dict[str, ChatSession] = {}
-active_connections: Dict[str, WebSocket] = {}
+app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(MetricsMiddleware)
+
+
+def _connector_pool():
+    """Connections the upstream client's aiohttp connector has in use, idle, and may open"""
+    connector = chai_client.session.connector if chai_client and chai_client.session else None
+    if connector is None:
+        return None
+    return {("limit",): connector.limit, **_connector_usage(connector)}
+
+
+def _connector_usage(connector) -> Dict:
+    """
+    In-use and idle connection counts, read from aiohttp internals
+
+    aiohttp has no public API for these. BaseConnector keeps them in
+    _acquired and _conns (unchanged through 3.x); if a release renames
+    either, the gauge reports only the limit rather than wrong counts.
+    """
+    acquired = getattr(connector, "_acquired", None)
+    conns = getattr(connector, "_conns", None)
+    if acquired is None or conns is None:
+        return {}
+    return {
+        ("in_use",): len(acquired),
+        ("idle",): sum(len(idle) for idle in conns.values()),
+    }
+
+
+def _upstream_stat(*path):
+    """Gauge callback reading a figure out of ChaiAPIClient.stats()"""
+    def read():
+        if chai_client is None:
+            return None
+        value = chai_client.stats()
+        for key in path:
+            value = value[key]
+        return value
+    return read
+
+
+# Read at scrape time, so they cost nothing on the request path
+Gauge("chai_websocket_connections", "Open chat WebSocket connections", callback=lambda: len(get_connection_manager()))
+Gauge("chai_websocket_evictions", "Chat WebSockets dropped as slow or silent consumers",
+      callback=lambda: get_connection_manager().evicted)
+Gauge(
+    "chai_sessions",
+    "Chat sessions in the session store",
+    callback=lambda: len(dependencies.chat_sessions) if dependencies.chat_sessions is not None else None
+)
+Gauge(
+    "chai_sessions_hot",
+    "Chat sessions resident in memory",
+    callback=lambda: getattr(dependencies.chat_sessions, "hot_sessions", None)
+)
+Gauge(
+    "chai_sqlite_pending_writes",
+    "Writes queued for the SQLite writer thread",
+    callback=lambda: dependencies.sqlite_writer.pending if dependencies.sqlite_writer is not None else None
+)
+Gauge("chai_upstream_pool_connections", "Upstream connector pool", labels=("state",), callback=_connector_pool)
+Gauge("chai_upstream_rate_limit", "Current upstream request rate allowed, per second",
+      callback=_upstream_stat("rate_limiter", "rate"))
+Gauge("chai_upstream_rate_limit_waiting", "Callers queued for an upstream slot",
+      callback=_upstream_stat("rate_limiter", "waiting"))
+Gauge("chai_upstream_throttled", "429 responses seen from the upstream",
+      callback=_upstream_stat("rate_limiter", "throttled"))
+Gauge("chai_upstream_circuit_open", "1 while the upstream circuit breaker is not closed",
+      callback=lambda: None if chai_client is None else int(chai_client.circuit_breaker.state != "closed"))
+Gauge("chai_upstream_hedges", "Hedged upstream requests fired", callback=_upstream_stat("hedges"))
+Gauge("chai_upstream_hedge_wins", "Hedged upstream requests that answered first", callback=_upstream_stat("hedge_wins"))
 
 # Root endpoint
 @app.get("/")
@@ -76,7 +208,19 @@ async def root():
 # Health check
 @app.get("/health")
 async def health_check():
-    return {"status": "healthy", "timestamp": datetime.utcnow()}
+    health = {"status": "healthy", "timestamp": datetime.utcnow()}
+    if chai_client is not None:
+        health["upstream"] = chai_client.stats()
+        if chai_client.response_cache is not None:
+            health["response_cache"] = chai_client.response_cache.stats()
+    health["websockets"] = get_connection_manager().stats()
+    return health
+
+
+# Prometheus scrape endpoint
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
 
 
 # Include routers
@@ -87,65 +231,136 @@ app.include_router(chat.router, prefix="/api/chat", tags=["chat"])
 # WebSocket endpoint for real-time chat
 @app.websocket("/ws/chat/{session_id}")
 async def websocket_chat(websocket: WebSocket, session_id: str):
-    await websocket.accept()
-    active_connections[session_id] = websocket
+    connections = get_connection_manager()
+    connection = await connections.connect(websocket, session_id)
 
     try:
         while True:
             # Receive message from client
             data = await websocket.receive_json()
+            connection.seen()
 
-            # Get session
-            if session_id not in chat_sessions:
-                await websocket.send_json({
-                    "error": "Session not found"
-                })
+            if data.get("type") == "pong":
+                continue
+            if data.get("type") == "ping":
+                connection.offer({"type": "pong"})
                 continue
 
-            session = chat_sessions[session_id]
-
-            # Send to CHAI API
-            chai_response = await chai_client.send_message({
-                "prompt": session.prompt,
-                "bot_name": session.bot_name,
-                "user_name": session.user_name,
-                "chat_history": [
-                    {"sender": msg.sender, "message": msg.content}
-                    for msg in session.messages
-                ],
-                "memory": ""
-            }, user_message=data["message"])
-
-            # Update session history
-            session.messages.append(ChatMessage(
-                sender=session.user_name,
-                content=data["message"],
-                timestamp=datetime.utcnow()
-            ))
-            session.messages.append(ChatMessage(
-                sender=session.bot_name,
-                content=chai_response["response"],
-                timestamp=datetime.utcnow()
-            ))
-
-            # Send response back
-            await websocket.send_json({
-                "sender": session.bot_name,
-                "message": chai_response["response"],
-                "timestamp": datetime.utcnow().isoformat()
-            })
+            connection.busy += 1
+            try:
+                await _websocket_turn(connection, data)
+            finally:
+                connection.busy -= 1
+                connection.seen()
 
     except WebSocketDisconnect:
-        del active_connections[session_id]
         logger.info(f"WebSocket disconnected for session {session_id}")
     except Exception as e:
         logger.error(f"WebSocket error: {e}")
-        await websocket.close()
-        if session_id in active_connections:
-            del active_connections[session_id]
+    finally:
+        await connections.disconnect(connection)
+
+
+class _ConsumerGone(Exception):
+    """The socket running a turn was evicted or closed before the reply was delivered"""
+
+
+async def _websocket_turn(connection: Connection, data: Dict):
+    """Run one turn sent over a WebSocket, through the same store and queue as the REST endpoints"""
+    connections = get_connection_manager()
+    session_id = connection.session_id
+
+    async def send(frame: Dict):
+        if not await connections.send(connection, frame):
+            raise _ConsumerGone()
+
+    async def fail(error: str, **extra):
+        await send({"type": "error", "error": error, **extra})
+
+    try:
+        message = SendMessageRequest(session_id=session_id, message=data.get("message", "")).message
+    except ValidationError as e:
+        await fail(e.errors()[0]["msg"])
+        return
+
+    sessions = get_chat_sessions()
+    stream = bool(data.get("stream"))
+    try:
+        # Share the REST endpoints' per-session ordering so turns never interleave
+        async with get_session_queue().turn(session_id):
+            try:
+                session = await sessions.load(session_id)
+            except KeyError:
+                await fail("Session not found")
+                return
+            if not session.is_active:
+                await fail("Session is not active")
+                return
+
+            window = await chat.build_history_window(session, message, get_bot_storage())
+            request_data = {
+                "prompt": session.prompt,
+                "bot_name": session.bot_name,
+                "user_name": session.user_name,
+                "chat_history": window.chat_history,
+                "memory": session.memory
+            }
+
+            try:
+                if stream:
+                    # Relay chunks as they arrive; history is only committed once the stream completes
+                    chunks = []
+                    async with aclosing(chai_client.stream_message(request_data, user_message=message)) as reply:
+                        async for chunk in reply:
+                            chunks.append(chunk)
+                            await send({"type": "chunk", "delta": chunk})
+                    bot_reply = "".join(chunks)
+                else:
+                    chai_response = await chai_client.send_message(request_data, user_message=message)
+                    bot_reply = chai_response["response"]
+            except _ConsumerGone:
+                raise
+            except (RateLimitExceeded, CircuitOpenError) as e:
+                await fail(str(e), retry_after=math.ceil(e.retry_after))
+                return
+            except Exception as e:
+                logger.error(f"WebSocket turn error: {e}")
+                await fail(str(e))
+                return
+
+            bot_msg = await chat.commit_turn(sessions, session, message, bot_reply, origin=connection)
+
+        websocket_messages.inc()
+
+        # Send response back
+        frame = {
+            "sender": session.bot_name,
+            "message": bot_reply,
+            "timestamp": bot_msg.timestamp.isoformat(),
+            "history_trimmed": window.trimmed
+        }
+        if stream:
+            frame["type"] = "done"
+        await send(frame)
+    except SessionLockTimeout as e:
+        await connections.send(connection, {"type": "error", "error": str(e), "retry_after": math.ceil(e.retry_after)})
+    except _ConsumerGone:
+        logger.info(f"Dropped WebSocket turn for session {session_id}: client not reading")
 
 
 # Error handlers
+@app.exception_handler(SessionLockTimeout)
+async def session_lock_timeout_handler(request, exc):
+    return JSONResponse(
+        status_code=503,
+        content={
+            "error": str(exc),
+            "status_code": 503
+        },
+        headers={"Retry-After": str(math.ceil(exc.retry_after))}
+    )
+
+
 @app.exception_handler(HTTPException)
 async def http_exception_handler(request, exc):
     return JSONResponse(
@@ -153,7 +368,9 @@ async def http_exception_handler(request, exc):
         content={
             "error": exc.detail,
             "status_code": exc.status_code
-        }
+        },
+        # Carries Retry-After on 429s and 503s
+        headers=getattr(exc, "headers", None)
     )
 
 
@@ -0,0 +1,195 @@
+import asyncio
+import importlib
+import logging
+import math
+import re
+from collections import Counter
+from typing import Callable, List, Optional, Set, Tuple
+
+from .models import ChatMessage, ChatSession
+from .session_queue import SessionQueue
+from .session_store import SessionStore
+
+logger = logging.getLogger(__name__)
+
+_SENTENCE_SPLIT = re.compile(r"(?<=[.!?])\s+|\n+")
+_WORD = re.compile(r"[a-z0-9']+")
+_STOPWORDS = frozenset("""
+a about above after again all also am an and any are as at be because been before being below
+between both but by can could did do does doing down during each few for from further had has
+have having he her here hers herself him himself his how i if in into is it its itself just
+like me more most my myself no nor not now of off on once only or other our ours ourselves out
+over own really same she should so some such than that the their theirs them themselves then
+there these they this those through to too under until up very was we were what when where
+which while who whom why will with would you your yours yourself yourselves yeah yes ok okay
+""".split())
+
+
+class Summarizer:
+    """Condenses older turns of a conversation into a memory string"""
+
+    async def summarize(self, memory: str, messages: List[ChatMessage]) -> str:
+        """
+        Fold messages into an existing memory
+
+        Args:
+            memory: The session's current memory (may be empty)
+            messages: Turns being compacted, oldest first
+
+        Returns:
+            The new memory string
+        """
+        raise NotImplementedError
+
+
+class ExtractiveSummarizer(Summarizer):
+    """
+    Deterministic, offline summarizer that keeps the most salient sentences
+
+    Sentences from the previous memory and the compacted turns are scored
+    by the frequency of their content words across the whole batch; the
+    best ones are kept, in their original order, up to max_chars.
+    """
+
+    def __init__(self, max_chars: int = 1200):
+        self.max_chars = max_chars
+
+    async def summarize(self, memory: str, messages: List[ChatMessage]) -> str:
+        # Scoring is pure CPU work; keep it off the event loop
+        return await asyncio.to_thread(self.condense, memory, messages)
+
+    def condense(self, memory: str, messages: List[ChatMessage]) -> str:
+        candidates: List[Tuple[str, str]] = []
+        for line in memory.splitlines():
+            speaker, _, text = line.partition(": ")
+            if text:
+                candidates.append((speaker, text))
+        for message in messages:
+            for sentence in _SENTENCE_SPLIT.split(message.content):
+                sentence = sentence.strip()
+                if len(sentence) > 3:
+                    candidates.append((message.sender, sentence))
+
+        tokens = [
+            [w for w in _WORD.findall(text.lower()) if len(w) > 2 and w not in _STOPWORDS]
+            for _, text in candidates
+        ]
+        frequency = Counter(w for words in tokens for w in set(words))
+
+        def score(i: int) -> float:
+            words = set(tokens[i])
+            if not words:
+                return 0.0
+            return sum(frequency[w] for w in words) / math.sqrt(len(tokens[i]))
+
+        ranked = sorted(range(len(candidates)), key=lambda i: (-score(i), i))
+
+        kept: Set[int] = set()
+        used = 0
+        for i in ranked:
+            speaker, text = candidates[i]
+            size = len(speaker) + len(text) + 3
+            if used + size > self.max_chars:
+                continue
+            kept.add(i)
+            used += size
+
+        return "\n".join(f"{candidates[i][0]}: {candidates[i][1]}" for i in sorted(kept))
+
+
+def load_summarizer(spec: str) -> Summarizer:
+    """Build a summarizer from "extractive" or a "package.module:ClassName" import path"""
+    if spec == "extractive":
+        return ExtractiveSummarizer()
+    module_name, _, attr = spec.partition(":")
+    return getattr(importlib.import_module(module_name), attr)()
+
+
+class MemoryCompactor:
+    """
+    Background stage that rolls older turns of a session into its memory
+
+    Once more than compact_after messages have accumulated past the
+    session's memory_upto mark, everything except the newest keep_recent
+    messages is folded into session.memory. Requests then carry the memory
+    plus only the turns after memory_upto. Work is queued per session and
+    done by a single worker task, never on the request path.
+
+    Summarizing runs alongside the session's turns; only the result is
+    applied as a turn of its own, taken from the queue returned by
+    get_queue, so it never overwrites changes made meanwhile.
+    """
+
+    def __init__(
+            self,
+            summarizer: Summarizer,
+            get_queue: Callable[[], SessionQueue],
+            compact_after: int = 40,
+            keep_recent: int = 12
+    ):
+        self.summarizer = summarizer
+        self.get_queue = get_queue
+        self.compact_after = compact_after
+        self.keep_recent = keep_recent
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Set[str] = set()
+        self._worker: Optional[asyncio.Task] = None
+
+    def needs_compaction(self, session: ChatSession) -> bool:
+        return len(session.messages) - session.memory_upto > self.compact_after
+
+    def schedule(self, sessions: SessionStore, session: ChatSession):
+        """Queue a session for compaction if its uncompacted history has grown past the threshold"""
+        if not self.needs_compaction(session) or session.id in self._pending:
+            return
+        if self._worker is None or self._worker.done():
+            self._queue = asyncio.Queue()
+            self._worker = asyncio.create_task(self._run())
+        self._pending.add(session.id)
+        self._queue.put_nowait((sessions, session.id))
+
+    async def compact(self, sessions: SessionStore, session: ChatSession):
+        """Fold everything but the most recent turns of a session into its memory"""
+        start = session.memory_upto
+        upto = len(session.messages) - self.keep_recent
+        if upto <= start:
+            return
+
+        batch = session.messages[start:upto]
+        memory = await self.summarizer.summarize(session.memory, batch)
+
+        async with self.get_queue().turn(session.id):
+            # Apply to the session as it is now, unless it was deleted, cleared or compacted meanwhile
+            try:
+                session = await sessions.load(session.id)
+            except KeyError:
+                return
+            if (
+                    session.memory_upto != start
+                    or len(session.messages) < upto
+                    or session.messages[upto - 1] != batch[-1]
+            ):
+                return
+            session.memory = memory
+            session.memory_upto = upto
+            await sessions.save(session)
+        logger.info(f"Compacted {len(batch)} messages of session {session.id} into {len(memory)} chars of memory")
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+
+    async def _run(self):
+        while True:
+            sessions, session_id = await self._queue.get()
+            self._pending.discard(session_id)
+            try:
+                if session_id in sessions:
+                    await self.compact(sessions, await sessions.load(session_id))
+            except Exception as e:
+                logger.error(f"Memory compaction failed for session {session_id}: {e}")
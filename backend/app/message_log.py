@@ -0,0 +1,151 @@
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+
+
+def _to_micros(timestamp: datetime) -> int:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    return (timestamp - EPOCH) // _MICROSECOND
+
+
+class MessageLog:
+    """
+    Columnar storage for one session's messages
+
+    Instead of one ChatMessage (and its dict, datetime and str objects) per
+    message, a session's history is kept in a few flat columns: a small
+    per-log table of interned sender names plus an array of indices into it,
+    timestamps as integer microseconds, message text as UTF-8 in one
+    contiguous bytearray addressed by an offsets array, and metadata only
+    for the messages that have any.
+
+    It behaves like the list it replaces: len(), iteration, indexing and
+    slicing work, and append/extend take ChatMessage objects. Indexing and
+    iteration materialize ChatMessage objects on the fly, so that only
+    happens at the API boundary; internal readers use sender(), content()
+    and entries() instead.
+    """
+
+    __slots__ = ("_senders", "_sender_index", "_sender_ids", "_timestamps", "_arena", "_offsets", "_metadata")
+
+    def __init__(self, messages: Iterable = ()):
+        self._senders: List[str] = []
+        self._sender_index: Dict[str, int] = {}
+        self._sender_ids = array("H")
+        self._timestamps = array("q")
+        self._arena = bytearray()
+        self._offsets = array("Q", [0])
+        self._metadata: Dict[int, Dict[str, Any]] = {}
+        self.extend(messages)
+
+    def __len__(self) -> int:
+        return len(self._timestamps)
+
+    def add(self, sender: str, content: str, timestamp: datetime, metadata: Optional[Dict[str, Any]] = None):
+        """Append one message from its fields"""
+        sender_id = self._sender_index.get(sender)
+        if sender_id is None:
+            sender_id = self._sender_index[sender] = len(self._senders)
+            self._senders.append(sender)
+        if metadata:
+            self._metadata[len(self)] = metadata
+        self._sender_ids.append(sender_id)
+        self._timestamps.append(_to_micros(timestamp))
+        self._arena += content.encode("utf-8")
+        self._offsets.append(len(self._arena))
+
+    def append(self, message):
+        self.add(message.sender, message.content, message.timestamp, message.metadata)
+
+    def extend(self, messages: Iterable):
+        for message in messages:
+            self.append(message)
+
+    def sender(self, index: int) -> str:
+        return self._senders[self._sender_ids[index]]
+
+    def content(self, index: int) -> str:
+        index = self._index(index)
+        return self._arena[self._offsets[index]:self._offsets[index + 1]].decode("utf-8")
+
+    def timestamp(self, index: int) -> datetime:
+        return EPOCH + timedelta(microseconds=self._timestamps[index])
+
+    def metadata(self, index: int) -> Dict[str, Any]:
+        return self._metadata.get(self._index(index), {})
+
+    def entries(self, start: int = 0, end: Optional[int] = None) -> Iterator[Tuple[str, str]]:
+        """(sender, content) of messages [start, end), without building ChatMessage objects"""
+        end = len(self) if end is None else end
+        senders, sender_ids, arena, offsets = self._senders, self._sender_ids, self._arena, self._offsets
+        for i in range(start, end):
+            yield senders[sender_ids[i]], arena[offsets[i]:offsets[i + 1]].decode("utf-8")
+
+    def _index(self, index: int) -> int:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("message index out of range")
+        return index
+
+    def _message(self, index: int):
+        from .models import ChatMessage
+
+        # Every column was validated on the way in, so skip validating again
+        return ChatMessage.model_construct(
+            sender=self.sender(index),
+            content=self.content(index),
+            timestamp=self.timestamp(index),
+            metadata=dict(self.metadata(index)),
+            seq=index,
+        )
+
+    def __getitem__(self, index: Union[int, slice]):
+        if isinstance(index, slice):
+            return [self._message(i) for i in range(*index.indices(len(self)))]
+        return self._message(self._index(index))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self._message(i)
+
+    def __repr__(self) -> str:
+        return f"MessageLog({len(self)} messages)"
+
+    @property
+    def nbytes(self) -> int:
+        """Approximate resident size of the log's columns"""
+        return (
+            self._sender_ids.itemsize * len(self._sender_ids)
+            + self._timestamps.itemsize * len(self._timestamps)
+            + self._offsets.itemsize * len(self._offsets)
+            + len(self._arena)
+            + sum(64 + len(sender) for sender in self._senders)
+            + 256 * len(self._metadata)
+        )
+
+    @classmethod
+    def __get_pydantic_core_schema__(cls, source, handler):
+        """Validate and serialize as a list of ChatMessage, so the API shape is unchanged"""
+        from pydantic_core import core_schema
+        from .models import ChatMessage
+
+        list_schema = handler.generate_schema(List[ChatMessage])
+
+        def validate(value, validate_list):
+            if isinstance(value, cls):
+                return value
+            return cls(validate_list(value))
+
+        return core_schema.no_info_wrap_validator_function(
+            validate,
+            list_schema,
+            serialization=core_schema.plain_serializer_function_ser_schema(
+                lambda log: log[:],
+                return_schema=list_schema
+            )
+        )
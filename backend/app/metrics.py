@@ -0,0 +1,252 @@
+import bisect
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+# Latency buckets in seconds, from fast in-memory routes up to full upstream timeouts
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _format_value(value: float) -> str:
+    if value == math.inf:
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), registry: Optional["Registry"] = None):
+        self.name = name
+        self.help = help
+        self.label_names = tuple(labels)
+        self._children: Dict[Tuple[str, ...], object] = {}
+        (registry or REGISTRY).register(self)
+        if not self.label_names:
+            # Unlabelled metrics are exported as zero before their first update
+            self.labels()
+
+    def labels(self, *values: str):
+        """The child for one combination of label values, created on first use"""
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _samples(self) -> Iterable[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self._samples())
+        return "\n".join(lines)
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def dec(self, amount: float = 1.0):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    """Monotonically increasing count"""
+
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            yield f"{self.name}{_format_labels(self.label_names, values)} {_format_value(child.value)}"
+
+
+class Gauge(_Metric):
+    """
+    Value that can go up and down
+
+    With a callback, the value is read when the metrics are rendered
+    instead of being maintained on the hot path. The callback returns a
+    number, or a dict of label-values tuple -> number.
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), callback: Optional[Callable] = None, **kwargs):
+        self.callback = callback
+        super().__init__(name, help, labels, **kwargs)
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def _samples(self) -> Iterable[str]:
+        if self.callback is not None:
+            values = self.callback()
+            if values is None:
+                return
+            if not isinstance(values, dict):
+                values = {(): values}
+            for label_values, value in values.items():
+                yield f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(value)}"
+            return
+        for label_values, child in self._children.items():
+            yield f"{self.name}{_format_labels(self.label_names, label_values)} {_format_value(child.value)}"
+
+
+class _HistogramValue:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        # One slot per bucket plus +Inf; made cumulative only when rendered
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Distribution of observations over fixed buckets"""
+
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS, **kwargs):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labels, **kwargs)
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value: float):
+        self.labels().observe(value)
+
+    def _samples(self) -> Iterable[str]:
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + (math.inf,), child.counts):
+                cumulative += count
+                le = f'le="{_format_value(bound)}"'
+                yield f"{self.name}_bucket{_format_labels(self.label_names, values, le)} {cumulative}"
+            labels = _format_labels(self.label_names, values)
+            yield f"{self.name}_sum{labels} {_format_value(child.sum)}"
+            yield f"{self.name}_count{labels} {child.count}"
+
+
+class Registry:
+    """Set of metrics rendered together in the Prometheus text format"""
+
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric):
+        self._metrics.append(metric)
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+
+REGISTRY = Registry()
+
+# Hot-path metrics; everything else is read through gauge callbacks at scrape time
+http_request_duration = Histogram(
+    "chai_http_request_duration_seconds",
+    "Time to handle an HTTP request, by route template",
+    labels=("method", "route", "status")
+)
+upstream_request_duration = Histogram(
+    "chai_upstream_request_duration_seconds",
+    "Time for one upstream CHAI API attempt, by response status",
+    labels=("kind", "status")
+)
+upstream_retries = Counter(
+    "chai_upstream_retries_total",
+    "Upstream attempts retried, by reason",
+    labels=("reason",)
+)
+messages_appended = Counter(
+    "chai_messages_appended_total",
+    "Chat messages appended to session histories"
+)
+websocket_messages = Counter(
+    "chai_websocket_messages_total",
+    "WebSocket chat turns handled"
+)
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request against its route template"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        status = 500
+
+        async def send_with_status(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            http_request_duration.labels(
+                scope["method"],
+                route_template(scope),
+                str(status)
+            ).observe(time.perf_counter() - started)
+
+
+def route_template(scope) -> str:
+    """The matched route's path template, with {name} for each parameter, to keep label cardinality bounded"""
+    route = scope.get("route")
+    if route is None:
+        return "unmatched"
+    # Newer FastAPI versions match an included router's routes against the path
+    # after its prefix, leaving the prefix out of route.path; put it back
+    path, start = scope["path"], 0
+    while start != -1 and not route.path_regex.match(path[start:]):
+        start = path.find("/", start + 1)
+    return path[:max(start, 0)] + route.path
@@ -1,9 +1,12 @@
-from pydantic import BaseModel, Field, validator
+from pydantic import BaseModel, Field, PrivateAttr, validator
 from typing import List, Optional, Dict, Any
 from datetime import datetime
 from enum import Enum
 import uuid
 
+from .message_log import MessageLog
+from .prompts import registry as prompt_registry
+
 
 class PersonalityType(str, Enum):
     FRIENDLY = "friendly"
@@ -22,6 +25,8 @@ class ChatMessage(BaseModel):
     content: str
     timestamp: datetime = Field(default_factory=datetime.utcnow)
     metadata: Optional[Dict[str, Any]] = {}
+    # Position in the session's history; set when read back from a session
+    seq: Optional[int] = None
 
 
 class ChatHistory(BaseModel):
@@ -35,11 +40,26 @@ class ChatSession(BaseModel):
     user_name: str = "User"
     prompt: str
     personality: PersonalityType = PersonalityType.FRIENDLY
-    messages: List[ChatMessage] = []
+    # Columnar; serialized as a list of ChatMessage
+    messages: MessageLog = Field(default_factory=MessageLog)
     created_at: datetime = Field(default_factory=datetime.utcnow)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
     metadata: Optional[Dict[str, Any]] = {}
+    bot_id: Optional[str] = None
+    context_budget: Optional[int] = None
+    pinned_messages: List[int] = []
+    # Rolling summary of messages[:memory_upto], sent upstream as "memory"
+    memory: str = ""
+    memory_upto: int = 0
+
+    # Pre-encoded chat_history (see app.history_buffer); never serialized
+    _history: Any = PrivateAttr(default=None)
+
+    @validator('prompt')
+    def intern_prompt(cls, v):
+        # Sessions of one persona share a single copy of its prompt
+        return prompt_registry.intern(v)
 
 
 class CreateChatRequest(BaseModel):
@@ -48,6 +68,8 @@ class CreateChatRequest(BaseModel):
     personality: PersonalityType = PersonalityType.FRIENDLY
     custom_prompt: Optional[str] = None
     custom_traits: Optional[List[str]] = None
+    bot_id: Optional[str] = None
+    context_budget: Optional[int] = Field(None, ge=1)
 
     @validator('bot_name', 'user_name')
     def validate_names(cls, v):
@@ -86,6 +108,11 @@ class Bot(BaseModel):
     custom_traits: Optional[List[str]] = []
     created_at: datetime = Field(default_factory=datetime.utcnow)
     is_active: bool = True
+    context_budget: Optional[int] = None
+
+    @validator('prompt')
+    def intern_prompt(cls, v):
+        return prompt_registry.intern(v)
 
 
 class CreateBotRequest(BaseModel):
@@ -93,6 +120,7 @@ class CreateBotRequest(BaseModel):
     personality: PersonalityType
     custom_prompt: Optional[str] = None
     custom_traits: Optional[List[str]] = []
+    context_budget: Optional[int] = Field(None, ge=1)
 
     @validator('name')
     def validate_name(cls, v):
@@ -106,12 +134,38 @@ class CreateBotRequest(BaseModel):
 class SessionListResponse(BaseModel):
     sessions: List[ChatSession]
     total: int
+    # Pass as ?cursor= to fetch the next page; None on the last page
+    next_cursor: Optional[str] = None
+
+
+class SessionSummary(BaseModel):
+    """A session as shown in a session list: names, counts and a preview, but no message bodies"""
+    id: str
+    bot_name: str
+    user_name: str
+    personality: PersonalityType
+    bot_id: Optional[str] = None
+    is_active: bool = True
+    message_count: int = 0
+    last_message_preview: Optional[str] = None
+    last_message_sender: Optional[str] = None
+    last_message_at: Optional[datetime] = None
+    created_at: datetime
+    updated_at: datetime
+
+
+class SessionSummaryListResponse(BaseModel):
+    sessions: List[SessionSummary]
+    total: int
+    next_cursor: Optional[str] = None
 
 
 class MessageListResponse(BaseModel):
     messages: List[ChatMessage]
     session_id: str
     total: int
+    has_earlier: bool = False
+    has_later: bool = False
 
 
 class ErrorResponse(BaseModel):
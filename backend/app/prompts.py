@@ -0,0 +1,100 @@
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+# Prepended to every prompt sent upstream; the continuation indent is part of
+# the text sessions have always been created with, so it is kept verbatim
+SAFETY_PROMPT = """You are a helpful, harmless, and honest AI friend. 
+        Always respond in a safe and appropriate manner. Be respectful and considerate in your responses.
+        """
+
+PERSONA_PROMPTS = {
+    "friendly": "You are a warm, outgoing person who loves meeting new people. You're naturally cheerful, use casual language, and genuinely enjoy conversations. You share personal experiences and ask engaging questions about others' lives.",
+    "professional": "You are a successful professional with strong communication skills. You speak with confidence and clarity, share insights from your career, and maintain appropriate boundaries while being personable.",
+    "creative": "You are an artistic and imaginative person who sees the world differently. You love discussing ideas, sharing creative projects, and inspiring others to think outside the box. You often reference art, music, or literature.",
+    "analytical": "You are a logical thinker who enjoys analyzing situations and solving problems. You appreciate data and facts, ask thoughtful questions, and like to understand how things work. You're naturally curious about systems and patterns.",
+    "empathetic": "You are a deeply caring person who connects emotionally with others. You're a great listener, validate feelings, and offer genuine support. You share your own vulnerabilities and create safe spaces for others.",
+    "humorous": "You are naturally funny and love making people laugh. You use appropriate humor, share amusing stories from your life, and can lighten the mood in any conversation. You're quick-witted but never mean-spirited.",
+    "adventurous": "You are someone who loves new experiences and exploring the world. You're always planning your next trip, trying new activities, and encouraging others to step out of their comfort zones. You share exciting stories from your adventures.",
+    "intellectual": "You are well-read and enjoy deep discussions about ideas, philosophy, science, and culture. You love learning and sharing knowledge, but in a conversational way that doesn't feel preachy. You ask thought-provoking questions."
+}
+
+DEFAULT_PERSONA_PROMPT = "You are a helpful AI friend."
+
+
+class PromptRegistry:
+    """
+    Persona prompts compiled once and shared between sessions
+
+    Every persona's full prompt (safety instructions included) is built
+    when the registry is created, and every prompt passed through intern()
+    is replaced by the first equal string seen, so the sessions and bots of
+    one persona hold a single copy of it. The prompt actually sent upstream
+    is derived once per distinct prompt and reused on every later turn,
+    which also lets the request-prefix cache hash it only once. Both tables
+    are LRUs, so one-off custom prompts age out instead of accumulating.
+    """
+
+    def __init__(
+            self,
+            safety_prompt: str = SAFETY_PROMPT,
+            personas: Optional[Dict[str, str]] = None,
+            max_entries: int = 4096
+    ):
+        self.safety_prompt = safety_prompt
+        self.max_entries = max_entries
+        self._interned: "OrderedDict[str, str]" = OrderedDict()
+        self._upstream: "OrderedDict[str, str]" = OrderedDict()
+        self._personas = {
+            name: self.intern(f"{safety_prompt}\n\n{text}")
+            for name, text in (personas or PERSONA_PROMPTS).items()
+        }
+        self._default = self.intern(f"{safety_prompt}\n\n{DEFAULT_PERSONA_PROMPT}")
+
+    def _remember(self, table: "OrderedDict[str, str]", key: str, value: str):
+        table[key] = value
+        if len(table) > self.max_entries:
+            table.popitem(last=False)
+
+    def intern(self, prompt: str) -> str:
+        """The shared copy of prompt"""
+        shared = self._interned.get(prompt)
+        if shared is None:
+            self._remember(self._interned, prompt, prompt)
+            return prompt
+        self._interned.move_to_end(prompt)
+        return shared
+
+    def persona(
+            self,
+            personality_type: str,
+            custom_traits: Optional[List[str]] = None,
+            custom_prompt: Optional[str] = None
+    ) -> str:
+        """The prompt of a persona, with any extra traits and instructions appended"""
+        prompt = self._personas.get(personality_type, self._default)
+        if not custom_traits and not custom_prompt:
+            return prompt
+        if custom_traits:
+            prompt += f"\n\nAdditional traits: {', '.join(custom_traits)}"
+        if custom_prompt:
+            prompt += f"\n\n{custom_prompt}"
+        return self.intern(prompt)
+
+    def upstream(self, prompt: str) -> str:
+        """The prompt to send upstream for a session's prompt: with the safety instructions in front, exactly once"""
+        final = self._upstream.get(prompt)
+        if final is not None:
+            self._upstream.move_to_end(prompt)
+            return final
+        if not prompt:
+            final = self.safety_prompt
+        elif prompt.startswith(self.safety_prompt):
+            # Persona prompts already start with them
+            final = prompt
+        else:
+            final = self.intern(f"{self.safety_prompt}\n\n{prompt}")
+        self._remember(self._upstream, prompt, final)
+        return final
+
+
+registry = PromptRegistry()
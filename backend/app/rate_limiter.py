@@ -0,0 +1,145 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+
+
+class RateLimitExceeded(Exception):
+    """Raised when a caller would have to wait longer than the limiter allows"""
+
+    def __init__(self, retry_after: float):
+        super().__init__("Rate limit exceeded")
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header given either as seconds or as an HTTP date"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class AdaptiveRateLimiter:
+    """
+    Client-side token bucket whose rate adapts to upstream 429s (AIMD)
+
+    Callers queue for tokens in arrival order. The caller at the head of
+    the queue re-checks the bucket whenever it wakes, so a 429 holds back
+    everyone still queued rather than only later arrivals. Callers that
+    would wait longer than max_wait are refused with RateLimitExceeded. A
+    429 multiplies the rate by decrease (at most once per cooldown) and
+    pauses the bucket for Retry-After; every success probes the rate back
+    up additively.
+    """
+
+    def __init__(
+            self,
+            rate: float = 10.0,
+            min_rate: float = 0.5,
+            max_rate: float = 100.0,
+            burst: float = 10.0,
+            increase: float = 1.0,
+            decrease: float = 0.5,
+            cooldown: float = 1.0,
+            max_wait: float = 10.0
+    ):
+        self.rate = rate
+        self.min_rate = min_rate
+        self.max_rate = max_rate
+        self.burst = burst
+        self.increase = increase
+        self.decrease = decrease
+        self.cooldown = cooldown
+        self.max_wait = max_wait
+        self.tokens = burst
+        self.throttled = 0
+        self.rejected = 0
+        self.waiting = 0
+        self._lock = asyncio.Lock()
+        self._last = time.monotonic()
+        self._blocked_until = 0.0
+        self._last_decrease = float("-inf")
+
+    def _refill(self, now: float):
+        # Nothing accrues while the upstream has told us to back off
+        start = max(self._last, self._blocked_until)
+        if now > start:
+            self.tokens = min(self.burst, self.tokens + (now - start) * self.rate)
+        self._last = now
+
+    def _delay(self, now: float) -> float:
+        """How long until the next token can be taken"""
+        return max(0.0, self._blocked_until - now) + max(0.0, 1 - self.tokens) / self.rate
+
+    def _reject(self, wait: float):
+        self.rejected += 1
+        raise RateLimitExceeded(wait)
+
+    async def acquire(self):
+        """Wait for a slot to call the upstream"""
+        now = time.monotonic()
+        self._refill(now)
+        # Everyone already queued goes first
+        estimate = self._delay(now) + self.waiting / self.rate
+        if estimate > self.max_wait:
+            self._reject(estimate)
+        deadline = now + self.max_wait
+
+        self.waiting += 1
+        try:
+            try:
+                async with asyncio.timeout(self.max_wait):
+                    await self._lock.acquire()
+            except TimeoutError:
+                self._reject(self._delay(time.monotonic()) + self.waiting / self.rate)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._refill(now)
+                    delay = self._delay(now)
+                    if delay <= 0:
+                        self.tokens -= 1
+                        return
+                    if now + delay > deadline:
+                        self._reject(delay)
+                    await asyncio.sleep(delay)
+            finally:
+                self._lock.release()
+        finally:
+            self.waiting -= 1
+
+    def on_success(self):
+        """Additive increase: probe for more throughput"""
+        self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
+
+    def on_throttle(self, retry_after: Optional[float] = None):
+        """Multiplicative decrease, and pause the bucket for Retry-After"""
+        now = time.monotonic()
+        self._refill(now)
+        self.throttled += 1
+        if now - self._last_decrease >= self.cooldown:
+            self.rate = max(self.min_rate, self.rate * self.decrease)
+            self._last_decrease = now
+        pause = retry_after if retry_after is not None else 1 / self.rate
+        self._blocked_until = max(self._blocked_until, now + pause)
+        self.tokens = min(self.tokens, 0.0)
+
+    def stats(self) -> Dict:
+        return {
+            "rate": self.rate,
+            "tokens": self.tokens,
+            "waiting": self.waiting,
+            "throttled": self.throttled,
+            "rejected": self.rejected,
+        }
@@ -0,0 +1,583 @@
+import asyncio
+import itertools
+import json
+import logging
+import time
+import uuid
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import AsyncIterator, Awaitable, Callable, Dict, Iterator, List, Optional, Sequence, Tuple, Union
+
+from redis.asyncio import Redis
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
+from redis.exceptions import RedisError
+
+from .message_log import MessageLog
+from .models import ChatSession, ChatMessage, Bot, SessionSummary
+from .session_queue import SessionQueue
+from .session_store import (
+    BotStore,
+    SessionCache,
+    SessionIndex,
+    SessionStore,
+    estimate_messages_bytes,
+    summarize_session
+)
+
+logger = logging.getLogger(__name__)
+
+# Key layout shared by every worker
+SESSION_KEY = "chai:session:{}"      # hash: data (session JSON without messages), rev, epoch
+MESSAGES_KEY = "chai:messages:{}"    # list of message JSON, oldest first
+SUMMARIES_KEY = "chai:summaries"     # hash: session id -> SessionSummary JSON
+BOTS_KEY = "chai:bots"               # hash: bot id -> Bot JSON
+LOCK_KEY = "chai:lock:{}"            # string: token of the worker running the session's turn
+
+# Pub/sub channels
+EVENTS_CHANNEL = "chai:events"       # session summaries written or deleted
+TURNS_CHANNEL = "chai:turns"         # committed turns, for WebSockets held by other workers
+UNLOCK_CHANNEL = "chai:unlock"       # session locks released
+
+# Tags this process's publications so it can skip its own
+WORKER_ID = uuid.uuid4().hex
+
+# KEYS[1]: session hash; ARGV[1]: JSON list of commands, run only if the session still exists
+WRITE_SCRIPT = """
+if redis.call("EXISTS", KEYS[1]) == 0 then
+    return false
+end
+local replies = {}
+for i, command in ipairs(cjson.decode(ARGV[1])) do
+    replies[i] = redis.call(unpack(command))
+end
+return replies
+"""
+
+# KEYS[1]: lock; ARGV: token, lease in ms
+RENEW_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    return redis.call("PEXPIRE", KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+# KEYS[1]: lock; ARGV: token, channel and message announcing the release
+UNLOCK_SCRIPT = """
+if redis.call("GET", KEYS[1]) == ARGV[1] then
+    redis.call("DEL", KEYS[1])
+    redis.call("PUBLISH", ARGV[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+
+def connect(url: str, socket_timeout: Optional[float] = 5.0) -> Redis:
+    """
+    Client for the Redis (or Valkey, or tools.resp_server) at url
+
+    redis:// and rediss:// URLs are accepted, with credentials and the db
+    number taken from the URL. Commands are never retried after a dropped
+    connection: a transaction may already have been applied, and sending
+    it again would append its messages twice.
+    """
+    return Redis.from_url(
+        url,
+        socket_timeout=socket_timeout,
+        socket_connect_timeout=5.0,
+        retry=Retry(NoBackoff(), 0),
+        retry_on_error=[]
+    )
+
+
+def _message_json(message: ChatMessage) -> str:
+    return message.model_dump_json(exclude={"seq"})
+
+
+def _load_messages(log: MessageLog, rows: List[bytes]):
+    for row in rows:
+        message = json.loads(row)
+        log.add(
+            message["sender"],
+            message["content"],
+            datetime.fromisoformat(message["timestamp"]),
+            message.get("metadata")
+        )
+
+
+def _async_only(store: object, *methods: str):
+    raise TypeError(f"{type(store).__name__} is shared through Redis; use await {'/'.join(methods)}")
+
+
+class RedisSessionStore(SessionStore):
+    """
+    Session store shared by several worker processes through Redis
+
+    Each session is a hash of its fields plus a list of its messages. The
+    hash carries a revision, bumped by every write, and an epoch, bumped
+    when the history is cleared. Workers keep recently used sessions
+    materialized in a local LRU and revalidate them on every load with one
+    round trip for (rev, epoch, message count): an unchanged session is
+    served as is, one that only gained messages fetches just those, and
+    anything else is reloaded. Writes to an existing session run as one
+    script that does nothing if the session was deleted meanwhile.
+
+    Summaries are replicated into every worker, so session lists and
+    membership checks never touch Redis: they are loaded whole whenever
+    the event subscription is (re)established and kept current by the
+    events each write publishes on chai:events.
+
+    Every Redis call is awaited, so sessions are read with load() and
+    created and deleted with create() and delete(); item access and
+    assignment raise TypeError.
+    """
+
+    def __init__(
+            self,
+            client: Redis,
+            max_sessions: int = 1000,
+            max_bytes: int = 64 * 1024 * 1024
+    ):
+        super().__init__()
+        self.client = client
+        self._hot = SessionCache(max_sessions, max_bytes, on_evict=self._evicted)
+        # (rev, epoch) of each hot session as last read or written by this worker
+        self._versions: Dict[str, Tuple[int, int]] = {}
+        self._write_script = client.register_script(WRITE_SCRIPT)
+
+    async def load_summaries(self):
+        """Replace the local summaries with the ones in Redis"""
+        reply = await self.client.hgetall(SUMMARIES_KEY)
+        summaries = {}
+        for session_id, data in reply.items():
+            summaries[session_id.decode("utf-8")] = SessionSummary.model_validate_json(data)
+        index = SessionIndex()
+        index.load((s.id, s.updated_at, s.is_active) for s in summaries.values())
+        self._summaries, self._index = summaries, index
+
+    def handle_event(self, data: bytes):
+        """Apply a summary change published by another worker"""
+        event = json.loads(data)
+        if event["origin"] == WORKER_ID:
+            return
+        session_id = event["id"]
+        if event["op"] == "put":
+            summary = SessionSummary.model_validate(event["summary"])
+            self._summaries[session_id] = summary
+            self._index.update(session_id, summary.updated_at, summary.is_active)
+        else:
+            self._drop(session_id)
+
+    def _evicted(self, session: ChatSession):
+        self._versions.pop(session.id, None)
+
+    def _drop(self, session_id: str):
+        self._forget(session_id)
+        self._hot.discard(session_id)
+        self._versions.pop(session_id, None)
+
+    async def _fetch(self, session_id: str) -> Tuple[Optional[ChatSession], Tuple[int, int]]:
+        """Read a whole session and its (rev, epoch); None if it does not exist"""
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hmget(SESSION_KEY.format(session_id), "rev", "epoch")
+            pipe.hget(SESSION_KEY.format(session_id), "data")
+            pipe.lrange(MESSAGES_KEY.format(session_id), 0, -1)
+            (rev, epoch), data, rows = await pipe.execute()
+        if data is None:
+            return None, (0, 0)
+        session = ChatSession.model_validate_json(data)
+        _load_messages(session.messages, rows)
+        return session, (int(rev), int(epoch))
+
+    async def load(self, session_id: str) -> ChatSession:
+        session = self._hot.get(session_id)
+        version = self._versions.get(session_id)
+        if session is not None and version is not None:
+            async with self.client.pipeline(transaction=True) as pipe:
+                pipe.hmget(SESSION_KEY.format(session_id), "rev", "epoch")
+                pipe.llen(MESSAGES_KEY.format(session_id))
+                (rev, epoch), length = await pipe.execute()
+            if rev is not None:
+                if (int(rev), int(epoch)) == version and length == len(session.messages):
+                    return session
+                if int(epoch) == version[1] and length >= len(session.messages):
+                    if await self._catch_up(session, version):
+                        return session
+
+        fresh, version = await self._fetch(session_id)
+        if fresh is None:
+            self._hot.discard(session_id)
+            self._versions.pop(session_id, None)
+            raise KeyError(session_id)
+        self._hot.put(fresh)
+        self._versions[session_id] = version
+        return fresh
+
+    async def _catch_up(self, session: ChatSession, version: Tuple[int, int]) -> bool:
+        """Bring a hot session up to date with messages appended and fields saved elsewhere; False if it was cleared meanwhile"""
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.hmget(SESSION_KEY.format(session.id), "rev", "epoch")
+            pipe.hget(SESSION_KEY.format(session.id), "data")
+            pipe.lrange(MESSAGES_KEY.format(session.id), len(session.messages), -1)
+            (rev, epoch), data, rows = await pipe.execute()
+        if rev is None or int(epoch) != version[1]:
+            return False
+        if int(rev) != version[0]:
+            # Messages are kept, so the session's history buffer stays valid
+            fresh = ChatSession.model_validate_json(data)
+            for name in ChatSession.model_fields:
+                if name != "messages":
+                    setattr(session, name, getattr(fresh, name))
+        if rows:
+            before = session.messages.nbytes
+            _load_messages(session.messages, rows)
+            self._hot.grow(session, session.messages.nbytes - before)
+        self._versions[session.id] = (int(rev), int(epoch))
+        return True
+
+    def _event(self, summary: SessionSummary) -> str:
+        return json.dumps({
+            "origin": WORKER_ID,
+            "op": "put",
+            "id": summary.id,
+            "summary": summary.model_dump(mode="json")
+        })
+
+    def _refresh_summary(self, session: ChatSession):
+        # The local summaries may not have caught up with the session's creation yet; _write refreshes them instead
+        pass
+
+    async def _write(self, session: ChatSession, *commands: Sequence, appended: bool = False, cleared: bool = False):
+        """
+        Apply commands along with the session's fields and summary, and announce the new summary
+
+        A session deleted by another worker while this one was still using
+        it must not be brought back, so everything runs in one script that
+        first checks the session still exists.
+        """
+        summary = summarize_session(session)
+        key = SESSION_KEY.format(session.id)
+        commands = [
+            *commands,
+            ("HSET", key, "data", session.model_dump_json(exclude={"messages"})),
+            ("HINCRBY", key, "rev", 1),
+            ("HINCRBY", key, "epoch", 0),
+            ("HSET", SUMMARIES_KEY, session.id, summary.model_dump_json()),
+            ("PUBLISH", EVENTS_CHANNEL, self._event(summary)),
+        ]
+        replies = await self._write_script(
+            keys=[key],
+            args=[json.dumps([[str(arg) for arg in command] for command in commands])]
+        )
+        if replies is None:
+            self._drop(session.id)
+            return
+        self._summaries[session.id] = summary
+        self._index.update(session.id, summary.updated_at, summary.is_active)
+
+        # The local copy is current only if no other worker wrote in between
+        version = self._versions.get(session.id)
+        current = (
+            version is not None
+            and (replies[-4], replies[-3]) == (version[0] + 1, version[1] + cleared)
+            and (not appended or replies[0] == len(session.messages))
+        )
+        if current:
+            self._versions[session.id] = (replies[-4], replies[-3])
+        else:
+            self._hot.discard(session.id)
+            self._versions.pop(session.id, None)
+
+    async def create(self, session: ChatSession):
+        self._summarize(session)
+        key = SESSION_KEY.format(session.id)
+        rows = [_message_json(message) for message in session.messages]
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(key, MESSAGES_KEY.format(session.id))
+            pipe.hset(key, "data", session.model_dump_json(exclude={"messages"}))
+            pipe.hincrby(key, "rev", 1)
+            pipe.hincrby(key, "epoch", 1)
+            if rows:
+                pipe.rpush(MESSAGES_KEY.format(session.id), *rows)
+            pipe.hset(SUMMARIES_KEY, session.id, self._summaries[session.id].model_dump_json())
+            pipe.publish(EVENTS_CHANNEL, self._event(self._summaries[session.id]))
+            replies = await pipe.execute()
+        self._versions[session.id] = (replies[2], replies[3])
+        self._hot.put(session)
+
+    async def delete(self, session_id: str):
+        async with self.client.pipeline(transaction=True) as pipe:
+            pipe.delete(SESSION_KEY.format(session_id), MESSAGES_KEY.format(session_id))
+            pipe.hdel(SUMMARIES_KEY, session_id)
+            pipe.publish(EVENTS_CHANNEL, json.dumps({"origin": WORKER_ID, "op": "del", "id": session_id}))
+            deleted, _, _ = await pipe.execute()
+        self._drop(session_id)
+        if not deleted:
+            raise KeyError(session_id)
+
+    def __getitem__(self, session_id: str) -> ChatSession:
+        _async_only(self, "load()")
+
+    def __setitem__(self, session_id: str, session: ChatSession):
+        _async_only(self, "create()")
+
+    def __delitem__(self, session_id: str):
+        _async_only(self, "delete()")
+
+    def __contains__(self, session_id) -> bool:
+        return session_id in self._summaries
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._summaries))
+
+    def __len__(self) -> int:
+        return len(self._summaries)
+
+    async def append_messages(self, session: ChatSession, messages: List[ChatMessage]):
+        await super().append_messages(session, messages)
+        await self._write(
+            session,
+            ("RPUSH", MESSAGES_KEY.format(session.id), *(_message_json(m) for m in messages)),
+            appended=True
+        )
+        if session.id in self._versions:
+            self._hot.grow(session, estimate_messages_bytes(messages))
+
+    async def clear_messages(self, session: ChatSession):
+        await super().clear_messages(session)
+        await self._write(
+            session,
+            ("DEL", MESSAGES_KEY.format(session.id)),
+            ("HINCRBY", SESSION_KEY.format(session.id), "epoch", 1),
+            cleared=True
+        )
+        if session.id in self._versions:
+            self._hot.put(session)
+
+    async def save(self, session: ChatSession):
+        await super().save(session)
+        await self._write(session)
+
+    @property
+    def hot_sessions(self) -> int:
+        return len(self._hot)
+
+    @property
+    def hot_bytes(self) -> int:
+        return self._hot.total_bytes
+
+
+class RedisBotStore(BotStore):
+    """Bot store shared by several worker processes through one Redis hash"""
+
+    def __init__(self, client: Redis):
+        self.client = client
+
+    async def load(self, bot_id: str) -> Bot:
+        data = await self.client.hget(BOTS_KEY, bot_id)
+        if data is None:
+            raise KeyError(bot_id)
+        return Bot.model_validate_json(data)
+
+    async def load_all(self) -> List[Bot]:
+        return [Bot.model_validate_json(data) for data in (await self.client.hgetall(BOTS_KEY)).values()]
+
+    async def create(self, bot: Bot):
+        await self.client.hset(BOTS_KEY, bot.id, bot.model_dump_json())
+
+    async def delete(self, bot_id: str):
+        if not await self.client.hdel(BOTS_KEY, bot_id):
+            raise KeyError(bot_id)
+
+    def __getitem__(self, bot_id: str) -> Bot:
+        _async_only(self, "load()")
+
+    def __setitem__(self, bot_id: str, bot: Bot):
+        _async_only(self, "create()")
+
+    def __delitem__(self, bot_id: str):
+        _async_only(self, "delete()")
+
+    def __iter__(self) -> Iterator[str]:
+        _async_only(self, "load_all()")
+
+    def __len__(self) -> int:
+        _async_only(self, "load_all()")
+
+
+class SessionLockTimeout(Exception):
+    """Raised when a turn could not take its session's lock in time"""
+
+    def __init__(self, session_id: str, retry_after: float):
+        super().__init__(f"Session {session_id} is busy")
+        self.retry_after = retry_after
+
+
+class SharedSessionQueue(SessionQueue):
+    """
+    SessionQueue whose turns are also exclusive across worker processes
+
+    Turns still queue locally first, so each worker contends for a session
+    with at most one turn at a time. That turn then takes the session's
+    lock in Redis: SET NX with a lease, renewed while the turn runs so only
+    a crashed worker's lock ever expires. Releasing it is announced on
+    chai:unlock so waiting workers retry at once rather than at their next
+    poll. Renewing and releasing check the lock still holds this turn's
+    token, atomically, in a script. A session's turns therefore never
+    overlap and each one sees the history committed by every earlier one,
+    whichever worker ran it; across workers they run in the order the
+    lock is won, which is not strictly arrival order.
+
+    A turn that cannot take the lock within lock_timeout raises
+    SessionLockTimeout. depth() only counts this worker's turns.
+    """
+
+    def __init__(
+            self,
+            client: Redis,
+            lease: float = 30.0,
+            lock_timeout: float = 60.0,
+            poll_interval: float = 0.5
+    ):
+        super().__init__()
+        self.client = client
+        self.lease = lease
+        self.lock_timeout = lock_timeout
+        self.poll_interval = poll_interval
+        self._tokens = itertools.count()
+        self._unlocked: Dict[str, asyncio.Event] = {}
+        self._renew_script = client.register_script(RENEW_SCRIPT)
+        self._unlock_script = client.register_script(UNLOCK_SCRIPT)
+
+    @asynccontextmanager
+    async def turn(self, session_id: str) -> AsyncIterator[int]:
+        async with super().turn(session_id) as arrival_depth:
+            token = await self._lock(session_id)
+            renewal = asyncio.create_task(self._renew(session_id, token))
+            try:
+                yield arrival_depth
+            finally:
+                renewal.cancel()
+                # Shielded so a cancelled turn still hands the session on
+                await asyncio.shield(self._unlock(session_id, token))
+
+    def handle_unlock(self, data: bytes):
+        """Wake this worker's turn waiting on a session another worker just released"""
+        event = self._unlocked.get(data.decode("utf-8"))
+        if event is not None:
+            event.set()
+
+    async def _lock(self, session_id: str) -> str:
+        key = LOCK_KEY.format(session_id)
+        token = f"{WORKER_ID}:{next(self._tokens)}"
+        deadline = time.monotonic() + self.lock_timeout
+        event = self._unlocked[session_id] = asyncio.Event()
+        try:
+            # Subscribe to the release before trying, so it cannot slip in between
+            while not await self.client.set(key, token, nx=True, px=int(self.lease * 1000)):
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise SessionLockTimeout(session_id, self.poll_interval)
+                try:
+                    await asyncio.wait_for(event.wait(), min(self.poll_interval, remaining))
+                except asyncio.TimeoutError:
+                    pass
+                event.clear()
+            return token
+        except asyncio.CancelledError:
+            # The SET may have landed before the cancellation; releasing a lock we don't hold is a no-op
+            asyncio.ensure_future(self._unlock(session_id, token))
+            raise
+        finally:
+            del self._unlocked[session_id]
+
+    async def _renew(self, session_id: str, token: str):
+        key = LOCK_KEY.format(session_id)
+        while True:
+            await asyncio.sleep(self.lease / 3)
+            try:
+                if not await self._renew_script(keys=[key], args=[token, int(self.lease * 1000)]):
+                    logger.warning(f"Lost the lock on session {session_id} mid-turn")
+                    return
+            except RedisError as e:
+                logger.warning(f"Could not renew the lock on session {session_id}: {e}")
+
+    async def _unlock(self, session_id: str, token: str):
+        try:
+            await self._unlock_script(keys=[LOCK_KEY.format(session_id)], args=[token, UNLOCK_CHANNEL, session_id])
+        except RedisError as e:
+            logger.warning(f"Could not release the lock on session {session_id}; it expires in {self.lease}s: {e}")
+
+
+Handler = Callable[[bytes], None]
+
+
+class EventSubscriber:
+    """
+    Pub/sub listener on its own connection, dispatching messages to per-channel handlers
+
+    Handlers run on the event loop and must not block. The subscription is
+    re-established after a dropped connection; messages published meanwhile
+    are lost, as with any Redis pub/sub, so on_subscribe is awaited every
+    time it is (re)established to let callers resynchronize, before any
+    message is dispatched.
+    """
+
+    def __init__(
+            self,
+            url: str,
+            handlers: Dict[str, Handler],
+            on_subscribe: Optional[Callable[[], Awaitable[None]]] = None,
+            retry_delay: float = 1.0
+    ):
+        # No socket timeout: the connection is idle whenever nothing is published
+        self.client = connect(url, socket_timeout=None)
+        self.handlers = handlers
+        self.on_subscribe = on_subscribe
+        self.retry_delay = retry_delay
+        self.ready = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while True:
+            pubsub = self.client.pubsub()
+            try:
+                await pubsub.subscribe(*self.handlers)
+                async for message in pubsub.listen():
+                    channel: Union[bytes, str] = message["channel"]
+                    channel = channel.decode("utf-8") if isinstance(channel, bytes) else channel
+                    if message["type"] == "subscribe":
+                        if message["data"] == len(self.handlers):
+                            if self.on_subscribe is not None:
+                                await self.on_subscribe()
+                            self.ready.set()
+                    elif message["type"] == "message":
+                        try:
+                            self.handlers[channel](message["data"])
+                        except Exception as e:
+                            logger.error(f"Error handling message on {channel}: {e}")
+            except asyncio.CancelledError:
+                raise
+            except (RedisError, OSError) as e:
+                self.ready.clear()
+                logger.warning(f"Pub/sub connection lost ({e}); reconnecting in {self.retry_delay}s")
+                await asyncio.sleep(self.retry_delay)
+            finally:
+                try:
+                    await pubsub.aclose()
+                except (RedisError, OSError):
+                    pass
+
+    async def close(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.client.aclose()
@@ -0,0 +1,110 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+
+from .history_buffer import EncodedHistory, encode_entry
+
+# Approximate bookkeeping cost of one entry on top of its reply text
+ENTRY_OVERHEAD_BYTES = 200
+
+
+class ResponseCache:
+    """
+    Exact-match cache of upstream replies
+
+    Entries are keyed on a hash of the prompt, memory, names, the last
+    history_turns chat_history entries and the new user message. They expire
+    after ttl seconds and are evicted least-recently-used first once either
+    max_entries or max_bytes is exceeded.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 10000,
+            max_bytes: int = 32 * 1024 * 1024,
+            ttl: float = 300.0,
+            history_turns: int = 4
+    ):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.history_turns = history_turns
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        # key -> (expires_at, reply, size)
+        self._entries: "OrderedDict[str, Tuple[float, str, int]]" = OrderedDict()
+
+    def key(self, data: Dict, user_message: Optional[str]) -> str:
+        """Fingerprint the parts of a request that determine the reply"""
+        h = hashlib.sha256()
+        for field in ("prompt", "memory", "bot_name", "user_name"):
+            h.update(str(data.get(field, "")).encode("utf-8"))
+            h.update(b"\0")
+
+        history = data.get("chat_history", [])
+        if self.history_turns > 0:
+            if isinstance(history, EncodedHistory):
+                h.update(history.tail(self.history_turns))
+            else:
+                # Comma-terminated, like EncodedHistory.tail, so both forms share keys
+                for entry in history[-self.history_turns:]:
+                    h.update(encode_entry(entry["sender"], entry["message"]))
+                    h.update(b",")
+        h.update(b"\0")
+        h.update((user_message or "").encode("utf-8"))
+        return h.hexdigest()
+
+    def get(self, key: str) -> Optional[str]:
+        """Return a cached reply, counting the hit or miss"""
+        entry = self._entries.get(key)
+        if entry is not None and entry[0] < time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            entry = None
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return entry[1]
+
+    def put(self, key: str, reply: str):
+        """Cache a reply, evicting the least recently used entries past the caps"""
+        self._remove(key)
+        size = ENTRY_OVERHEAD_BYTES + len(key) + len(reply.encode("utf-8"))
+        if size > self.max_bytes:
+            return
+
+        self._entries[key] = (time.monotonic() + self.ttl, reply, size)
+        self.total_bytes += size
+        while len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def clear(self):
+        self._entries.clear()
+        self.total_bytes = 0
+
+    def stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.total_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+    def _remove(self, key: str):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.total_bytes -= entry[2]
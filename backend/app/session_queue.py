@@ -0,0 +1,81 @@
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Deque, Dict
+
+
+class _Mailbox:
+    __slots__ = ("busy", "depth", "waiters")
+
+    def __init__(self):
+        self.busy = False
+        # Turns holding or waiting for this mailbox
+        self.depth = 0
+        self.waiters: Deque[asyncio.Future] = deque()
+
+
+class SessionQueue:
+    """
+    Runs the turns of each session one at a time, in arrival order
+
+    Every session gets a lightweight mailbox, created on first use and
+    dropped as soon as no turn holds or waits on it. Turns on different
+    sessions never wait on each other.
+    """
+
+    def __init__(self):
+        self._mailboxes: Dict[str, _Mailbox] = {}
+
+    def depth(self, session_id: str) -> int:
+        """Number of turns running or queued for a session"""
+        mailbox = self._mailboxes.get(session_id)
+        return mailbox.depth if mailbox else 0
+
+    def __len__(self) -> int:
+        """Number of sessions with a live mailbox"""
+        return len(self._mailboxes)
+
+    @asynccontextmanager
+    async def turn(self, session_id: str) -> AsyncIterator[int]:
+        """Wait for this session's earlier turns to finish; yields the depth seen on arrival"""
+        mailbox = self._mailboxes.get(session_id)
+        if mailbox is None:
+            mailbox = self._mailboxes[session_id] = _Mailbox()
+        arrival_depth = mailbox.depth
+        mailbox.depth += 1
+
+        if mailbox.busy:
+            waiter = asyncio.get_running_loop().create_future()
+            mailbox.waiters.append(waiter)
+            try:
+                await waiter
+            except asyncio.CancelledError:
+                if waiter.done() and not waiter.cancelled():
+                    # We were handed the mailbox just as we were cancelled; pass it on
+                    self._release(session_id, mailbox)
+                else:
+                    mailbox.waiters.remove(waiter)
+                    self._leave(session_id, mailbox)
+                raise
+        else:
+            mailbox.busy = True
+
+        try:
+            yield arrival_depth
+        finally:
+            self._release(session_id, mailbox)
+
+    def _release(self, session_id: str, mailbox: _Mailbox):
+        while mailbox.waiters:
+            waiter = mailbox.waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._leave(session_id, mailbox)
+                return
+        mailbox.busy = False
+        self._leave(session_id, mailbox)
+
+    def _leave(self, session_id: str, mailbox: _Mailbox):
+        mailbox.depth -= 1
+        if mailbox.depth == 0 and self._mailboxes.get(session_id) is mailbox:
+            del self._mailboxes[session_id]
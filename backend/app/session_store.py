@@ -0,0 +1,516 @@
+import asyncio
+import bisect
+import heapq
+import itertools
+import json
+import os
+from collections import OrderedDict
+from collections.abc import MutableMapping
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from fastapi.encoders import jsonable_encoder
+
+from .message_log import MessageLog
+from .models import ChatSession, ChatMessage, Bot, SessionSummary
+
+# Rough overheads used to estimate the resident size of a session; a message
+# costs its MessageLog columns (sender id, timestamp, offset) plus its text
+SESSION_OVERHEAD_BYTES = 2048
+MESSAGE_OVERHEAD_BYTES = 18
+
+# Characters of the last message kept in a session summary
+PREVIEW_CHARS = 100
+
+
+def estimate_messages_bytes(messages: List[ChatMessage]) -> int:
+    """Approximate resident size of messages once appended to a MessageLog"""
+    return sum(MESSAGE_OVERHEAD_BYTES + len(m.content) + len(m.sender) for m in messages)
+
+
+def estimate_session_bytes(session: ChatSession) -> int:
+    """Approximate resident size of a materialized session"""
+    return SESSION_OVERHEAD_BYTES + len(session.prompt) + session.messages.nbytes
+
+
+def summarize_session(session: ChatSession) -> SessionSummary:
+    """Build a session's list entry from its fields and last message"""
+    messages = session.messages
+    last = len(messages) - 1
+    return SessionSummary(
+        id=session.id,
+        bot_name=session.bot_name,
+        user_name=session.user_name,
+        personality=session.personality,
+        bot_id=session.bot_id,
+        is_active=session.is_active,
+        message_count=len(messages),
+        last_message_preview=messages.content(last)[:PREVIEW_CHARS] if messages else None,
+        last_message_sender=messages.sender(last) if messages else None,
+        last_message_at=messages.timestamp(last) if messages else None,
+        created_at=session.created_at,
+        updated_at=session.updated_at
+    )
+
+
+# Position of a session in listing order
+SessionKey = Tuple[datetime, str]
+
+
+class SessionIndex:
+    """
+    Session ids ordered by (updated_at, id), partitioned into active and inactive
+
+    Each partition is a sorted list maintained incrementally with bisect, so
+    a page of the newest sessions before a given key costs O(log n + page)
+    rather than a sort of the whole collection.
+    """
+
+    def __init__(self):
+        self._keys: Dict[bool, List[SessionKey]] = {True: [], False: []}
+        self._entries: Dict[str, Tuple[bool, SessionKey]] = {}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def count(self, active: Optional[bool] = None) -> int:
+        """Sessions in one partition, or in both when active is None"""
+        return len(self._entries) if active is None else len(self._keys[active])
+
+    def update(self, session_id: str, updated_at: datetime, is_active: bool):
+        entry = (is_active, (updated_at, session_id))
+        if self._entries.get(session_id) == entry:
+            return
+        self.remove(session_id)
+        self._entries[session_id] = entry
+        keys = self._keys[is_active]
+        # Touched sessions are the newest, so this is almost always an append
+        if not keys or keys[-1] < entry[1]:
+            keys.append(entry[1])
+        else:
+            bisect.insort(keys, entry[1])
+
+    def load(self, sessions: Iterable[Tuple[str, datetime, bool]]):
+        """Add many (id, updated_at, is_active) entries at once, sorting once instead of per insert"""
+        for session_id, updated_at, is_active in sessions:
+            self.remove(session_id)
+            self._entries[session_id] = (is_active, (updated_at, session_id))
+            self._keys[is_active].append((updated_at, session_id))
+        for keys in self._keys.values():
+            keys.sort()
+
+    def remove(self, session_id: str):
+        entry = self._entries.pop(session_id, None)
+        if entry is not None:
+            keys = self._keys[entry[0]]
+            del keys[bisect.bisect_left(keys, entry[1])]
+
+    def page(self, active: Optional[bool], before: Optional[SessionKey] = None, limit: Optional[int] = None) -> List[SessionKey]:
+        """Keys newest first, starting after the cursor key before, at most limit of them"""
+        partitions = [self._keys[active]] if active is not None else [self._keys[True], self._keys[False]]
+        streams = []
+        for keys in partitions:
+            end = bisect.bisect_left(keys, before) if before is not None else len(keys)
+            start = max(0, end - limit) if limit is not None else 0
+            streams.append(reversed(keys[start:end]))
+        merged = streams[0] if len(streams) == 1 else heapq.merge(*streams, reverse=True)
+        return list(itertools.islice(merged, limit))
+
+
+class SessionStore(MutableMapping):
+    """
+    Storage interface for chat sessions
+
+    Behaves like a dict of session id -> ChatSession. Request handlers use
+    the async methods instead: load/create/delete, and for changes to a
+    stored session append_messages/clear_messages/save, so that durable
+    backends can persist them, shared ones can do so without blocking the
+    event loop, and the store's summaries (what session lists show) stay
+    current without reading any history.
+    """
+
+    def __init__(self):
+        self._summaries: Dict[str, SessionSummary] = {}
+        self._index = SessionIndex()
+
+    def summary(self, session_id: str) -> SessionSummary:
+        return self._summaries[session_id]
+
+    def summaries(self) -> List[SessionSummary]:
+        """The list entry of every session"""
+        return list(self._summaries.values())
+
+    def count(self, active: Optional[bool] = None) -> int:
+        """Number of sessions, optionally only the active or the inactive ones"""
+        return self._index.count(active)
+
+    def page(
+            self,
+            active: Optional[bool] = None,
+            before: Optional[SessionKey] = None,
+            limit: Optional[int] = None
+    ) -> Tuple[List[SessionSummary], Optional[SessionKey]]:
+        """
+        A page of session summaries, most recently updated first
+
+        Args:
+            active: Only active (True) or inactive (False) sessions; None for both
+            before: Key returned with the previous page, to continue after it
+            limit: Page size; None returns everything after before
+
+        Returns:
+            The summaries, and the key to pass as before for the next page
+            (None when there are no more)
+        """
+        keys = self._index.page(active, before, limit)
+        next_key = keys[-1] if limit is not None and len(keys) == limit else None
+        if next_key is not None and not self._index.page(active, next_key, 1):
+            next_key = None
+        return [self._summaries[session_id] for _, session_id in keys], next_key
+
+    async def load(self, session_id: str) -> ChatSession:
+        """Read a session for a request, treating it as recently used; raises KeyError if there is none"""
+        return self[session_id]
+
+    async def create(self, session: ChatSession):
+        """Store a new session"""
+        self[session.id] = session
+
+    async def delete(self, session_id: str):
+        """Remove a session; raises KeyError if there is none"""
+        del self[session_id]
+
+    def peek(self, session_id: str) -> ChatSession:
+        """Read a session without treating it as recently used"""
+        return self[session_id]
+
+    def _summarize(self, session: ChatSession):
+        self._summaries[session.id] = summarize_session(session)
+        self._index.update(session.id, session.updated_at, session.is_active)
+
+    def _forget(self, session_id: str):
+        self._summaries.pop(session_id, None)
+        self._index.remove(session_id)
+
+    def _refresh_summary(self, session: ChatSession):
+        # A turn can finish after its session was deleted; don't bring it back
+        if session.id in self._summaries:
+            self._summarize(session)
+
+    async def append_messages(self, session: ChatSession, messages: List[ChatMessage]):
+        """Append messages to a session and bump its updated_at"""
+        session.messages.extend(messages)
+        session.updated_at = datetime.utcnow()
+        self._refresh_summary(session)
+
+    async def clear_messages(self, session: ChatSession):
+        """Remove every message (and with them every pin and the memory) from a session"""
+        session.messages = MessageLog()
+        session.pinned_messages = []
+        session.memory = ""
+        session.memory_upto = 0
+        session.updated_at = datetime.utcnow()
+        self._refresh_summary(session)
+
+    async def save(self, session: ChatSession):
+        """Persist changes to a session's own fields (name, flags, timestamps)"""
+        self._refresh_summary(session)
+
+    def close(self):
+        """Release any resources held by the store"""
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local session store; everything is lost on restart"""
+
+    def __init__(self):
+        super().__init__()
+        self._sessions: Dict[str, ChatSession] = {}
+
+    def __getitem__(self, session_id: str) -> ChatSession:
+        return self._sessions[session_id]
+
+    def __setitem__(self, session_id: str, session: ChatSession):
+        self._sessions[session_id] = session
+        self._summarize(session)
+
+    def __delitem__(self, session_id: str):
+        del self._sessions[session_id]
+        self._forget(session_id)
+
+    def __contains__(self, session_id) -> bool:
+        return session_id in self._sessions
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._sessions)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+
+class SessionCache:
+    """
+    LRU of materialized sessions capped by count and approximate bytes
+
+    Sessions pushed past either cap are removed least-recently-used first
+    and handed to on_evict. The most recently touched session is never
+    evicted, even if it alone exceeds the byte cap.
+    """
+
+    def __init__(
+            self,
+            max_sessions: int,
+            max_bytes: int,
+            on_evict: Callable[[ChatSession], None]
+    ):
+        self.max_sessions = max_sessions
+        self.max_bytes = max_bytes
+        self.on_evict = on_evict
+        self.total_bytes = 0
+        self._entries: "OrderedDict[str, ChatSession]" = OrderedDict()
+        self._sizes: Dict[str, int] = {}
+
+    def get(self, session_id: str) -> Optional[ChatSession]:
+        """Return a hot session and mark it most recently used"""
+        session = self._entries.get(session_id)
+        if session is not None:
+            self._entries.move_to_end(session_id)
+        return session
+
+    def peek(self, session_id: str) -> Optional[ChatSession]:
+        """Return a hot session without changing its recency"""
+        return self._entries.get(session_id)
+
+    def put(self, session: ChatSession):
+        """Insert or replace a session as the most recently used"""
+        self.discard(session.id)
+        size = estimate_session_bytes(session)
+        self._entries[session.id] = session
+        self._sizes[session.id] = size
+        self.total_bytes += size
+        self._evict()
+
+    def grow(self, session: ChatSession, delta: int):
+        """Account for a hot session growing by delta bytes, re-admitting it if it was evicted"""
+        if self._entries.get(session.id) is not session:
+            self.put(session)
+            return
+        self._entries.move_to_end(session.id)
+        self._sizes[session.id] += delta
+        self.total_bytes += delta
+        self._evict()
+
+    def discard(self, session_id: str):
+        """Drop a session without calling on_evict"""
+        if self._entries.pop(session_id, None) is not None:
+            self.total_bytes -= self._sizes.pop(session_id)
+
+    def __contains__(self, session_id) -> bool:
+        return session_id in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _evict(self):
+        while len(self._entries) > 1 and (
+                len(self._entries) > self.max_sessions or self.total_bytes > self.max_bytes
+        ):
+            session_id, session = self._entries.popitem(last=False)
+            self.total_bytes -= self._sizes.pop(session_id)
+            self.on_evict(session)
+
+
+class TieredSessionStore(SessionStore):
+    """
+    Session store with a capped LRU hot tier in front of a cold tier
+
+    Hot sessions are fully materialized and served at dict-lookup speed.
+    When the hot tier exceeds its caps, the least recently used sessions
+    are handed to _spill and dropped from memory; _load rehydrates them
+    the next time they are touched. Subclasses provide the cold tier.
+
+    load() runs _load on a single background thread, so requests for cold
+    sessions never block the event loop on the cold tier.
+    """
+
+    def __init__(self, max_sessions: int = 1000, max_bytes: int = 64 * 1024 * 1024):
+        super().__init__()
+        self._hot = SessionCache(max_sessions, max_bytes, on_evict=self._spill)
+        self._ids: Set[str] = set()
+        self._loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="session-load")
+
+    def _load(self, session_id: str) -> ChatSession:
+        """Read a cold session back from the cold tier"""
+        raise NotImplementedError
+
+    def _spill(self, session: ChatSession):
+        """Move a session evicted from the hot tier into the cold tier"""
+
+    def _discard(self, session_id: str):
+        """Remove a session from the cold tier"""
+
+    def __getitem__(self, session_id: str) -> ChatSession:
+        session = self._hot.get(session_id)
+        if session is None:
+            if session_id not in self._ids:
+                raise KeyError(session_id)
+            session = self._load(session_id)
+            self._hot.put(session)
+        return session
+
+    async def load(self, session_id: str) -> ChatSession:
+        session = self._hot.get(session_id)
+        if session is not None:
+            return session
+        if session_id not in self._ids:
+            raise KeyError(session_id)
+        loaded = await asyncio.get_running_loop().run_in_executor(self._loader, self._load, session_id)
+        # Another request may have loaded (or a turn re-admitted) the session, or deleted it, meanwhile
+        session = self._hot.get(session_id)
+        if session is not None:
+            return session
+        if session_id not in self._ids:
+            raise KeyError(session_id)
+        self._hot.put(loaded)
+        return loaded
+
+    def __setitem__(self, session_id: str, session: ChatSession):
+        self._ids.add(session_id)
+        self._hot.put(session)
+        self._summarize(session)
+
+    def __delitem__(self, session_id: str):
+        if session_id not in self._ids:
+            raise KeyError(session_id)
+        self._ids.discard(session_id)
+        self._forget(session_id)
+        self._hot.discard(session_id)
+        self._discard(session_id)
+
+    def __contains__(self, session_id) -> bool:
+        return session_id in self._ids
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(list(self._ids))
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def values(self) -> List[ChatSession]:
+        """Every session, reading cold ones without promoting them into the hot tier"""
+        return [self.peek(sid) for sid in list(self._ids)]
+
+    def peek(self, session_id: str) -> ChatSession:
+        if session_id not in self._ids:
+            raise KeyError(session_id)
+        return self._hot.peek(session_id) or self._load(session_id)
+
+    async def append_messages(self, session: ChatSession, messages: List[ChatMessage]):
+        await super().append_messages(session, messages)
+        # The session may have been evicted while its turn awaited upstream
+        if session.id in self._ids:
+            self._hot.grow(session, estimate_messages_bytes(messages))
+
+    async def clear_messages(self, session: ChatSession):
+        await super().clear_messages(session)
+        if session.id in self._ids:
+            self._hot.put(session)
+
+    async def save(self, session: ChatSession):
+        await super().save(session)
+        if session.id in self._ids and self._hot.peek(session.id) is not session:
+            self._hot.put(session)
+
+    @property
+    def hot_sessions(self) -> int:
+        return len(self._hot)
+
+    @property
+    def hot_bytes(self) -> int:
+        return self._hot.total_bytes
+
+    def close(self):
+        self._loader.shutdown()
+
+
+class SpillingSessionStore(TieredSessionStore):
+    """
+    Non-durable session store that spills cold sessions to local files
+
+    Evicted sessions are written as JSON under spill_dir and read back on
+    demand. The directory is scratch space and is emptied on startup.
+    """
+
+    def __init__(self, spill_dir: str, max_sessions: int = 1000, max_bytes: int = 64 * 1024 * 1024):
+        super().__init__(max_sessions, max_bytes)
+        self.spill_dir = spill_dir
+        os.makedirs(spill_dir, exist_ok=True)
+        for name in os.listdir(spill_dir):
+            if name.endswith(".json"):
+                os.remove(os.path.join(spill_dir, name))
+
+    def _path(self, session_id: str) -> str:
+        return os.path.join(self.spill_dir, f"{session_id}.json")
+
+    def _load(self, session_id: str) -> ChatSession:
+        with open(self._path(session_id), encoding="utf-8") as f:
+            return ChatSession(**json.load(f))
+
+    def _spill(self, session: ChatSession):
+        tmp_path = self._path(session.id) + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(jsonable_encoder(session), f)
+        os.replace(tmp_path, self._path(session.id))
+
+    def _discard(self, session_id: str):
+        try:
+            os.remove(self._path(session_id))
+        except FileNotFoundError:
+            pass
+
+
+class BotStore(MutableMapping):
+    """Storage interface for bots; behaves like a dict of bot id -> Bot, with async methods for request handlers"""
+
+    async def load(self, bot_id: str) -> Bot:
+        """Read a bot; raises KeyError if there is none"""
+        return self[bot_id]
+
+    async def load_all(self) -> List[Bot]:
+        return list(self.values())
+
+    async def create(self, bot: Bot):
+        self[bot.id] = bot
+
+    async def delete(self, bot_id: str):
+        """Remove a bot; raises KeyError if there is none"""
+        del self[bot_id]
+
+    def close(self):
+        """Release any resources held by the store"""
+
+
+class InMemoryBotStore(BotStore):
+    """Process-local bot store; everything is lost on restart"""
+
+    def __init__(self):
+        self._bots: Dict[str, Bot] = {}
+
+    def __getitem__(self, bot_id: str) -> Bot:
+        return self._bots[bot_id]
+
+    def __setitem__(self, bot_id: str, bot: Bot):
+        self._bots[bot_id] = bot
+
+    def __delitem__(self, bot_id: str):
+        del self._bots[bot_id]
+
+    def __contains__(self, bot_id) -> bool:
+        return bot_id in self._bots
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._bots)
+
+    def __len__(self) -> int:
+        return len(self._bots)
@@ -0,0 +1,484 @@
+import itertools
+import json
+import logging
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional, Sequence, Tuple
+
+from .models import ChatSession, ChatMessage, Bot, SessionSummary
+from .session_store import PREVIEW_CHARS, TieredSessionStore, BotStore
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id TEXT PRIMARY KEY,
+    bot_name TEXT NOT NULL,
+    user_name TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    personality TEXT NOT NULL,
+    created_at TEXT NOT NULL,
+    updated_at TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    metadata TEXT,
+    bot_id TEXT,
+    context_budget INTEGER,
+    pinned_messages TEXT,
+    memory TEXT,
+    memory_upto INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_active_updated ON sessions (is_active, updated_at);
+
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    session_id TEXT NOT NULL,
+    sender TEXT NOT NULL,
+    content TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    metadata TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_messages_session ON messages (session_id, id);
+
+CREATE TABLE IF NOT EXISTS bots (
+    id TEXT PRIMARY KEY,
+    name TEXT NOT NULL,
+    personality TEXT NOT NULL,
+    prompt TEXT NOT NULL,
+    custom_traits TEXT,
+    created_at TEXT NOT NULL,
+    is_active INTEGER NOT NULL DEFAULT 1,
+    context_budget INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_bots_name ON bots (name);
+"""
+
+# Columns added after the first release of the schema, created on older databases at startup
+ADDED_COLUMNS = {
+    "sessions": {
+        "bot_id": "TEXT",
+        "context_budget": "INTEGER",
+        "pinned_messages": "TEXT",
+        "memory": "TEXT",
+        "memory_upto": "INTEGER NOT NULL DEFAULT 0",
+    },
+    "bots": {
+        "context_budget": "INTEGER",
+    },
+}
+
+UPSERT_SESSION = (
+    "INSERT OR REPLACE INTO sessions "
+    "(id, bot_name, user_name, prompt, personality, created_at, updated_at, is_active, metadata, "
+    "bot_id, context_budget, pinned_messages, memory, memory_upto) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)"
+)
+TOUCH_SESSION = "UPDATE sessions SET updated_at = ? WHERE id = ?"
+DELETE_SESSION = "DELETE FROM sessions WHERE id = ?"
+INSERT_MESSAGE = (
+    "INSERT INTO messages (session_id, sender, content, timestamp, metadata) VALUES (?, ?, ?, ?, ?)"
+)
+DELETE_MESSAGES = "DELETE FROM messages WHERE session_id = ?"
+UPSERT_BOT = (
+    "INSERT OR REPLACE INTO bots "
+    "(id, name, personality, prompt, custom_traits, created_at, is_active, context_budget) "
+    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+)
+DELETE_BOT = "DELETE FROM bots WHERE id = ?"
+
+
+def connect(path: str, check_same_thread: bool = True) -> sqlite3.Connection:
+    """Open a connection in WAL mode with the schema in place"""
+    conn = sqlite3.connect(path, check_same_thread=check_same_thread)
+    conn.execute("PRAGMA journal_mode=WAL")
+    # WAL + NORMAL only fsyncs at checkpoints, which is what makes batched appends cheap
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    for table, columns in ADDED_COLUMNS.items():
+        existing = {row[1] for row in conn.execute(f"PRAGMA table_info({table})")}
+        for column, decl in columns.items():
+            if column not in existing:
+                conn.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+    conn.commit()
+    return conn
+
+
+def _is_transient(e: sqlite3.Error) -> bool:
+    """Whether a write failed only because another connection held the database"""
+    message = str(e)
+    return isinstance(e, sqlite3.OperationalError) and ("locked" in message or "busy" in message)
+
+
+class SqliteWriter:
+    """
+    Write-behind queue for a SQLite database
+
+    Statements are queued by the request path and applied by a single
+    background thread, which drains everything pending into one
+    transaction so many appends share a single commit.
+
+    If that transaction fails, its operations are retried one per
+    transaction so a single bad operation (a constraint violation, a
+    missing table, a full disk) is logged, counted in failed and dropped
+    without taking the rest of the batch with it. An operation that only
+    failed because another connection held the database (locked or busy)
+    is retried after retry_delay until it lands: committed does not move
+    past it and flush() keeps waiting meanwhile.
+    """
+
+    _STOP = object()
+
+    def __init__(self, path: str, max_batch: int = 1000, retry_delay: float = 1.0):
+        self.path = path
+        self.max_batch = max_batch
+        self.retry_delay = retry_delay
+        self._queue: "queue.Queue" = queue.Queue()
+        self._seq = itertools.count(1)
+        # Sequence number of the last operation known to be committed
+        self.committed = 0
+        # Operations dropped because they failed on their own
+        self.failed = 0
+        self._thread = threading.Thread(target=self._run, name="sqlite-writer", daemon=True)
+        self._ready = threading.Event()
+        self._error: Optional[Exception] = None
+        self._thread.start()
+        self._ready.wait()
+        if self._error:
+            raise self._error
+
+    def submit(self, sql: str, params: Sequence = ()) -> int:
+        """Queue a single statement and return its sequence number"""
+        seq = next(self._seq)
+        self._queue.put((seq, sql, [params]))
+        return seq
+
+    def submit_many(self, sql: str, rows: List[Sequence]) -> int:
+        """Queue a statement to be executed once per row and return its sequence number"""
+        seq = next(self._seq)
+        self._queue.put((seq, sql, rows))
+        return seq
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """Block until everything queued so far has been committed (or dropped as bad)"""
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    @property
+    def pending(self) -> int:
+        """Approximate number of queued operations"""
+        return self._queue.qsize()
+
+    def close(self):
+        """Commit outstanding writes and stop the writer thread"""
+        if self._thread.is_alive():
+            self._queue.put(self._STOP)
+            self._thread.join()
+
+    def _run(self):
+        try:
+            conn = connect(self.path)
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+
+        stopping = False
+        while not stopping:
+            batch = [self._queue.get()]
+            while len(batch) < self.max_batch:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            ops, waiters = [], []
+            for op in batch:
+                if op is self._STOP:
+                    stopping = True
+                elif isinstance(op, threading.Event):
+                    waiters.append(op)
+                else:
+                    ops.append(op)
+
+            self._write(conn, ops, stopping)
+            for waiter in waiters:
+                waiter.set()
+
+        conn.close()
+        logger.info("SQLite writer stopped")
+
+    def _write(self, conn: sqlite3.Connection, ops: List[Tuple], stopping: bool):
+        if not ops:
+            return
+        try:
+            with conn:
+                for _, sql, rows in ops:
+                    conn.executemany(sql, rows)
+            self.committed = ops[-1][0]
+            return
+        except sqlite3.Error as e:
+            if len(ops) > 1:
+                logger.warning(f"SQLite write batch of {len(ops)} ops failed ({e}); retrying them one at a time")
+
+        for op in ops:
+            seq, sql, rows = op
+            while True:
+                try:
+                    with conn:
+                        conn.executemany(sql, rows)
+                    self.committed = seq
+                    break
+                except sqlite3.Error as e:
+                    if _is_transient(e):
+                        if stopping:
+                            logger.error(f"SQLite writer stopping with writes from #{seq} unapplied: {e}")
+                            return
+                        logger.error(f"SQLite write #{seq} failed ({e}); retrying in {self.retry_delay}s")
+                        time.sleep(self.retry_delay)
+                        continue
+                    self.failed += 1
+                    logger.error(f"Dropping SQLite write #{seq} ({sql.split('(')[0].strip()}): {e}")
+                    break
+
+
+def _dump_json(value) -> Optional[str]:
+    return json.dumps(value, default=str) if value else None
+
+
+def _load_json(value: Optional[str], default):
+    return json.loads(value) if value else default
+
+
+def _session_row(session: ChatSession) -> Tuple:
+    return (
+        session.id,
+        session.bot_name,
+        session.user_name,
+        session.prompt,
+        getattr(session.personality, "value", session.personality),
+        session.created_at.isoformat(),
+        session.updated_at.isoformat(),
+        int(session.is_active),
+        _dump_json(session.metadata),
+        session.bot_id,
+        session.context_budget,
+        _dump_json(session.pinned_messages),
+        session.memory,
+        session.memory_upto,
+    )
+
+
+def _message_row(session_id: str, message: ChatMessage) -> Tuple:
+    return (
+        session_id,
+        message.sender,
+        message.content,
+        message.timestamp.isoformat(),
+        _dump_json(message.metadata),
+    )
+
+
+class SqliteSessionStore(TieredSessionStore):
+    """
+    Session store persisted to SQLite
+
+    Recently used sessions live in the LRU hot tier; every change is also
+    queued on a SqliteWriter so request handlers never wait on disk, which
+    makes SQLite itself the cold tier. Evicted sessions are simply dropped
+    and reloaded from the database when touched again.
+    """
+
+    def __init__(
+            self,
+            writer: SqliteWriter,
+            max_sessions: int = 1000,
+            max_bytes: int = 64 * 1024 * 1024
+    ):
+        super().__init__(max_sessions, max_bytes)
+        self._writer = writer
+        # Used by load()'s background thread as well as the event loop, one at a time
+        self._reader = connect(writer.path, check_same_thread=False)
+        self._reader_lock = threading.Lock()
+        # Last queued write per session, so a reload can wait for it to land
+        self._last_write: Dict[str, int] = {}
+        for summary in self._read_summaries():
+            self._ids.add(summary.id)
+            self._summaries[summary.id] = summary
+        self._index.load((s.id, s.updated_at, s.is_active) for s in self._summaries.values())
+        logger.info(f"Found {len(self._ids)} chat sessions in {writer.path}")
+
+    def _record(self, session_id: str, seq: int):
+        self._last_write[session_id] = seq
+
+    def _read_summaries(self) -> Iterator[SessionSummary]:
+        """Summaries of every stored session, computed in SQL without reading message bodies"""
+        rows = self._reader.execute(
+            "SELECT s.id, s.bot_name, s.user_name, s.personality, s.bot_id, s.is_active, "
+            "s.created_at, s.updated_at, "
+            "(SELECT COUNT(*) FROM messages WHERE session_id = s.id), "
+            "last.sender, substr(last.content, 1, ?), last.timestamp "
+            "FROM sessions s LEFT JOIN messages last "
+            "ON last.id = (SELECT MAX(id) FROM messages WHERE session_id = s.id)",
+            (PREVIEW_CHARS,)
+        )
+        for row in rows:
+            yield SessionSummary(
+                id=row[0],
+                bot_name=row[1],
+                user_name=row[2],
+                personality=row[3],
+                bot_id=row[4],
+                is_active=bool(row[5]),
+                created_at=datetime.fromisoformat(row[6]),
+                updated_at=datetime.fromisoformat(row[7]),
+                message_count=row[8],
+                last_message_sender=row[9],
+                last_message_preview=row[10],
+                last_message_at=datetime.fromisoformat(row[11]) if row[11] else None,
+            )
+
+    def _load(self, session_id: str) -> ChatSession:
+        if self._last_write.get(session_id, 0) > self._writer.committed:
+            self._writer.flush()
+        with self._reader_lock:
+            return self._read_session(session_id)
+
+    def _read_session(self, session_id: str) -> ChatSession:
+        row = self._reader.execute(
+            "SELECT id, bot_name, user_name, prompt, personality, created_at, updated_at, "
+            "is_active, metadata, bot_id, context_budget, pinned_messages, memory, memory_upto "
+            "FROM sessions WHERE id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            raise KeyError(session_id)
+
+        session = ChatSession(
+            id=row[0],
+            bot_name=row[1],
+            user_name=row[2],
+            prompt=row[3],
+            personality=row[4],
+            created_at=datetime.fromisoformat(row[5]),
+            updated_at=datetime.fromisoformat(row[6]),
+            is_active=bool(row[7]),
+            metadata=_load_json(row[8], {}),
+            bot_id=row[9],
+            context_budget=row[10],
+            pinned_messages=_load_json(row[11], []),
+            memory=row[12] or "",
+            memory_upto=row[13],
+        )
+        for sender, content, timestamp, metadata in self._reader.execute(
+            "SELECT sender, content, timestamp, metadata FROM messages "
+            "WHERE session_id = ? ORDER BY id",
+            (session_id,)
+        ):
+            session.messages.add(sender, content, datetime.fromisoformat(timestamp), _load_json(metadata, {}))
+        return session
+
+    def _discard(self, session_id: str):
+        self._writer.submit(DELETE_MESSAGES, (session_id,))
+        self._writer.submit(DELETE_SESSION, (session_id,))
+        self._last_write.pop(session_id, None)
+
+    def __setitem__(self, session_id: str, session: ChatSession):
+        super().__setitem__(session_id, session)
+        self._writer.submit(DELETE_MESSAGES, (session_id,))
+        self._writer.submit(UPSERT_SESSION, _session_row(session))
+        self._record(session_id, self._writer.submit_many(
+            INSERT_MESSAGE, [_message_row(session_id, m) for m in session.messages]
+        ))
+
+    async def append_messages(self, session: ChatSession, messages: List[ChatMessage]):
+        await super().append_messages(session, messages)
+        # A turn can finish after its session was deleted; writing it would leave orphan rows behind
+        if session.id not in self._ids:
+            return
+        self._writer.submit_many(INSERT_MESSAGE, [_message_row(session.id, m) for m in messages])
+        self._record(session.id, self._writer.submit(
+            TOUCH_SESSION, (session.updated_at.isoformat(), session.id)
+        ))
+
+    async def clear_messages(self, session: ChatSession):
+        await super().clear_messages(session)
+        if session.id not in self._ids:
+            return
+        self._writer.submit(DELETE_MESSAGES, (session.id,))
+        self._record(session.id, self._writer.submit(UPSERT_SESSION, _session_row(session)))
+
+    async def save(self, session: ChatSession):
+        await super().save(session)
+        if session.id not in self._ids:
+            return
+        self._record(session.id, self._writer.submit(UPSERT_SESSION, _session_row(session)))
+
+    def close(self):
+        super().close()
+        self._writer.flush()
+        self._reader.close()
+
+
+class SqliteBotStore(BotStore):
+    """Bot store persisted to SQLite through the shared write-behind queue"""
+
+    def __init__(self, writer: SqliteWriter):
+        self._writer = writer
+        self._bots: Dict[str, Bot] = {}
+        self._load()
+
+    def _load(self):
+        conn = connect(self._writer.path)
+        try:
+            for row in conn.execute(
+                    "SELECT id, name, personality, prompt, custom_traits, created_at, is_active, "
+                    "context_budget FROM bots"
+            ):
+                self._bots[row[0]] = Bot(
+                    id=row[0],
+                    name=row[1],
+                    personality=row[2],
+                    prompt=row[3],
+                    custom_traits=_load_json(row[4], []),
+                    created_at=datetime.fromisoformat(row[5]),
+                    is_active=bool(row[6]),
+                    context_budget=row[7],
+                )
+        finally:
+            conn.close()
+
+    def __getitem__(self, bot_id: str) -> Bot:
+        return self._bots[bot_id]
+
+    def __setitem__(self, bot_id: str, bot: Bot):
+        self._bots[bot_id] = bot
+        self._writer.submit(UPSERT_BOT, (
+            bot.id,
+            bot.name,
+            getattr(bot.personality, "value", bot.personality),
+            bot.prompt,
+            _dump_json(bot.custom_traits),
+            bot.created_at.isoformat(),
+            int(bot.is_active),
+            bot.context_budget,
+        ))
+
+    def __delitem__(self, bot_id: str):
+        del self._bots[bot_id]
+        self._writer.submit(DELETE_BOT, (bot_id,))
+
+    def __contains__(self, bot_id) -> bool:
+        return bot_id in self._bots
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._bots)
+
+    def __len__(self) -> int:
+        return len(self._bots)
+
+    def close(self):
+        self._writer.flush()
@@ -0,0 +1,273 @@
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Deque, Dict, Iterator, List, Optional
+
+import aiohttp
+
+from .metrics import route_template
+
+logger = logging.getLogger(__name__)
+
+SERVICE_NAME = "chai-backend"
+
+
+class Span:
+    __slots__ = ("name", "id", "parent_id", "start", "end", "wall_start", "tags")
+
+    def __init__(self, name: str, parent_id: Optional[str], tags: Dict[str, str]):
+        self.name = name
+        self.id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.start = time.perf_counter()
+        self.end: Optional[float] = None
+        self.wall_start = time.time()
+        self.tags = tags
+
+    @property
+    def duration(self) -> float:
+        return (self.end if self.end is not None else time.perf_counter()) - self.start
+
+    def tag(self, key: str, value):
+        self.tags[key] = str(value)
+
+
+class Trace:
+    """Spans recorded while handling one request"""
+
+    def __init__(self, name: str):
+        self.id = os.urandom(16).hex()
+        self.root = Span(name, None, {})
+        self.spans: List[Span] = []
+        self.handler_end: Optional[float] = None
+
+    def add(self, name: str, start: float, end: float, parent_id: Optional[str] = None) -> Span:
+        """Record a span that has already happened"""
+        span = Span(name, parent_id or self.root.id, {})
+        span.wall_start -= span.start - start
+        span.start = start
+        span.end = end
+        self.spans.append(span)
+        return span
+
+    def server_timing(self) -> str:
+        """Server-Timing header value: total milliseconds per span name, in first-seen order"""
+        totals: Dict[str, float] = {}
+        for span in self.spans:
+            if span.end is not None:
+                totals[span.name] = totals.get(span.name, 0.0) + span.duration
+        entries = [f"{name};dur={1000 * seconds:.2f}" for name, seconds in totals.items()]
+        entries.append(f"total;dur={1000 * self.root.duration:.2f}")
+        return ", ".join(entries)
+
+    def to_zipkin(self) -> List[Dict]:
+        """The trace as Zipkin v2 JSON spans"""
+        spans = []
+        for span in [self.root] + self.spans:
+            entry = {
+                "traceId": self.id,
+                "id": span.id,
+                "name": span.name,
+                "timestamp": int(span.wall_start * 1_000_000),
+                "duration": max(1, int(span.duration * 1_000_000)),
+                "localEndpoint": {"serviceName": SERVICE_NAME},
+            }
+            if span.parent_id:
+                entry["parentId"] = span.parent_id
+            else:
+                entry["kind"] = "SERVER"
+            if span.tags:
+                entry["tags"] = span.tags
+            spans.append(entry)
+        return spans
+
+
+_trace: ContextVar[Optional[Trace]] = ContextVar("chai_trace", default=None)
+_parent: ContextVar[Optional[str]] = ContextVar("chai_span_parent", default=None)
+
+
+def current_trace() -> Optional[Trace]:
+    return _trace.get()
+
+
+@contextmanager
+def span(name: str, **tags) -> Iterator[Optional[Span]]:
+    """Time a block as a span of the current request's trace; a no-op outside a traced request"""
+    trace = _trace.get()
+    if trace is None:
+        yield None
+        return
+
+    current = Span(name, _parent.get() or trace.root.id, {k: str(v) for k, v in tags.items()})
+    trace.spans.append(current)
+    token = _parent.set(current.id)
+    try:
+        yield current
+    except BaseException as e:
+        current.tag("error", type(e).__name__)
+        raise
+    finally:
+        current.end = time.perf_counter()
+        _parent.reset(token)
+
+
+def record(name: str, start: float, **tags):
+    """Record a span that started at start (a perf_counter value) and ends now"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add(name, start, time.perf_counter(), _parent.get()).tags.update(
+            {k: str(v) for k, v in tags.items()}
+        )
+
+
+def mark_handler_start():
+    """Record everything before the endpoint body (routing, body parsing, validation) as a span"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.add("validate", trace.root.start, time.perf_counter())
+
+
+def mark_handler_end():
+    """Note that the endpoint returned; the time until the response starts is reported as serialization"""
+    trace = _trace.get()
+    if trace is not None:
+        trace.handler_end = time.perf_counter()
+
+
+class TraceExporter:
+    """
+    Ships finished traces as Zipkin v2 JSON in the background
+
+    The target is either a file path, which gets one JSON array of spans per
+    trace per line, or an http(s) URL of a Zipkin-compatible collector, which
+    gets batches POSTed to it. Traces are buffered in a bounded queue and
+    dropped, not waited on, if the exporter falls behind.
+    """
+
+    def __init__(self, target: str, sample_rate: float = 1.0, max_queue: int = 10000, flush_interval: float = 1.0):
+        self.target = target
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.exported = 0
+        self.dropped = 0
+        self._queue: Deque[Trace] = deque(maxlen=max_queue)
+        self._worker: Optional[asyncio.Task] = None
+        self._session: Optional[aiohttp.ClientSession] = None
+
+    def sampled(self) -> bool:
+        return self.sample_rate >= 1.0 or random.random() < self.sample_rate
+
+    def submit(self, trace: Trace):
+        if len(self._queue) == self._queue.maxlen:
+            self.dropped += 1
+        self._queue.append(trace)
+        if self._worker is None or self._worker.done():
+            self._worker = asyncio.create_task(self._run())
+
+    async def _run(self):
+        while self._queue:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        batch = [self._queue.popleft() for _ in range(len(self._queue))]
+        if not batch:
+            return
+        try:
+            if self.target.startswith(("http://", "https://")):
+                await self._post(batch)
+            else:
+                await asyncio.to_thread(self._write, batch)
+            self.exported += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            logger.error(f"Failed to export {len(batch)} traces to {self.target}: {e}")
+
+    def _write(self, batch: List[Trace]):
+        with open(self.target, "a", encoding="utf-8") as f:
+            for trace in batch:
+                f.write(json.dumps(trace.to_zipkin()))
+                f.write("\n")
+
+    async def _post(self, batch: List[Trace]):
+        if self._session is None:
+            self._session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=10))
+        spans = [span for trace in batch for span in trace.to_zipkin()]
+        async with self._session.post(self.target, json=spans) as response:
+            response.raise_for_status()
+
+    async def close(self):
+        if self._worker is not None:
+            self._worker.cancel()
+            try:
+                await self._worker
+            except asyncio.CancelledError:
+                pass
+            self._worker = None
+        await self.flush()
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+
+exporter: Optional[TraceExporter] = None
+
+
+def configure(target: Optional[str], sample_rate: float = 1.0):
+    """Start exporting traces to target (a file path or collector URL); None only reports Server-Timing"""
+    global exporter
+    exporter = TraceExporter(target, sample_rate) if target else None
+
+
+async def close():
+    global exporter
+    if exporter is not None:
+        await exporter.close()
+        exporter = None
+
+
+class TracingMiddleware:
+    """ASGI middleware that traces each HTTP request and reports it in a Server-Timing header"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        trace = Trace(scope["method"])
+        status = 500
+
+        async def send_with_timing(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if trace.handler_end is not None:
+                    trace.add("serialize", trace.handler_end, time.perf_counter())
+                message = {
+                    **message,
+                    "headers": list(message.get("headers", [])) + [
+                        (b"server-timing", trace.server_timing().encode("latin-1"))
+                    ],
+                }
+            await send(message)
+
+        token = _trace.set(trace)
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _trace.reset(token)
+            trace.root.end = time.perf_counter()
+            trace.root.name = f"{scope['method']} {route_template(scope)}"
+            trace.root.tag("http.status_code", status)
+            trace.root.tag("http.path", scope["path"])
+            if exporter is not None and exporter.sampled():
+                exporter.submit(trace)
@@ -1,7 +1,14 @@
-from fastapi import APIRouter, HTTPException, Depends, Query
-from typing import List, Dict
+from fastapi import APIRouter, HTTPException, Depends, Query, Response
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import StreamingResponse
+from typing import AsyncIterator, List, Dict, Optional
+import asyncio
+import base64
+import json
 import logging
-from datetime import datetime
+import math
+import time
+from datetime import datetime, timezone
 
 from app.models import (
     ChatSession,
@@ -10,12 +17,29 @@ from app.models import (
     ChatResponse,
     ChatMessage,
     SessionListResponse,
+    SessionSummaryListResponse,
     MessageListResponse,
     Bot,
     CreateBotRequest
 )
 from app.chai_client import ChaiAPIClient
-from app.dependencies import get_chai_client, get_chat_sessions, get_bot_storage
+from app.connections import Connection
+from app.circuit_breaker import CircuitOpenError
+from app.metrics import messages_appended
+from app.tracing import mark_handler_end, mark_handler_start, record, span
+from app.rate_limiter import RateLimitExceeded
+from app.redis_store import SessionLockTimeout
+from app.dependencies import (
+    get_chai_client,
+    get_chat_sessions,
+    get_connection_manager,
+    get_context_budgeter,
+    get_bot_storage,
+    get_memory_compactor,
+    get_session_queue
+)
+from app.session_store import SessionKey, SessionStore, BotStore
+from app.context import HistoryWindow, history_window
 
 logger = logging.getLogger(__name__)
 
@@ -26,30 +50,38 @@ router = APIRouter()
 async def create_chat_session(
         request: CreateChatRequest,
         chai_client: ChaiAPIClient = Depends(get_chai_client),
-        sessions: Dict = Depends(get_chat_sessions)
+        sessions: SessionStore = Depends(get_chat_sessions),
+        bots: BotStore = Depends(get_bot_storage)
 ):
     """Create a new chat session with a bot"""
-    try:
-        # Create personality prompt
-        prompt = chai_client.create_personality_prompt(
-            request.personality,
-            request.custom_traits
-        )
+    bot: Optional[Bot] = None
+    if request.bot_id:
+        bot = await _load_bot(bots, request.bot_id)
 
-        # Add custom prompt if provided
-        if request.custom_prompt:
-            prompt += f"\n\n{request.custom_prompt}"
+    try:
+        if bot:
+            # Sessions started from a saved bot reuse its persona
+            prompt = bot.prompt
+        else:
+            # Create personality prompt, with the custom prompt if provided
+            prompt = chai_client.create_personality_prompt(
+                request.personality,
+                request.custom_traits,
+                request.custom_prompt
+            )
 
         # Create session
         session = ChatSession(
-            bot_name=request.bot_name,
+            bot_name=bot.name if bot else request.bot_name,
             user_name=request.user_name,
             prompt=prompt,
-            personality=request.personality
+            personality=bot.personality if bot else request.personality,
+            bot_id=request.bot_id,
+            context_budget=request.context_budget
         )
 
         # Store session
-        sessions[session.id] = session
+        await sessions.create(session)
 
         logger.info(f"Created chat session: {session.id}")
         return session
@@ -59,52 +91,203 @@ async def create_chat_session(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def _load_session(sessions: SessionStore, session_id: str) -> ChatSession:
+    """Read a session for a request, or fail it with 404"""
+    try:
+        return await sessions.load(session_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Session not found")
+
+
+async def _load_bot(bots: BotStore, bot_id: str) -> Bot:
+    """Read a bot for a request, or fail it with 404"""
+    try:
+        return await bots.load(bot_id)
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Bot not found")
+
+
+async def commit_turn(
+        sessions: SessionStore,
+        session: ChatSession,
+        user_message: str,
+        reply: str,
+        origin: Optional[Connection] = None
+) -> ChatMessage:
+    """Append a completed user/bot exchange to the session history and announce it to the session's sockets"""
+    user_msg = ChatMessage(
+        sender=session.user_name,
+        content=user_message
+    )
+
+    bot_msg = ChatMessage(
+        sender=session.bot_name,
+        content=reply
+    )
+
+    await sessions.append_messages(session, [user_msg, bot_msg])
+    messages_appended.inc(2)
+
+    # Other tabs on this session see the turn; the socket that sent it already has the reply.
+    # Tabs held by other workers can't be counted from here, so shared stores always publish
+    connections = get_connection_manager()
+    if connections.publish is not None or connections.listeners(session.id, exclude=origin):
+        await connections.broadcast(session.id, {
+            "type": "turn",
+            "session_id": session.id,
+            "messages": jsonable_encoder([user_msg, bot_msg])
+        }, exclude=origin)
+
+    # Fold older turns into the session memory in the background once history grows
+    compactor = get_memory_compactor()
+    if compactor:
+        compactor.schedule(sessions, session)
+
+    return bot_msg
+
+
+def _sse_event(event: str, data: Dict) -> str:
+    """Format a single Server-Sent Events frame"""
+    return f"event: {event}\ndata: {json.dumps(jsonable_encoder(data))}\n\n"
+
+
+async def _stream_reply(
+        request: SendMessageRequest,
+        chai_client: ChaiAPIClient,
+        sessions: SessionStore,
+        bots: BotStore
+) -> AsyncIterator[str]:
+    """Relay upstream chunks as SSE and commit the turn once the stream completes"""
+    # Spans are recorded after the fact here: a context manager held across a yield could be resumed elsewhere
+    queued_at = time.perf_counter()
+    try:
+        async with get_session_queue().turn(request.session_id) as queue_depth:
+            record("queue", queued_at, depth=queue_depth)
+            # The session may have been deleted or evicted while this turn was queued
+            try:
+                session = await sessions.load(request.session_id)
+            except KeyError:
+                yield _sse_event("error", {"error": "Session not found", "session_id": request.session_id})
+                return
+            if not session.is_active:
+                yield _sse_event("error", {"error": "Session is not active", "session_id": session.id})
+                return
+
+            # Headers are already on the wire, so report the history window as the first event
+            history_started = time.perf_counter()
+            window = await build_history_window(session, request.message, bots)
+            record("history", history_started, **window.stats())
+            yield _sse_event("history", {**window.stats(), "queue_depth": queue_depth})
+
+            chunks = []
+            upstream_started = time.perf_counter()
+            try:
+                async for chunk in chai_client.stream_message({
+                    "prompt": session.prompt,
+                    "bot_name": session.bot_name,
+                    "user_name": session.user_name,
+                    "chat_history": window.chat_history,
+                    "memory": session.memory
+                }, user_message=request.message):
+                    chunks.append(chunk)
+                    yield _sse_event("chunk", {"delta": chunk})
+            except (asyncio.CancelledError, GeneratorExit):
+                # Client went away mid-stream; leave the history untouched
+                logger.info(f"Stream for session {session.id} cancelled before completion")
+                raise
+            except Exception as e:
+                logger.error(f"Error streaming message: {e}")
+                yield _sse_event("error", {"error": str(e), "session_id": session.id})
+                return
+
+            record("upstream", upstream_started, chunks=len(chunks))
+
+            commit_started = time.perf_counter()
+            bot_msg = await commit_turn(sessions, session, request.message, "".join(chunks))
+            record("commit", commit_started)
+    except SessionLockTimeout as e:
+        yield _sse_event("error", {
+            "error": str(e),
+            "session_id": request.session_id,
+            "retry_after": math.ceil(e.retry_after)
+        })
+        return
+
+    yield _sse_event("done", ChatResponse(
+        response=bot_msg.content,
+        bot_name=session.bot_name,
+        timestamp=bot_msg.timestamp,
+        session_id=session.id
+    ))
+
+
+async def build_history_window(session: ChatSession, user_message: str, bots: BotStore) -> HistoryWindow:
+    """Prepare chat history, trimmed to the session's (or its bot's) context budget"""
+    bot = None
+    if session.bot_id:
+        try:
+            bot = await bots.load(session.bot_id)
+        except KeyError:
+            pass
+    return history_window(get_context_budgeter(), session, user_message, bot)
+
+
 @router.post("/send", response_model=ChatResponse)
 async def send_message(
         request: SendMessageRequest,
+        http_response: Response,
+        stream: bool = Query(False, description="Stream the reply as Server-Sent Events"),
         chai_client: ChaiAPIClient = Depends(get_chai_client),
-        sessions: Dict = Depends(get_chat_sessions)
+        sessions: SessionStore = Depends(get_chat_sessions),
+        bots: BotStore = Depends(get_bot_storage)
 ):
     """Send a message to the bot and get a response"""
+    mark_handler_start()
     try:
         # Get session
-        if request.session_id not in sessions:
-            raise HTTPException(status_code=404, detail="Session not found")
-
-        session = sessions[request.session_id]
-
-        if not session.is_active:
+        if not (await _load_session(sessions, request.session_id)).is_active:
             raise HTTPException(status_code=400, detail="Session is not active")
 
-        # Prepare chat history
-        chat_history = [
-            {"sender": msg.sender, "message": msg.content}
-            for msg in session.messages
-        ]
-
-        # Send to CHAI API
-        response = await chai_client.send_message({
-            "prompt": session.prompt,
-            "bot_name": session.bot_name,
-            "user_name": session.user_name,
-            "chat_history": chat_history,
-            "memory": ""
-        }, user_message=request.message)
-
-        # Update session with new messages
-        user_msg = ChatMessage(
-            sender=session.user_name,
-            content=request.message
-        )
-
-        bot_msg = ChatMessage(
-            sender=session.bot_name,
-            content=response["response"]
-        )
-
-        session.messages.extend([user_msg,bot_msg])
-        session.updated_at = datetime.utcnow()
-
+        if stream:
+            return StreamingResponse(
+                _stream_reply(request, chai_client, sessions, bots),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+            )
+
+        # Turns on one session run in arrival order so each sees the previous one's history
+        queued_at = time.perf_counter()
+        async with get_session_queue().turn(request.session_id) as queue_depth:
+            record("queue", queued_at, depth=queue_depth)
+            with span("load"):
+                session = await _load_session(sessions, request.session_id)
+            # Deactivated while this turn was queued
+            if not session.is_active:
+                raise HTTPException(status_code=400, detail="Session is not active")
+
+            with span("history") as history_span:
+                window = await build_history_window(session, request.message, bots)
+                if history_span:
+                    history_span.tags.update({k: str(v) for k, v in window.stats().items()})
+
+            # Send to CHAI API
+            with span("upstream"):
+                response = await chai_client.send_message({
+                    "prompt": session.prompt,
+                    "bot_name": session.bot_name,
+                    "user_name": session.user_name,
+                    "chat_history": window.chat_history,
+                    "memory": session.memory
+                }, user_message=request.message)
+
+            # Update session with new messages
+            with span("commit"):
+                bot_msg = await commit_turn(sessions, session, request.message, response["response"])
+
+        http_response.headers.update(window.headers())
+        http_response.headers["X-Queue-Depth"] = str(queue_depth)
+
+        mark_handler_end()
         return ChatResponse(
             response=response["response"],
             bot_name=session.bot_name,
@@ -114,31 +297,80 @@ async def send_message(
 
     except HTTPException:
         raise
+    except RateLimitExceeded as e:
+        logger.warning(f"Upstream rate limit: caller would wait {e.retry_after:.1f}s")
+        raise HTTPException(
+            status_code=429,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    except CircuitOpenError as e:
+        logger.warning(f"Upstream circuit open, failing fast for {e.retry_after:.1f}s")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
+    except SessionLockTimeout as e:
+        logger.warning(f"Gave up waiting for session {request.session_id}: {e}")
+        raise HTTPException(
+            status_code=503,
+            detail=str(e),
+            headers={"Retry-After": str(math.ceil(e.retry_after))}
+        )
     except Exception as e:
         logger.error(f"Error sending message: {e}")
         raise HTTPException(status_code=500, detail=str(e))
 
 
+def _encode_cursor(key: Optional[SessionKey]) -> Optional[str]:
+    """Opaque keyset cursor for the position after key"""
+    if key is None:
+        return None
+    updated_at, session_id = key
+    return base64.urlsafe_b64encode(f"{updated_at.isoformat()}|{session_id}".encode("utf-8")).decode("ascii")
+
+
+def _decode_cursor(cursor: Optional[str]) -> Optional[SessionKey]:
+    if not cursor:
+        return None
+    try:
+        stamp, _, session_id = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").partition("|")
+        updated_at = datetime.fromisoformat(stamp)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    # The index holds naive UTC times, which can't be compared with an aware one
+    if updated_at.tzinfo is not None:
+        updated_at = updated_at.astimezone(timezone.utc).replace(tzinfo=None)
+    return updated_at, session_id
+
+
 @router.get("/sessions", response_model=SessionListResponse)
 async def list_sessions(
         active_only: bool = Query(True, description="Only return active sessions"),
-        sessions: Dict = Depends(get_chat_sessions)
+        cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+        limit: Optional[int] = Query(None, ge=1, le=500, description="Page size; all sessions if omitted"),
+        sessions: SessionStore = Depends(get_chat_sessions)
 ):
-    """List all chat sessions"""
+    """List chat sessions with their messages, most recently updated first"""
+    before = _decode_cursor(cursor)
     try:
-        all_sessions = list(sessions.values())
-
-        if active_only:
-            filtered_sessions = [s for s in all_sessions if s.is_active]
-        else:
-            filtered_sessions = all_sessions
-
-        # Sort by updated_at descending
-        filtered_sessions.sort(key=lambda x: x.updated_at, reverse=True)
+        active = True if active_only else None
+        summaries, next_key = sessions.page(active, before, limit)
+
+        # Paged from the summaries, so only the sessions on this page are read from the store
+        page = []
+        for summary in summaries:
+            try:
+                page.append(await sessions.load(summary.id))
+            except KeyError:
+                # Deleted since the page was taken
+                continue
 
         return SessionListResponse(
-            sessions=filtered_sessions,
-            total=len(filtered_sessions)
+            sessions=page,
+            total=sessions.count(active),
+            next_cursor=_encode_cursor(next_key)
         )
 
     except Exception as e:
@@ -146,16 +378,49 @@ async def list_sessions(
         raise HTTPException(status_code=500, detail=str(e))
 
 
+@router.get("/sessions/summaries", response_model=SessionSummaryListResponse)
+async def list_session_summaries(
+        active_only: bool = Query(True, description="Only return active sessions"),
+        cursor: Optional[str] = Query(None, description="next_cursor from the previous page"),
+        limit: Optional[int] = Query(None, ge=1, le=500, description="Page size; all sessions if omitted"),
+        sessions: SessionStore = Depends(get_chat_sessions)
+):
+    """List sessions without their messages, from the store's maintained summaries"""
+    before = _decode_cursor(cursor)
+    try:
+        active = True if active_only else None
+        summaries, next_key = sessions.page(active, before, limit)
+
+        return SessionSummaryListResponse(
+            sessions=summaries,
+            total=sessions.count(active),
+            next_cursor=_encode_cursor(next_key)
+        )
+
+    except Exception as e:
+        logger.error(f"Error listing session summaries: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 @router.get("/sessions/{session_id}", response_model=ChatSession)
 async def get_session(
         session_id: str,
-        sessions: Dict = Depends(get_chat_sessions)
+        sessions: SessionStore = Depends(get_chat_sessions)
 ):
     """Get a specific chat session"""
+    return await _load_session(sessions, session_id)
+
+
+@router.get("/sessions/{session_id}/queue")
+async def get_queue_depth(
+        session_id: str,
+        sessions: SessionStore = Depends(get_chat_sessions)
+):
+    """Get the number of turns running or waiting on a session"""
     if session_id not in sessions:
         raise HTTPException(status_code=404, detail="Session not found")
 
-    return sessions[session_id]
+    return {"session_id": session_id, "depth": get_session_queue().depth(session_id)}
 
 
 @router.get("/sessions/{session_id}/messages", response_model=MessageListResponse)
@@ -163,47 +428,90 @@ async def get_messages(
         session_id: str,
         limit: int = Query(50, ge=1, le=200),
         offset: int = Query(0, ge=0),
-        sessions: Dict = Depends(get_chat_sessions)
+        before: Optional[int] = Query(None, ge=0, description="Page of messages with seq below this"),
+        after: Optional[int] = Query(None, ge=-1, description="Page of messages with seq above this"),
+        tail: bool = Query(False, description="Page of the newest messages"),
+        sessions: SessionStore = Depends(get_chat_sessions)
 ):
-    """Get messages from a chat session"""
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-
-    session = sessions[session_id]
-    messages = session.messages[offset:offset + limit]
+    """
+    Get messages from a chat session
+
+    Every message carries a seq: its position in the session's append-only
+    history, stable until the history is cleared. Page backwards from
+    tail=true with before=<first seq of the page>, or poll for new messages
+    with after=<last seq seen>; only the requested page is materialized.
+    """
+    if (before is not None) + (after is not None) + tail + bool(offset) > 1:
+        raise HTTPException(status_code=400, detail="Use only one of offset, before, after and tail")
+    session = await _load_session(sessions, session_id)
+    total = len(session.messages)
+    if before is not None:
+        end = min(before, total)
+        start = max(0, end - limit)
+    elif tail:
+        end = total
+        start = max(0, end - limit)
+    else:
+        start = min(after + 1 if after is not None else offset, total)
+        end = min(start + limit, total)
 
     return MessageListResponse(
-        messages=messages,
+        messages=session.messages[start:end],
         session_id=session_id,
-        total=len(session.messages)
+        total=total,
+        has_earlier=start > 0,
+        has_later=end < total
     )
 
 
+@router.post("/sessions/{session_id}/messages/{index}/pin")
+async def pin_message(
+        session_id: str,
+        index: int,
+        pinned: bool = Query(True, description="Pin (true) or unpin (false) the message"),
+        sessions: SessionStore = Depends(get_chat_sessions)
+):
+    """Pin a message so it is always sent upstream regardless of the context budget"""
+    # Queued behind running turns, so a turn's save can't drop the pin
+    async with get_session_queue().turn(session_id):
+        session = await _load_session(sessions, session_id)
+        if not 0 <= index < len(session.messages):
+            raise HTTPException(status_code=404, detail="Message not found")
+
+        pins = set(session.pinned_messages)
+        if pinned:
+            pins.add(index)
+        else:
+            pins.discard(index)
+        session.pinned_messages = sorted(pins)
+        await sessions.save(session)
+
+    return {"message": "Message pinned" if pinned else "Message unpinned", "pinned_messages": session.pinned_messages}
+
+
 @router.delete("/sessions/{session_id}")
 async def delete_session(
         session_id: str,
-        sessions: Dict = Depends(get_chat_sessions)
+        sessions: SessionStore = Depends(get_chat_sessions)
 ):
     """Delete a chat session"""
-    if session_id not in sessions:
+    try:
+        await sessions.delete(session_id)
+    except KeyError:
         raise HTTPException(status_code=404, detail="Session not found")
-
-    del sessions[session_id]
     return {"message": "Session deleted successfully"}
 
 
 @router.post("/sessions/{session_id}/clear")
 async def clear_messages(
         session_id: str,
-        sessions: Dict = Depends(get_chat_sessions)
+        sessions: SessionStore = Depends(get_chat_sessions)
 ):
     """Clear all messages from a session"""
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-
-    session = sessions[session_id]
-    session.messages = []
-    session.updated_at = datetime.utcnow()
+    # Queued like a turn, so a turn in flight can't write back the history, pins or memory being cleared
+    async with get_session_queue().turn(session_id):
+        session = await _load_session(sessions, session_id)
+        await sessions.clear_messages(session)
 
     return {"message": "Messages cleared successfully"}
 
@@ -211,15 +519,15 @@ async def clear_messages(
 @router.post("/sessions/{session_id}/deactivate")
 async def deactivate_session(
         session_id: str,
-        sessions: Dict = Depends(get_chat_sessions)
+        sessions: SessionStore = Depends(get_chat_sessions)
 ):
     """Deactivate a chat session"""
-    if session_id not in sessions:
-        raise HTTPException(status_code=404, detail="Session not found")
-
-    session = sessions[session_id]
-    session.is_active = False
-    session.updated_at = datetime.utcnow()
+    # Queued like a turn, so a turn in flight can't save the session back as active
+    async with get_session_queue().turn(session_id):
+        session = await _load_session(sessions, session_id)
+        session.is_active = False
+        session.updated_at = datetime.utcnow()
+        await sessions.save(session)
 
     return {"message": "Session deactivated successfully"}
 
@@ -229,29 +537,28 @@ async def deactivate_session(
 async def create_bot(
         request: CreateBotRequest,
         chai_client: ChaiAPIClient = Depends(get_chai_client),
-        bots: Dict = Depends(get_bot_storage)
+        bots: BotStore = Depends(get_bot_storage)
 ):
     """Create a new bot with custom personality"""
     try:
         # Create personality prompt
         prompt = chai_client.create_personality_prompt(
             request.personality,
-            request.custom_traits
+            request.custom_traits,
+            request.custom_prompt
         )
 
-        if request.custom_prompt:
-            prompt += f"\n\n{request.custom_prompt}"
-
         # Create bot
         bot = Bot(
             name=request.name,
             personality=request.personality,
             prompt=prompt,
-            custom_traits=request.custom_traits
+            custom_traits=request.custom_traits,
+            context_budget=request.context_budget
         )
 
         # Store bot
-        bots[bot.id] = bot
+        await bots.create(bot)
 
         logger.info(f"Created bot: {bot.id} - {bot.name}")
         return bot
@@ -263,32 +570,29 @@ async def create_bot(
 
 @router.get("/bots", response_model=List[Bot])
 async def list_bots(
-        bots: Dict = Depends(get_bot_storage)
+        bots: BotStore = Depends(get_bot_storage)
 ):
     """List all available bots"""
-    return list(bots.values())
+    return await bots.load_all()
 
 
 @router.get("/bots/{bot_id}", response_model=Bot)
 async def get_bot(
         bot_id: str,
-        bots: Dict = Depends(get_bot_storage)
+        bots: BotStore = Depends(get_bot_storage)
 ):
     """Get a specific bot"""
-    if bot_id not in bots:
-        raise HTTPException(status_code=404, detail="Bot not found")
-
-    return bots[bot_id]
+    return await _load_bot(bots, bot_id)
 
 
 @router.delete("/bots/{bot_id}")
 async def delete_bot(
         bot_id: str,
-        bots: Dict = Depends(get_bot_storage)
+        bots: BotStore = Depends(get_bot_storage)
 ):
     """Delete a bot"""
-    if bot_id not in bots:
+    try:
+        await bots.delete(bot_id)
+    except KeyError:
         raise HTTPException(status_code=404, detail="Bot not found")
-
-    del bots[bot_id]
     return {"message": "Bot deleted successfully"}
\ No newline at end of file
@@ -0,0 +1,47 @@
+import asyncio
+import os
+import sys
+import threading
+
+# The app imports itself as "app", the way run.sh puts backend/ on PYTHONPATH,
+# and dependencies imports the main module as backend.app.main
+BACKEND = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, BACKEND)
+sys.path.insert(1, os.path.dirname(BACKEND))
+
+import pytest
+from aiohttp import web
+from fastapi.testclient import TestClient
+
+from tools.mock_upstream import MockUpstream
+
+
+def serve_in_thread(app: web.Application) -> str:
+    """Serve an aiohttp app from a daemon thread; returns its base URL"""
+    loop = asyncio.new_event_loop()
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    loop.run_until_complete(site.start())
+    port = site._server.sockets[0].getsockname()[1]
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return f"http://127.0.0.1:{port}"
+
+
+@pytest.fixture(scope="session")
+def api():
+    """The app on in-memory stores, against a mock upstream that answers at once, behind a TestClient"""
+    upstream = MockUpstream(latency="fixed:0", chunk_delay="fixed:0", response_size="short", seed=1)
+    with pytest.MonkeyPatch.context() as env:
+        env.setenv("CHAI_API_BASE_URL", serve_in_thread(upstream.app()))
+        env.setenv("CHAI_SESSION_STORE", "memory")
+        env.setenv("CHAI_UPSTREAM_RATE", "1000")
+        env.setenv("CHAI_UPSTREAM_BURST", "1000")
+        # Imported here, and before app.dependencies, which imports it back
+        import backend.app.main as main
+        from app import dependencies
+        dependencies.get_settings.cache_clear()
+
+        with TestClient(main.app) as client:
+            yield client
+    dependencies.get_settings.cache_clear()
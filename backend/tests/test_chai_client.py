@@ -0,0 +1,217 @@
+import asyncio
+import json
+import time
+
+import pytest
+from aiohttp import web
+
+from app.chai_client import ChaiAPIClient, ChaiAPIError
+from app.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+from app.rate_limiter import RateLimitExceeded
+
+
+def half_open_breaker() -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=1, recovery_time=0.01)
+    breaker.before_call()
+    breaker.record_failure()
+    time.sleep(0.02)
+    return breaker
+
+
+class RefusingLimiter:
+    waiting = 0
+
+    async def acquire(self):
+        raise RateLimitExceeded(5.0)
+
+
+async def upstream(status: int):
+    """Serve every chat request with the given status; returns the runner and its base URL"""
+    async def handle(request):
+        return web.json_response({"error": "rejected"}, status=status)
+
+    return await serve(handle)
+
+
+async def serve(handle):
+    """Serve every chat request with handle; returns the runner and its base URL"""
+    app = web.Application()
+    app.router.add_post("/endpoints/onsite/chat", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def test_trial_call_rejected_with_4xx_frees_the_half_open_slot():
+    breaker = half_open_breaker()
+    client = ChaiAPIClient("key", circuit_breaker=breaker)
+
+    async def rejected(body, bot_name):
+        raise ChaiAPIError("API error: Bad Request", status=400)
+
+    client._hedged_post = rejected
+
+    async def main():
+        for _ in range(3):
+            with pytest.raises(ChaiAPIError):
+                await client._call(b"{}", "Assistant")
+
+    asyncio.run(main())
+    assert breaker.state == HALF_OPEN
+    assert breaker.fast_failures == 0
+
+
+def test_trial_call_failing_upstream_reopens_the_circuit():
+    breaker = half_open_breaker()
+    client = ChaiAPIClient("key", circuit_breaker=breaker)
+
+    async def unavailable(body, bot_name):
+        raise ChaiAPIError("API error: Service Unavailable", status=503)
+
+    client._hedged_post = unavailable
+
+    async def main():
+        with pytest.raises(ChaiAPIError):
+            await client._call(b"{}", "Assistant")
+        with pytest.raises(CircuitOpenError):
+            await client._call(b"{}", "Assistant")
+
+    asyncio.run(main())
+    assert breaker.state == OPEN
+
+
+def test_trial_stream_rejected_with_4xx_frees_the_half_open_slot():
+    breaker = half_open_breaker()
+
+    async def main():
+        runner, base_url = await upstream(400)
+        client = ChaiAPIClient("key", base_url=base_url, circuit_breaker=breaker)
+        try:
+            for _ in range(3):
+                with pytest.raises(ChaiAPIError):
+                    async for _ in client.stream_message({"prompt": "p", "chat_history": []}, "hi"):
+                        pass
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert breaker.state == HALF_OPEN
+    assert breaker.fast_failures == 0
+
+
+def test_trial_stream_refused_by_the_rate_limiter_frees_the_half_open_slot():
+    breaker = half_open_breaker()
+    client = ChaiAPIClient("key", rate_limiter=RefusingLimiter(), circuit_breaker=breaker)
+
+    async def main():
+        try:
+            for _ in range(3):
+                with pytest.raises(RateLimitExceeded):
+                    async for _ in client.stream_message({"prompt": "p", "chat_history": []}, "hi"):
+                        pass
+        finally:
+            await client.close()
+
+    asyncio.run(main())
+    assert breaker.state == HALF_OPEN
+    # The next trial is still admitted, and its success closes the circuit
+    breaker.before_call()
+    breaker.record_success()
+    assert breaker.state == CLOSED
+
+
+def test_refused_requests_are_not_logged_as_upstream_errors(caplog):
+    client = ChaiAPIClient("key", rate_limiter=RefusingLimiter())
+    data = {"prompt": "p", "chat_history": []}
+
+    async def main():
+        try:
+            with pytest.raises(RateLimitExceeded):
+                await client.send_message(data, "hi")
+            with pytest.raises(RateLimitExceeded):
+                async for _ in client.stream_message(data, "hi"):
+                    pass
+        finally:
+            await client.close()
+
+    with caplog.at_level("ERROR", logger="app.chai_client"):
+        asyncio.run(main())
+    assert caplog.records == []
+
+
+async def sse_reply(request, deltas, done=True):
+    response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+    await response.prepare(request)
+    for delta in deltas:
+        await response.write(f"data: {json.dumps({'delta': delta})}\n\n".encode("utf-8"))
+    if done:
+        await response.write(b"data: [DONE]\n\n")
+    return response
+
+
+def stream_reply(handle):
+    """Stream one reply from an upstream served by handle; returns the chunks and the breaker"""
+    breaker = CircuitBreaker(failure_threshold=1)
+
+    async def main():
+        runner, base_url = await serve(handle)
+        client = ChaiAPIClient("key", base_url=base_url, circuit_breaker=breaker)
+        try:
+            return [chunk async for chunk in client.stream_message({"prompt": "p", "chat_history": []}, "hi")]
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    return asyncio.run(main()), breaker
+
+
+def test_stream_yields_upstream_chunks_as_they_arrive():
+    accepted = []
+
+    async def handle(request):
+        accepted.append(request.headers["Accept"])
+        return await sse_reply(request, ["Hel", "lo ", "there"])
+
+    chunks, breaker = stream_reply(handle)
+    assert chunks == ["Hel", "lo ", "there"]
+    assert "text/event-stream" in accepted[0]
+    assert breaker.state == CLOSED
+
+
+def test_stream_falls_back_to_a_single_chunk_when_upstream_answers_with_json():
+    async def handle(request):
+        return web.json_response({"model_output": "the whole reply"})
+
+    assert stream_reply(handle)[0] == ["the whole reply"]
+
+
+def test_stream_cut_off_partway_raises_and_counts_as_an_upstream_failure():
+    async def handle(request):
+        # Promise more than is sent, then drop the connection
+        response = web.StreamResponse(headers={"Content-Type": "text/event-stream", "Content-Length": "1000"})
+        await response.prepare(request)
+        await response.write(b'data: {"delta": "partial"}\n\n')
+        request.transport.close()
+        return response
+
+    received = []
+    breaker = CircuitBreaker(failure_threshold=1)
+
+    async def main():
+        runner, base_url = await serve(handle)
+        client = ChaiAPIClient("key", base_url=base_url, circuit_breaker=breaker)
+        try:
+            with pytest.raises(ChaiAPIError, match="Stream interrupted"):
+                async for chunk in client.stream_message({"prompt": "p", "chat_history": []}, "hi"):
+                    received.append(chunk)
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    asyncio.run(main())
+    assert received == ["partial"]
+    assert breaker.state == OPEN
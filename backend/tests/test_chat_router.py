@@ -0,0 +1,132 @@
+import base64
+import json
+from datetime import datetime, timedelta, timezone
+
+import backend.app.main as main
+from app.rate_limiter import RateLimitExceeded
+
+
+class RefusingLimiter:
+    waiting = 0
+
+    async def acquire(self):
+        raise RateLimitExceeded(4.2)
+
+
+def create_session(api) -> str:
+    response = api.post("/api/chat/create", json={"bot_name": "Bot", "user_name": "User"})
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def test_throttled_send_tells_the_client_when_to_retry(api):
+    session_id = create_session(api)
+    limiter = main.chai_client.rate_limiter
+    main.chai_client.rate_limiter = RefusingLimiter()
+    try:
+        response = api.post("/api/chat/send", json={"session_id": session_id, "message": "hello"})
+    finally:
+        main.chai_client.rate_limiter = limiter
+
+    assert response.status_code == 429
+    assert response.headers["Retry-After"] == "5"
+
+
+
+def test_session_list_pages_whole_sessions_and_summaries_list_leaves_out_messages(api):
+    first, second, third = (create_session(api) for _ in range(3))
+    api.post("/api/chat/send", json={"session_id": first, "message": "hello"})
+
+    page = api.get("/api/chat/sessions", params={"limit": 2}).json()
+    assert [s["id"] for s in page["sessions"]] == [first, third]
+    messages = page["sessions"][0]["messages"]
+    assert [m["sender"] for m in messages] == ["User", "Bot"]
+    assert messages[0]["content"] == "hello"
+    following = api.get("/api/chat/sessions", params={"limit": 1, "cursor": page["next_cursor"]}).json()
+    assert [s["id"] for s in following["sessions"]] == [second]
+
+    summaries = api.get("/api/chat/sessions/summaries", params={"limit": 2}).json()
+    assert [s["id"] for s in summaries["sessions"]] == [first, third]
+    assert summaries["sessions"][0]["message_count"] == 2
+    assert "messages" not in summaries["sessions"][0]
+    assert summaries["total"] == page["total"]
+
+
+def test_session_list_accepts_a_cursor_with_a_utc_offset(api):
+    older, newer = create_session(api), create_session(api)
+    summary = api.get(f"/api/chat/sessions/{newer}").json()
+    # The same position as newer's own cursor, written in another timezone
+    updated_at = datetime.fromisoformat(summary["updated_at"]).replace(tzinfo=timezone.utc)
+    stamp = updated_at.astimezone(timezone(timedelta(hours=2))).isoformat()
+    cursor = base64.urlsafe_b64encode(f"{stamp}|{newer}".encode("utf-8")).decode("ascii")
+
+    for path in ("/api/chat/sessions", "/api/chat/sessions/summaries"):
+        response = api.get(path, params={"limit": 1, "cursor": cursor})
+        assert response.status_code == 200
+        assert [s["id"] for s in response.json()["sessions"]] == [older]
+
+
+def sse_events(body: str) -> list:
+    events = []
+    for frame in body.strip().split("\n\n"):
+        event, data = frame.split("\n")
+        events.append((event[len("event: "):], json.loads(data[len("data: "):])))
+    return events
+
+
+def test_streamed_send_relays_chunks_and_commits_the_turn_once_done(api):
+    session_id = create_session(api)
+    response = api.post("/api/chat/send", params={"stream": "true"}, json={"session_id": session_id, "message": "hello"})
+    assert response.headers["content-type"].startswith("text/event-stream")
+
+    events = sse_events(response.text)
+    kinds = [kind for kind, _ in events]
+    assert kinds[0] == "history" and kinds[-1] == "done"
+    assert set(kinds[1:-1]) == {"chunk"}
+    reply = "".join(data["delta"] for kind, data in events if kind == "chunk")
+    assert reply.startswith("(1) hello")
+    assert events[-1][1]["response"] == reply
+
+    messages = api.get(f"/api/chat/sessions/{session_id}/messages").json()["messages"]
+    assert [m["content"] for m in messages] == ["hello", reply]
+
+
+def test_websocket_streams_chunk_frames_then_done(api):
+    session_id = create_session(api)
+    with api.websocket_connect(f"/ws/chat/{session_id}") as ws:
+        ws.send_json({"message": "hello", "stream": True})
+        frames = []
+        while not frames or frames[-1].get("type") not in ("done", "error"):
+            frames.append(ws.receive_json())
+
+    assert frames[-1]["type"] == "done"
+    assert {frame["type"] for frame in frames[:-1]} == {"chunk"}
+    assert "".join(frame["delta"] for frame in frames[:-1]) == frames[-1]["message"]
+
+
+def test_session_list_rejects_a_malformed_cursor(api):
+    for path in ("/api/chat/sessions", "/api/chat/sessions/summaries"):
+        assert api.get(path, params={"cursor": "not a cursor"}).status_code == 400
+
+
+def test_message_pages_walk_back_from_the_tail_and_poll_forward(api):
+    session_id = create_session(api)
+    for n in range(3):
+        api.post("/api/chat/send", json={"session_id": session_id, "message": f"message {n}"})
+
+    def page(**params):
+        body = api.get(f"/api/chat/sessions/{session_id}/messages", params={"limit": 2, **params}).json()
+        return [m["seq"] for m in body["messages"]], body["has_earlier"], body["has_later"]
+
+    assert page(tail="true") == ([4, 5], True, False)
+    assert page(before=4) == ([2, 3], True, True)
+    assert page(before=2) == ([0, 1], False, True)
+    assert page(after=-1) == ([0, 1], False, True)
+    assert page(after=3) == ([4, 5], True, False)
+    assert page(after=5) == ([], True, False)
+    assert page(offset=1) == ([1, 2], True, True)
+
+    messages = api.get(f"/api/chat/sessions/{session_id}/messages", params={"before": 2}).json()["messages"]
+    assert messages[0]["content"] == "message 0"
+    response = api.get(f"/api/chat/sessions/{session_id}/messages", params={"before": 2, "tail": "true"})
+    assert response.status_code == 400
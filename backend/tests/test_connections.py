@@ -0,0 +1,112 @@
+import asyncio
+
+from app.connections import CLOSE_EVICTED, ConnectionManager
+
+
+class FakeWebSocket:
+    def __init__(self, stalled: bool = False):
+        self.sent = []
+        self.closed_with = None
+        # A stalled client never finishes receiving, so its queue backs up
+        self.unstalled = asyncio.Event()
+        if not stalled:
+            self.unstalled.set()
+
+    async def accept(self):
+        pass
+
+    async def send_json(self, frame):
+        await self.unstalled.wait()
+        self.sent.append(frame)
+
+    async def close(self, code: int = 1000, reason: str = ""):
+        self.closed_with = code
+
+
+async def settle():
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+def test_broadcast_reaches_every_other_socket_on_the_session():
+    async def main():
+        manager = ConnectionManager()
+        sockets = [FakeWebSocket() for _ in range(4)]
+        origin = await manager.connect(sockets[0], "s")
+        for ws in sockets[1:3]:
+            await manager.connect(ws, "s")
+        await manager.connect(sockets[3], "elsewhere")
+
+        published = []
+
+        async def publish(session_id, frame):
+            published.append((session_id, frame))
+
+        manager.publish = publish
+        delivered = await manager.broadcast("s", {"type": "message"}, exclude=origin)
+        await settle()
+        await manager.close()
+        return delivered, [ws.sent for ws in sockets], published
+
+    delivered, sent, published = asyncio.run(main())
+    assert delivered == 2
+    assert sent == [[], [{"type": "message"}], [{"type": "message"}], []]
+    assert published == [("s", {"type": "message"})]
+
+
+def test_slow_consumer_is_evicted_without_holding_back_the_others():
+    async def main():
+        manager = ConnectionManager(max_queue=1)
+        slow_ws, fast_ws = FakeWebSocket(stalled=True), FakeWebSocket()
+        await manager.connect(slow_ws, "s")
+        await manager.connect(fast_ws, "s")
+
+        for n in range(3):
+            await manager.broadcast("s", {"n": n})
+            await settle()
+        stats = manager.stats()
+        await manager.close()
+        return slow_ws, fast_ws, stats
+
+    slow_ws, fast_ws, stats = asyncio.run(main())
+    assert slow_ws.closed_with == CLOSE_EVICTED
+    assert fast_ws.sent == [{"n": 0}, {"n": 1}, {"n": 2}]
+    assert stats == {"connections": 1, "sessions": 1, "evicted": 1}
+
+
+def test_send_gives_up_and_evicts_after_send_timeout():
+    async def main():
+        manager = ConnectionManager(max_queue=1, send_timeout=0.01)
+        ws = FakeWebSocket(stalled=True)
+        connection = await manager.connect(ws, "s")
+        results = [await manager.send(connection, {"n": n}) for n in range(3)]
+        await settle()
+        remaining = len(manager)
+        await manager.close()
+        return results, ws.closed_with, remaining
+
+    # One frame is with the stalled sender, one fills the queue, the third times out
+    assert asyncio.run(main()) == ([True, True, False], CLOSE_EVICTED, 0)
+
+
+def test_heartbeat_pings_and_evicts_silent_sockets_but_not_busy_ones():
+    async def main():
+        manager = ConnectionManager(ping_interval=0.01, ping_timeout=0.05)
+        silent_ws, busy_ws = FakeWebSocket(), FakeWebSocket()
+        await manager.connect(silent_ws, "s")
+        busy = await manager.connect(busy_ws, "s")
+        busy.busy = 1
+
+        await asyncio.sleep(0.03)
+        pinged = {"type": "ping"} in silent_ws.sent
+        await asyncio.sleep(0.1)
+        await settle()
+        remaining = manager.listeners("s")
+        await manager.close()
+        return pinged, silent_ws.closed_with, remaining == [busy], busy_ws.sent
+
+    pinged, closed_with, busy_kept, busy_sent = asyncio.run(main())
+    assert pinged
+    assert closed_with == CLOSE_EVICTED
+    assert busy_kept
+    assert busy_sent == []
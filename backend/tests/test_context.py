@@ -0,0 +1,62 @@
+from app.context import ContextBudgeter, history_window, session_budget
+from app.history_buffer import HistoryBuffer
+from app.models import Bot, ChatMessage, ChatSession, PersonalityType
+
+
+def budgeter() -> ContextBudgeter:
+    # One token per character and no per-message overhead, so costs are easy to read off
+    return ContextBudgeter(max_tokens=100, chars_per_token=1, message_overhead=0)
+
+
+def buffer(*contents: str) -> HistoryBuffer:
+    history = HistoryBuffer(budgeter().message_cost)
+    history.extend(("U", content) for content in contents)
+    return history
+
+
+def sent(window) -> list:
+    return [entry["message"] for entry in window.chat_history.to_list()]
+
+
+def test_window_keeps_the_newest_messages_that_fit_the_budget():
+    # Each entry costs 1 (sender) + 9 (content)
+    window = budgeter().window(buffer(*(f"message {i}" for i in range(10))), budget=35)
+    assert sent(window) == ["message 7", "message 8", "message 9"]
+    assert window.tokens == 30 and window.tokens <= window.budget
+    assert window.stats() == {"total": 10, "sent": 3, "trimmed": 7, "tokens": 30, "budget": 35}
+
+
+def test_reserve_and_floor_shrink_the_window():
+    history = buffer(*(f"message {i}" for i in range(10)))
+    assert sent(budgeter().window(history, budget=35, reserve=10)) == ["message 8", "message 9"]
+    assert sent(budgeter().window(history, budget=1000, floor=8)) == ["message 8", "message 9"]
+
+
+def test_pinned_messages_are_always_sent_and_paid_for_first():
+    history = buffer(*(f"message {i}" for i in range(10)))
+    window = budgeter().window(history, budget=35, pinned=[1, 8, 42])
+    # message 1 is sent ahead of the window, whose budget it shrinks; 8 falls inside the window anyway, 42 does not exist
+    assert sent(window) == ["message 1", "message 8", "message 9"]
+    assert window.tokens == 30
+
+
+def test_pinned_messages_are_sent_even_when_they_alone_exceed_the_budget():
+    history = buffer("x" * 50, "recent")
+    window = budgeter().window(history, budget=20, pinned=[0])
+    assert sent(window) == ["x" * 50]
+    assert window.tokens == 51
+
+
+def test_session_budget_prefers_the_session_then_the_bot_then_the_default():
+    bot = Bot(name="B", personality=PersonalityType.FRIENDLY, prompt="p", context_budget=300)
+    assert session_budget(budgeter(), ChatSession(prompt="p", context_budget=200), bot) == 200
+    assert session_budget(budgeter(), ChatSession(prompt="p"), bot) == 300
+    assert session_budget(budgeter(), ChatSession(prompt="p")) == 100
+
+
+def test_history_window_leaves_room_for_the_new_message_and_the_memory():
+    session = ChatSession(prompt="p", user_name="U", memory="m" * 10, context_budget=45)
+    session.messages.extend([ChatMessage(sender="U", content=f"message {i}") for i in range(10)])
+    # 10 for the memory and 1 + 9 for the new message leave room for two entries
+    window = history_window(budgeter(), session, "message x")
+    assert sent(window) == ["message 8", "message 9"]
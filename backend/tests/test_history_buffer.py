@@ -0,0 +1,87 @@
+import json
+
+from app.chai_client import ChaiAPIClient
+from app.context import ContextBudgeter, history_window
+from app.history_buffer import EncodedHistory, HistoryBuffer, history_buffer
+from app.message_log import MessageLog
+from app.models import ChatMessage, ChatSession
+
+MESSAGES = [
+    ("User", "hello"),
+    ("Bot", 'quotes " and \\ backslashes'),
+    ("User", "naïve café ☕ and 日本語"),
+    ("Bot", "line\nbreaks\tand tabs"),
+]
+
+
+def session_with(messages) -> ChatSession:
+    session = ChatSession(prompt="Be kind", bot_name="Bot", user_name="User", memory="earlier")
+    session.messages.extend([ChatMessage(sender=sender, content=content) for sender, content in messages])
+    return session
+
+
+def old_body(client: ChaiAPIClient, session: ChatSession, user_message: str) -> dict:
+    """The request body as it was built before the history was pre-encoded"""
+    return {
+        "memory": session.memory,
+        "prompt": client._prepare_prompt(session.prompt),
+        "bot_name": session.bot_name,
+        "user_name": session.user_name,
+        "chat_history": [{"sender": s, "message": m} for s, m in MESSAGES] + [
+            {"sender": session.user_name, "message": user_message}
+        ],
+    }
+
+
+def test_encoded_history_builds_the_same_request_body_as_the_old_path():
+    client = ChaiAPIClient("key")
+    session = session_with(MESSAGES)
+    window = history_window(ContextBudgeter(max_tokens=10000), session, "what's new?")
+    assert isinstance(window.chat_history, EncodedHistory)
+
+    body = client._encode_request({
+        "prompt": session.prompt,
+        "bot_name": session.bot_name,
+        "user_name": session.user_name,
+        "chat_history": window.chat_history,
+        "memory": session.memory
+    }, user_message="what's new?")
+    assert json.loads(body) == old_body(client, session, "what's new?")
+
+    # The plain list form still encodes to the same body
+    plain = client._encode_request({
+        "prompt": session.prompt,
+        "bot_name": session.bot_name,
+        "user_name": session.user_name,
+        "chat_history": window.chat_history.to_list(),
+        "memory": session.memory
+    }, user_message="what's new?")
+    assert plain == body
+
+
+def test_selected_ranges_decode_to_the_selected_entries():
+    buffer = HistoryBuffer(lambda sender, content: 1)
+    buffer.extend(MESSAGES)
+    selection = EncodedHistory(buffer, [(0, 1), (2, 2), (3, 4)])
+
+    expected = [{"sender": s, "message": m} for s, m in (MESSAGES[0], MESSAGES[3])]
+    assert len(selection) == 2
+    assert selection.to_list() == expected
+    assert json.loads(b"[" + selection.tail(1)[:-1] + b"]") == expected[1:]
+    assert EncodedHistory(buffer, []).to_list() == []
+
+
+def test_history_buffer_encodes_only_new_messages_and_restarts_after_a_clear():
+    session = session_with(MESSAGES[:2])
+    cost = lambda sender, content: 1
+    buffer = history_buffer(session, cost)
+    encoded = bytes(buffer.slice(0))
+
+    session.messages.extend([ChatMessage(sender=s, content=m) for s, m in MESSAGES[2:]])
+    assert history_buffer(session, cost) is buffer
+    assert len(buffer) == 4
+    assert bytes(buffer.slice(0, 2)) == encoded
+
+    session.messages = MessageLog()
+    cleared = history_buffer(session, cost)
+    assert cleared is not buffer and len(cleared) == 0
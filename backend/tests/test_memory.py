@@ -0,0 +1,113 @@
+import asyncio
+
+from app.memory import ExtractiveSummarizer, MemoryCompactor, Summarizer, load_summarizer
+from app.models import ChatMessage, ChatSession
+from app.session_queue import SessionQueue
+from app.session_store import InMemorySessionStore
+
+
+class JoiningSummarizer(Summarizer):
+    """Memory is every compacted message, so tests can see exactly what was folded in"""
+
+    def __init__(self):
+        self.calls = 0
+        self.release = None
+
+    async def summarize(self, memory, messages):
+        self.calls += 1
+        if self.release is not None:
+            await self.release.wait()
+        return "|".join(filter(None, [memory] + [m.content for m in messages]))
+
+
+def stored_session(sessions, count: int) -> ChatSession:
+    session = ChatSession(prompt="prompt")
+    session.messages.extend([ChatMessage(sender="User", content=str(i)) for i in range(count)])
+    sessions[session.id] = session
+    return session
+
+
+def compactor(summarizer: Summarizer) -> MemoryCompactor:
+    queue = SessionQueue()
+    return MemoryCompactor(summarizer, lambda: queue, compact_after=5, keep_recent=2)
+
+
+def test_compaction_folds_all_but_the_most_recent_turns_into_memory():
+    sessions = InMemorySessionStore()
+    session = stored_session(sessions, 6)
+    memory = compactor(JoiningSummarizer())
+    assert memory.needs_compaction(session)
+
+    asyncio.run(memory.compact(sessions, session))
+    assert session.memory == "0|1|2|3"
+    assert session.memory_upto == 4
+    assert not memory.needs_compaction(session)
+
+    # The next round builds on the memory so far
+    session.messages.extend([ChatMessage(sender="User", content=str(i)) for i in range(6, 10)])
+    asyncio.run(memory.compact(sessions, session))
+    assert session.memory == "0|1|2|3|4|5|6|7"
+    assert session.memory_upto == 8
+
+
+def test_compaction_result_is_dropped_if_the_session_was_cleared_meanwhile():
+    sessions = InMemorySessionStore()
+    session = stored_session(sessions, 6)
+    summarizer = JoiningSummarizer()
+    memory = compactor(summarizer)
+
+    async def main():
+        summarizer.release = asyncio.Event()
+        compaction = asyncio.create_task(memory.compact(sessions, session))
+        await asyncio.sleep(0)
+        await sessions.clear_messages(session)
+        summarizer.release.set()
+        await compaction
+
+    asyncio.run(main())
+    assert summarizer.calls == 1
+    assert session.memory == "" and session.memory_upto == 0
+
+
+def test_scheduled_sessions_are_compacted_once_in_the_background():
+    sessions = InMemorySessionStore()
+    session = stored_session(sessions, 6)
+    short = stored_session(sessions, 3)
+    summarizer = JoiningSummarizer()
+    memory = compactor(summarizer)
+
+    async def main():
+        memory.schedule(sessions, session)
+        memory.schedule(sessions, session)
+        memory.schedule(sessions, short)
+        for _ in range(10):
+            await asyncio.sleep(0)
+        await memory.close()
+
+    asyncio.run(main())
+    assert summarizer.calls == 1
+    assert session.memory_upto == 4
+    assert short.memory_upto == 0
+
+
+def test_extractive_summary_keeps_salient_sentences_in_order_within_max_chars():
+    messages = [
+        ChatMessage(sender="User", content="My dog Rex loves the beach. It rained today."),
+        ChatMessage(sender="Bot", content="Rex sounds lovely! Does Rex swim at the beach?"),
+        ChatMessage(sender="User", content="Ok."),
+    ]
+    summary = ExtractiveSummarizer(max_chars=75).condense("", messages)
+    assert summary == "User: My dog Rex loves the beach.\nBot: Does Rex swim at the beach?"
+
+    # With room for everything, every sentence but the too-short "Ok." is kept, in order
+    assert ExtractiveSummarizer().condense("", messages).splitlines() == [
+        "User: My dog Rex loves the beach.",
+        "User: It rained today.",
+        "Bot: Rex sounds lovely!",
+        "Bot: Does Rex swim at the beach?",
+    ]
+
+
+def test_load_summarizer_by_name_or_import_path():
+    assert isinstance(load_summarizer("extractive"), ExtractiveSummarizer)
+    assert isinstance(load_summarizer("app.memory:ExtractiveSummarizer"), ExtractiveSummarizer)
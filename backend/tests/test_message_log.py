@@ -0,0 +1,54 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+from app.message_log import MessageLog
+from app.models import ChatMessage, ChatSession
+
+MESSAGES = [
+    ChatMessage(sender="User", content="hello", timestamp=datetime(2024, 1, 1, 12, 0, 0, 123456)),
+    ChatMessage(sender="Bot", content="naïve café ☕", timestamp=datetime(2024, 1, 1, 12, 0, 1), metadata={"k": 1}),
+    ChatMessage(sender="User", content="", timestamp=datetime(2024, 1, 1, 12, 0, 2)),
+]
+
+
+def fields(message: ChatMessage) -> tuple:
+    return message.sender, message.content, message.timestamp, message.metadata
+
+
+def test_messages_read_back_as_they_went_in():
+    log = MessageLog(MESSAGES)
+    assert len(log) == 3
+    assert [fields(m) for m in log] == [fields(m) for m in MESSAGES]
+    assert [m.seq for m in log] == [0, 1, 2]
+    assert fields(log[-2]) == fields(MESSAGES[1])
+    assert [m.content for m in log[1:]] == ["naïve café ☕", ""]
+    assert list(log.entries(1, 2)) == [("Bot", "naïve café ☕")]
+    with pytest.raises(IndexError):
+        log.content(3)
+
+
+def test_aware_timestamps_are_stored_as_naive_utc():
+    log = MessageLog()
+    log.add("User", "hi", datetime(2024, 1, 1, 12, tzinfo=timezone.utc))
+    assert log.timestamp(0) == datetime(2024, 1, 1, 12)
+
+
+def test_metadata_read_back_is_a_copy():
+    log = MessageLog(MESSAGES)
+    log[1].metadata["k"] = 2
+    assert log.metadata(1) == {"k": 1}
+    assert log.metadata(0) == {}
+
+
+def test_session_serializes_and_validates_messages_as_a_plain_list():
+    session = ChatSession(prompt="prompt", messages=MESSAGES)
+    assert isinstance(session.messages, MessageLog)
+
+    data = json.loads(session.model_dump_json())
+    assert [m["content"] for m in data["messages"]] == ["hello", "naïve café ☕", ""]
+    assert data["messages"][0]["timestamp"] == "2024-01-01T12:00:00.123456"
+
+    restored = ChatSession(**data)
+    assert [fields(m) for m in restored.messages] == [fields(m) for m in MESSAGES]
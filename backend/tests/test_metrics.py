@@ -0,0 +1,22 @@
+import backend.app.main as main
+
+
+def test_requests_are_labelled_with_the_route_template_even_when_a_parameter_repeats_a_segment(api):
+    # The session id "sessions" is also a literal segment of the route
+    assert api.get("/api/chat/sessions/sessions").status_code == 404
+    assert api.get("/api/chat/nowhere").status_code == 404
+
+    exposition = api.get("/metrics").text
+    assert 'route="/api/chat/sessions/{session_id}",status="404"' in exposition
+    assert 'route="/api/chat/{session_id}/{session_id}"' not in exposition
+    assert 'route="unmatched",status="404"' in exposition
+
+
+def test_connector_pool_reports_the_limit_and_usage(api):
+    session_id = api.post("/api/chat/create", json={}).json()["id"]
+    assert api.post("/api/chat/send", json={"session_id": session_id, "message": "hello"}).status_code == 200
+
+    pool = main._connector_pool()
+    assert pool[("limit",)] == main.chai_client.session.connector.limit
+    assert pool[("in_use",)] == 0
+    assert pool[("idle",)] >= 0
@@ -0,0 +1,55 @@
+from app.models import Bot, ChatSession, PersonalityType
+from app.prompts import DEFAULT_PERSONA_PROMPT, PERSONA_PROMPTS, SAFETY_PROMPT, PromptRegistry, registry
+
+
+def copy_of(text: str) -> str:
+    # A distinct but equal string object
+    return "".join(list(text))
+
+
+def test_equal_prompts_are_interned_to_one_shared_copy():
+    prompts = PromptRegistry()
+    first = prompts.intern(copy_of("You are a pirate."))
+    second = copy_of("You are a pirate.")
+    assert second is not first
+    assert prompts.intern(second) is first
+
+
+def test_sessions_and_bots_of_one_persona_share_its_prompt():
+    prompt = registry.persona("friendly")
+    session = ChatSession(prompt=copy_of(prompt))
+    bot = Bot(name="B", personality=PersonalityType.FRIENDLY, prompt=copy_of(prompt))
+    assert session.prompt is prompt and bot.prompt is prompt
+
+
+def test_persona_prompts_carry_the_safety_prompt_and_any_extras():
+    prompts = PromptRegistry()
+    assert prompts.persona("creative") == f"{SAFETY_PROMPT}\n\n{PERSONA_PROMPTS['creative']}"
+    assert prompts.persona("unknown") == f"{SAFETY_PROMPT}\n\n{DEFAULT_PERSONA_PROMPT}"
+
+    custom = prompts.persona("creative", ["witty", "kind"], "Talk about jazz.")
+    assert custom.endswith("\n\nAdditional traits: witty, kind\n\nTalk about jazz.")
+    assert prompts.persona("creative", ["witty", "kind"], "Talk about jazz.") is custom
+
+
+def test_upstream_prompt_has_the_safety_prompt_in_front_exactly_once():
+    prompts = PromptRegistry()
+    persona = prompts.persona("friendly")
+    assert prompts.upstream(persona) is persona
+    assert prompts.upstream("") == SAFETY_PROMPT
+
+    custom = prompts.upstream("Only speak in haiku.")
+    assert custom == f"{SAFETY_PROMPT}\n\nOnly speak in haiku."
+    assert prompts.upstream(copy_of("Only speak in haiku.")) is custom
+
+
+def test_tables_are_bounded_and_drop_the_least_recently_used_prompt():
+    prompts = PromptRegistry(max_entries=2)
+    kept = prompts.intern(copy_of("kept"))
+    prompts.intern(copy_of("dropped"))
+    assert prompts.intern(copy_of("kept")) is kept
+    prompts.intern(copy_of("newest"))
+
+    assert prompts.intern(copy_of("kept")) is kept
+    dropped = copy_of("dropped")
+    assert prompts.intern(dropped) is dropped
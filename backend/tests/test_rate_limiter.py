@@ -0,0 +1,65 @@
+import asyncio
+import time
+from datetime import datetime, timedelta, timezone
+from email.utils import format_datetime
+
+import pytest
+
+from app.rate_limiter import AdaptiveRateLimiter, RateLimitExceeded, parse_retry_after
+
+
+def test_throttle_decreases_multiplicatively_once_per_cooldown():
+    limiter = AdaptiveRateLimiter(rate=8.0, min_rate=1.5, decrease=0.5, cooldown=60.0)
+    limiter.on_throttle(retry_after=0)
+    assert limiter.rate == 4.0
+    limiter.on_throttle(retry_after=0)
+    assert limiter.rate == 4.0
+    assert limiter.throttled == 2
+
+    limiter = AdaptiveRateLimiter(rate=2.0, min_rate=1.5, decrease=0.5, cooldown=0.0)
+    limiter.on_throttle(retry_after=0)
+    assert limiter.rate == 1.5
+
+
+def test_success_increases_additively_up_to_max_rate():
+    limiter = AdaptiveRateLimiter(rate=2.0, max_rate=3.0, increase=1.0)
+    limiter.on_success()
+    assert limiter.rate == 2.5
+    for _ in range(10):
+        limiter.on_success()
+    assert limiter.rate == 3.0
+
+
+def test_acquire_paces_callers_to_the_rate():
+    limiter = AdaptiveRateLimiter(rate=20.0, burst=1.0)
+
+    async def main():
+        started = time.monotonic()
+        for _ in range(3):
+            await limiter.acquire()
+        return time.monotonic() - started
+
+    # The burst covers the first call; the other two wait 1/rate each
+    assert asyncio.run(main()) >= 0.09
+
+
+def test_acquire_refuses_callers_that_would_wait_past_max_wait():
+    limiter = AdaptiveRateLimiter(rate=10.0, burst=1.0, max_wait=0.5)
+    limiter.on_throttle(retry_after=5.0)
+
+    async def main():
+        with pytest.raises(RateLimitExceeded) as raised:
+            await limiter.acquire()
+        return raised.value
+
+    assert asyncio.run(main()).retry_after > 0.5
+    assert limiter.rejected == 1
+    assert limiter.waiting == 0
+
+
+def test_parse_retry_after():
+    assert parse_retry_after("2.5") == 2.5
+    assert parse_retry_after(None) is None
+    assert parse_retry_after("soon") is None
+    later = datetime.now(timezone.utc) + timedelta(seconds=30)
+    assert 25 < parse_retry_after(format_datetime(later, usegmt=True)) <= 30
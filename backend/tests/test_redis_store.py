@@ -0,0 +1,122 @@
+import asyncio
+import socket
+
+import pytest
+
+from app.models import ChatMessage, ChatSession
+from app.redis_store import (
+    LOCK_KEY,
+    MESSAGES_KEY,
+    SESSION_KEY,
+    RedisSessionStore,
+    SessionLockTimeout,
+    SharedSessionQueue,
+    connect
+)
+from tools.resp_server import RespServer
+
+
+@pytest.fixture(scope="module")
+def redis_url():
+    """A stand-in server for the whole module; each test uses its own session ids"""
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        port = s.getsockname()[1]
+    return RespServer().start_in_thread(port=port)
+
+
+def test_turns_on_a_session_never_overlap_across_workers(redis_url):
+    async def main():
+        clients = [connect(redis_url), connect(redis_url)]
+        queues = [SharedSessionQueue(client, poll_interval=0.01) for client in clients]
+        running, overlaps = set(), []
+
+        async def turn(queue, n):
+            async with queue.turn("serial"):
+                if running:
+                    overlaps.append(n)
+                running.add(n)
+                await asyncio.sleep(0.01)
+                running.discard(n)
+
+        await asyncio.gather(*(turn(queues[n % 2], n) for n in range(6)))
+        for client in clients:
+            await client.aclose()
+        return overlaps
+
+    assert asyncio.run(main()) == []
+
+
+def test_unlock_leaves_a_lock_taken_over_by_another_worker(redis_url):
+    async def main():
+        client = connect(redis_url)
+        queue = SharedSessionQueue(client)
+        key = LOCK_KEY.format("taken-over")
+        async with queue.turn("taken-over"):
+            # As if the lease expired mid-turn and another worker took the lock
+            await client.set(key, "other-worker")
+        owner = await client.get(key)
+        await client.aclose()
+        return owner
+
+    assert asyncio.run(main()) == b"other-worker"
+
+
+def test_lock_acquire_gives_up_after_lock_timeout(redis_url):
+    async def main():
+        clients = [connect(redis_url), connect(redis_url)]
+        holder = SharedSessionQueue(clients[0])
+        waiter = SharedSessionQueue(clients[1], lock_timeout=0.1, poll_interval=0.02)
+        async with holder.turn("busy"):
+            with pytest.raises(SessionLockTimeout) as raised:
+                async with waiter.turn("busy"):
+                    pass
+        # Released, so the next attempt gets through
+        async with waiter.turn("busy"):
+            pass
+        for client in clients:
+            await client.aclose()
+        return raised.value
+
+    error = asyncio.run(main())
+    assert error.retry_after == 0.02
+    assert "busy" in str(error)
+
+
+def test_write_to_a_session_deleted_by_another_worker_does_not_recreate_it(redis_url):
+    async def main():
+        clients = [connect(redis_url), connect(redis_url)]
+        mine, other = RedisSessionStore(clients[0]), RedisSessionStore(clients[1])
+        session = ChatSession(prompt="prompt")
+        await mine.create(session)
+        await other.load_summaries()
+        stale = await other.load(session.id)
+
+        await mine.delete(session.id)
+        await other.append_messages(stale, [ChatMessage(sender="User", content="late")])
+        remaining = await clients[0].exists(SESSION_KEY.format(session.id), MESSAGES_KEY.format(session.id))
+        for client in clients:
+            await client.aclose()
+        return remaining, session.id in other
+
+    assert asyncio.run(main()) == (0, False)
+
+
+def test_write_from_a_worker_that_has_not_seen_the_session_created(redis_url):
+    async def main():
+        clients = [connect(redis_url), connect(redis_url)]
+        mine, other = RedisSessionStore(clients[0]), RedisSessionStore(clients[1])
+        await other.load_summaries()
+        session = ChatSession(prompt="prompt")
+        await mine.create(session)
+
+        # other never got the creation event, but can still load and use the session
+        theirs = await other.load(session.id)
+        await other.append_messages(theirs, [ChatMessage(sender="User", content="hello")])
+        stored = await clients[0].llen(MESSAGES_KEY.format(session.id))
+        reloaded = await mine.load(session.id)
+        for client in clients:
+            await client.aclose()
+        return stored, reloaded.messages.content(-1), other.summary(session.id).message_count
+
+    assert asyncio.run(main()) == (1, "hello", 1)
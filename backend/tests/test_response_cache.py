@@ -0,0 +1,63 @@
+import time
+
+from app.context import ContextBudgeter
+from app.history_buffer import EncodedHistory, HistoryBuffer
+from app.response_cache import ENTRY_OVERHEAD_BYTES, ResponseCache
+
+
+def test_entries_expire_after_the_ttl():
+    cache = ResponseCache(ttl=0.05)
+    cache.put("k", "reply")
+    assert cache.get("k") == "reply"
+    time.sleep(0.06)
+    assert cache.get("k") is None
+    assert cache.stats()["expirations"] == 1
+    assert cache.total_bytes == 0
+
+
+def test_least_recently_used_entry_is_evicted_past_max_entries():
+    cache = ResponseCache(max_entries=2)
+    cache.put("a", "A")
+    cache.put("b", "B")
+    assert cache.get("a") == "A"
+    cache.put("c", "C")
+
+    assert cache.get("b") is None
+    assert cache.get("a") == "A" and cache.get("c") == "C"
+    assert cache.evictions == 1
+
+
+def test_entries_are_evicted_past_max_bytes_and_oversized_replies_are_not_cached():
+    size = ENTRY_OVERHEAD_BYTES + 1 + 100
+    cache = ResponseCache(max_bytes=size * 2)
+    for key in "abc":
+        cache.put(key, "x" * 100)
+    assert cache.get("a") is None
+    assert cache.total_bytes == size * 2
+
+    cache.put("d", "x" * (size * 2))
+    assert cache.get("d") is None
+    assert cache.total_bytes == size * 2
+
+
+def test_replacing_an_entry_keeps_the_byte_count_right():
+    cache = ResponseCache()
+    cache.put("k", "short")
+    cache.put("k", "a longer reply")
+    assert cache.stats()["entries"] == 1
+    assert cache.total_bytes == ENTRY_OVERHEAD_BYTES + 1 + len("a longer reply")
+
+
+def test_key_depends_only_on_the_recent_history_and_is_the_same_for_both_history_forms():
+    cache = ResponseCache(history_turns=2)
+    entries = [("User", "one"), ("Bot", "two"), ("User", "three")]
+    buffer = HistoryBuffer(ContextBudgeter().message_cost)
+    buffer.extend(entries)
+    data = {"prompt": "p", "bot_name": "Bot", "user_name": "User"}
+
+    plain = cache.key({**data, "chat_history": [{"sender": s, "message": m} for s, m in entries]}, "hi")
+    encoded = cache.key({**data, "chat_history": EncodedHistory(buffer, [(0, 3)])}, "hi")
+    recent_only = cache.key({**data, "chat_history": EncodedHistory(buffer, [(1, 3)])}, "hi")
+    assert plain == encoded == recent_only
+    assert cache.key({**data, "chat_history": EncodedHistory(buffer, [(0, 2)])}, "hi") != plain
+    assert cache.key({**data, "chat_history": EncodedHistory(buffer, [(0, 3)])}, "hello") != plain
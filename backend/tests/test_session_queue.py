@@ -0,0 +1,103 @@
+import asyncio
+
+import pytest
+
+from app.session_queue import SessionQueue
+
+
+def test_turns_on_one_session_run_one_at_a_time_in_arrival_order():
+    queue = SessionQueue()
+    order, depths = [], []
+
+    async def turn(n):
+        async with queue.turn("s") as depth:
+            depths.append(depth)
+            order.append(f"start {n}")
+            await asyncio.sleep(0.01)
+            order.append(f"end {n}")
+
+    async def main():
+        await asyncio.gather(*(turn(n) for n in range(3)))
+
+    asyncio.run(main())
+    assert order == ["start 0", "end 0", "start 1", "end 1", "start 2", "end 2"]
+    assert depths == [0, 1, 2]
+    assert len(queue) == 0
+
+
+def test_turns_on_different_sessions_do_not_wait_on_each_other():
+    queue = SessionQueue()
+
+    async def main():
+        async with queue.turn("a"):
+            # Would deadlock if sessions shared a lock
+            async with queue.turn("b") as depth:
+                return depth, queue.depth("a"), queue.depth("b")
+
+    assert asyncio.run(main()) == (0, 1, 1)
+
+
+def test_cancelled_waiter_leaves_the_queue_without_blocking_later_turns():
+    queue = SessionQueue()
+    ran = []
+
+    async def turn(n):
+        async with queue.turn("s"):
+            ran.append(n)
+            await asyncio.sleep(0.01)
+
+    async def main():
+        first = asyncio.create_task(turn(0))
+        await asyncio.sleep(0)
+        cancelled = asyncio.create_task(turn(1))
+        last = asyncio.create_task(turn(2))
+        await asyncio.sleep(0)
+        assert queue.depth("s") == 3
+        cancelled.cancel()
+        await asyncio.gather(first, last)
+        with pytest.raises(asyncio.CancelledError):
+            await cancelled
+
+    asyncio.run(main())
+    assert ran == [0, 2]
+    assert len(queue) == 0
+
+
+def test_waiter_cancelled_as_it_is_handed_the_turn_passes_it_on():
+    queue = SessionQueue()
+    ran = []
+
+    async def turn(n):
+        async with queue.turn("s"):
+            ran.append(n)
+
+    async def main():
+        holder = queue.turn("s")
+        await holder.__aenter__()
+        handed = asyncio.create_task(turn(1))
+        last = asyncio.create_task(turn(2))
+        await asyncio.sleep(0)
+        # Release, which hands the turn to the first waiter, then cancel it before it runs
+        await holder.__aexit__(None, None, None)
+        handed.cancel()
+        await last
+        with pytest.raises(asyncio.CancelledError):
+            await handed
+
+    asyncio.run(main())
+    assert ran == [2]
+    assert len(queue) == 0
+
+
+def test_turn_that_raises_releases_the_session():
+    queue = SessionQueue()
+
+    async def main():
+        with pytest.raises(RuntimeError):
+            async with queue.turn("s"):
+                raise RuntimeError("boom")
+        async with queue.turn("s") as depth:
+            return depth
+
+    assert asyncio.run(main()) == 0
+    assert len(queue) == 0
@@ -0,0 +1,167 @@
+import asyncio
+import os
+from datetime import datetime, timedelta
+
+from app.models import ChatMessage, ChatSession
+from app.session_store import InMemorySessionStore, SessionIndex, SpillingSessionStore, estimate_session_bytes
+
+T0 = datetime(2024, 1, 1)
+
+
+def new_session(store, content: str = "") -> ChatSession:
+    session = ChatSession(prompt="prompt")
+    if content:
+        session.messages.extend([ChatMessage(sender="User", content=content)])
+    store[session.id] = session
+    return session
+
+
+def spilled(store, session: ChatSession) -> bool:
+    return os.path.exists(store._path(session.id))
+
+
+def test_least_recently_used_sessions_spill_once_over_the_count_cap(tmp_path):
+    store = SpillingSessionStore(str(tmp_path), max_sessions=2)
+    first, second = new_session(store, "one"), new_session(store, "two")
+    asyncio.run(store.load(first.id))
+    third = new_session(store, "three")
+
+    assert store.hot_sessions == 2
+    assert spilled(store, second)
+    assert not spilled(store, first) and not spilled(store, third)
+    assert len(store) == 3 and second.id in store
+    store.close()
+
+
+def test_sessions_spill_once_over_the_byte_cap(tmp_path):
+    sample = ChatSession(prompt="prompt")
+    sample.messages.extend([ChatMessage(sender="User", content="x" * 1000)])
+    store = SpillingSessionStore(str(tmp_path), max_bytes=estimate_session_bytes(sample) * 2)
+    sessions = [new_session(store, "x" * 1000) for _ in range(3)]
+
+    assert store.hot_sessions == 2
+    assert store.hot_bytes <= store._hot.max_bytes
+    assert spilled(store, sessions[0])
+    store.close()
+
+
+def test_spilled_session_is_rehydrated_on_load(tmp_path):
+    store = SpillingSessionStore(str(tmp_path), max_sessions=1)
+    cold = new_session(store, "remember me")
+    new_session(store)
+
+    # Read without promoting it, then load it back into the hot tier
+    assert store.peek(cold.id).messages.content(0) == "remember me"
+    assert store.hot_sessions == 1 and cold.id not in store._hot
+    loaded = asyncio.run(store.load(cold.id))
+    assert loaded.id == cold.id
+    assert loaded.messages.content(0) == "remember me"
+    assert cold.id in store._hot
+    store.close()
+
+
+def test_turn_on_an_evicted_session_re_admits_it_with_its_new_messages(tmp_path):
+    store = SpillingSessionStore(str(tmp_path), max_sessions=1)
+
+    async def main():
+        session = new_session(store, "hello")
+        # Evicted while its turn awaited upstream
+        new_session(store)
+        await store.append_messages(session, [ChatMessage(sender="Bot", content="hi")])
+        return session, await store.load(session.id)
+
+    session, loaded = asyncio.run(main())
+    assert loaded is session
+    assert [loaded.messages.content(i) for i in range(len(loaded.messages))] == ["hello", "hi"]
+    assert store.summary(session.id).message_count == 2
+    store.close()
+
+
+def test_deleting_a_spilled_session_removes_its_file(tmp_path):
+    store = SpillingSessionStore(str(tmp_path), max_sessions=1)
+    cold = new_session(store, "bye")
+    new_session(store)
+    assert spilled(store, cold)
+
+    asyncio.run(store.delete(cold.id))
+    assert not spilled(store, cold)
+    assert cold.id not in store
+    store.close()
+
+
+def ids(keys) -> list:
+    return [session_id for _, session_id in keys]
+
+
+def test_index_pages_newest_first_per_partition_and_merged():
+    index = SessionIndex()
+    index.load([("a", T0, True), ("b", T0 + timedelta(1), False), ("c", T0 + timedelta(2), True)])
+    index.update("d", T0 + timedelta(3), True)
+
+    assert ids(index.page(True)) == ["d", "c", "a"]
+    assert ids(index.page(False)) == ["b"]
+    assert ids(index.page(None)) == ["d", "c", "b", "a"]
+    assert ids(index.page(None, limit=2)) == ["d", "c"]
+    assert ids(index.page(None, before=(T0 + timedelta(2), "c"), limit=2)) == ["b", "a"]
+    assert (index.count(), index.count(True), index.count(False)) == (4, 3, 1)
+
+
+def test_index_moves_touched_sessions_and_breaks_ties_by_id():
+    index = SessionIndex()
+    for session_id in "xyz":
+        index.update(session_id, T0, True)
+    assert ids(index.page(True)) == ["z", "y", "x"]
+
+    index.update("x", T0 + timedelta(1), True)
+    index.update("y", T0 + timedelta(1), False)
+    index.remove("z")
+    index.remove("missing")
+    assert ids(index.page(True)) == ["x"]
+    assert ids(index.page(False)) == ["y"]
+    assert len(index) == 2
+
+
+def test_store_pages_cover_every_session_once_and_end_without_a_cursor():
+    store = InMemorySessionStore()
+    created = []
+    for i in range(5):
+        session = ChatSession(prompt="prompt", updated_at=T0 + timedelta(i))
+        store[session.id] = session
+        created.append(session.id)
+
+    seen, before = [], None
+    while True:
+        summaries, before = store.page(None, before, limit=2)
+        seen.extend(summary.id for summary in summaries)
+        if before is None:
+            break
+    assert seen == created[::-1]
+
+    # A page that ends exactly at the last session has no next cursor either
+    summaries, next_key = store.page(None, None, limit=5)
+    assert len(summaries) == 5 and next_key is None
+
+
+def test_summaries_follow_appends_clears_and_deactivation():
+    store = InMemorySessionStore()
+    session = ChatSession(prompt="prompt", updated_at=T0)
+    store[session.id] = session
+
+    async def main():
+        await store.append_messages(session, [
+            ChatMessage(sender="User", content="hello"),
+            ChatMessage(sender="Bot", content="hi there"),
+        ])
+        appended = store.summary(session.id)
+        session.is_active = False
+        await store.save(session)
+        deactivated = store.summary(session.id)
+        await store.clear_messages(session)
+        return appended, deactivated, store.summary(session.id)
+
+    appended, deactivated, cleared = asyncio.run(main())
+    assert (appended.message_count, appended.last_message_preview, appended.last_message_sender) == (2, "hi there", "Bot")
+    assert appended.updated_at > T0
+    assert not deactivated.is_active
+    assert store.count(True) == 0 and store.count(False) == 1
+    assert cleared.message_count == 0 and cleared.last_message_preview is None
@@ -0,0 +1,66 @@
+import sqlite3
+
+from app.sqlite_store import SqliteWriter, connect
+
+INSERT_BOT = "INSERT INTO bots (id, name, personality, prompt, created_at) VALUES (?, ?, ?, ?, ?)"
+
+
+def test_failing_operation_is_dropped_without_losing_the_rest_of_its_batch(tmp_path):
+    path = str(tmp_path / "chat.db")
+    writer = SqliteWriter(path)
+    writer.submit(INSERT_BOT, ("a", "A", "friendly", "prompt", "now"))
+    writer.submit(INSERT_BOT, ("b", None, "friendly", "prompt", "now"))
+    last = writer.submit(INSERT_BOT, ("c", "C", "friendly", "prompt", "now"))
+    assert writer.flush(5)
+    writer.close()
+
+    assert writer.committed == last
+    assert writer.failed == 1
+    with sqlite3.connect(path) as conn:
+        assert [row[0] for row in conn.execute("SELECT id FROM bots ORDER BY id")] == ["a", "c"]
+
+
+class LockedConnection:
+    """A connection whose first writes fail as if another connection held the database"""
+
+    def __init__(self, conn: sqlite3.Connection, failures: int):
+        self.conn = conn
+        self.failures = failures
+
+    def __enter__(self):
+        return self.conn.__enter__()
+
+    def __exit__(self, *exc):
+        return self.conn.__exit__(*exc)
+
+    def executemany(self, sql, rows):
+        if self.failures:
+            self.failures -= 1
+            raise sqlite3.OperationalError("database is locked")
+        return self.conn.executemany(sql, rows)
+
+
+def test_operation_failing_on_a_locked_database_is_retried_until_it_lands(tmp_path):
+    path = str(tmp_path / "chat.db")
+    writer = SqliteWriter(path, retry_delay=0.01)
+    writer.close()
+
+    conn = LockedConnection(connect(path), failures=3)
+    writer._write(conn, [(7, INSERT_BOT, [("a", "A", "friendly", "prompt", "now")])], stopping=False)
+    assert conn.failures == 0
+    assert writer.committed == 7
+    assert writer.failed == 0
+    assert conn.conn.execute("SELECT id FROM bots").fetchall() == [("a",)]
+
+
+def test_operation_failing_on_the_schema_is_dropped_rather_than_retried(tmp_path):
+    path = str(tmp_path / "chat.db")
+    writer = SqliteWriter(path, retry_delay=0.02)
+    # "no such table" is an OperationalError too, but retrying it would never succeed
+    writer.submit("INSERT INTO missing (x) VALUES (?)", (1,))
+    last = writer.submit(INSERT_BOT, ("a", "A", "friendly", "prompt", "now"))
+    assert writer.flush(5)
+    writer.close()
+
+    assert writer.committed == last
+    assert writer.failed == 1
@@ -0,0 +1,381 @@
+"""
+End-to-end load benchmark for the chat backend
+
+Starts the mock upstream (tools.mock_upstream) and the FastAPI app in
+their own processes, then drives concurrent virtual users through
+create -> send x K -> list sessions -> fetch messages, over HTTP and/or
+the /ws/chat/{id} WebSocket:
+
+    PYTHONPATH=backend python -m tools.benchmark --users 50 --turns 10 --output bench.json
+    PYTHONPATH=backend python -m tools.benchmark --compare bench.json
+
+Reports throughput, p50/p95/p99 latency per endpoint and server RSS
+growth, and writes the results as JSON so runs can be compared between
+commits.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import platform
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import aiohttp
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def percentile(sorted_values: List[float], q: float) -> Optional[float]:
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    rank = math.ceil(q / 100 * len(sorted_values))
+    return sorted_values[min(len(sorted_values), max(1, rank)) - 1]
+
+
+def read_rss_kb(pid: int) -> Dict[str, Optional[int]]:
+    """Current and peak resident set size of a process, from /proc (Linux only)"""
+    rss = {"rss_kb": None, "peak_rss_kb": None}
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    rss["rss_kb"] = int(line.split()[1])
+                elif line.startswith("VmHWM:"):
+                    rss["peak_rss_kb"] = int(line.split()[1])
+    except OSError:
+        pass
+    return rss
+
+
+def git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_ROOT, stderr=subprocess.DEVNULL, text=True
+        ).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+class Recorder:
+    """Collects per-endpoint latencies and errors"""
+
+    def __init__(self):
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.errors: Dict[str, int] = defaultdict(int)
+
+    @asynccontextmanager
+    async def time(self, endpoint: str):
+        started = time.perf_counter()
+        try:
+            yield
+        except Exception:
+            self.errors[endpoint] += 1
+            raise
+        self.latencies[endpoint].append(time.perf_counter() - started)
+
+    def summary(self, wall_time: float) -> Dict:
+        endpoints = {}
+        for endpoint in sorted(set(self.latencies) | set(self.errors)):
+            values = sorted(self.latencies[endpoint])
+            endpoints[endpoint] = {
+                "count": len(values),
+                "errors": self.errors[endpoint],
+                "rps": len(values) / wall_time if wall_time else 0.0,
+                "mean_ms": 1000 * sum(values) / len(values) if values else None,
+                **{
+                    f"p{q}_ms": 1000 * percentile(values, q) if values else None
+                    for q in (50, 95, 99)
+                },
+            }
+        total = sum(len(v) for v in self.latencies.values())
+        return {
+            "requests": total,
+            "errors": sum(self.errors.values()),
+            "wall_time_s": wall_time,
+            "throughput_rps": total / wall_time if wall_time else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+class BenchmarkError(Exception):
+    pass
+
+
+async def _json(response: aiohttp.ClientResponse) -> Dict:
+    if response.status >= 400:
+        raise BenchmarkError(f"{response.method} {response.url.path}: HTTP {response.status}")
+    return await response.json()
+
+
+async def virtual_user(
+        http: aiohttp.ClientSession,
+        base_url: str,
+        recorder: Recorder,
+        user: int,
+        turns: int,
+        transport: str
+):
+    """One user's conversation: create, K turns, list sessions, fetch messages"""
+    async with recorder.time("POST /api/chat/create"):
+        async with http.post(f"{base_url}/api/chat/create", json={
+            "bot_name": f"Bench{user}",
+            "user_name": f"User{user}",
+            "personality": "friendly"
+        }) as response:
+            session_id = (await _json(response))["id"]
+
+    if transport == "ws":
+        ws_url = base_url.replace("http", "ws", 1) + f"/ws/chat/{session_id}"
+        async with http.ws_connect(ws_url) as ws:
+            for turn in range(turns):
+                async with recorder.time("WS turn"):
+                    await ws.send_json({"message": f"turn {turn} from user {user}"})
+                    frame = await ws.receive_json()
+                    while frame.get("type") == "ping":
+                        await ws.send_json({"type": "pong"})
+                        frame = await ws.receive_json()
+                    if "error" in frame:
+                        raise BenchmarkError(f"WS turn: {frame['error']}")
+    else:
+        for turn in range(turns):
+            async with recorder.time("POST /api/chat/send"):
+                async with http.post(f"{base_url}/api/chat/send", json={
+                    "session_id": session_id,
+                    "message": f"turn {turn} from user {user}"
+                }) as response:
+                    await _json(response)
+
+    async with recorder.time("GET /api/chat/sessions"):
+        async with http.get(f"{base_url}/api/chat/sessions") as response:
+            await _json(response)
+
+    async with recorder.time("GET /api/chat/sessions/{id}/messages"):
+        async with http.get(f"{base_url}/api/chat/sessions/{session_id}/messages") as response:
+            await _json(response)
+
+
+async def drive(base_url: str, users: int, turns: int, transport: str, server_pid: Optional[int]) -> Dict:
+    """Run every virtual user concurrently and summarise the run"""
+    recorder = Recorder()
+    connector = aiohttp.TCPConnector(limit=0)
+    timeout = aiohttp.ClientTimeout(total=120)
+    rss_before = read_rss_kb(server_pid) if server_pid else {}
+
+    async with aiohttp.ClientSession(connector=connector, timeout=timeout) as http:
+        started = time.perf_counter()
+        results = await asyncio.gather(
+            *[virtual_user(http, base_url, recorder, user, turns, transport) for user in range(users)],
+            return_exceptions=True
+        )
+        wall_time = time.perf_counter() - started
+
+    summary = recorder.summary(wall_time)
+    summary["failed_users"] = sum(1 for r in results if isinstance(r, Exception))
+    summary["turns_per_s"] = (users - summary["failed_users"]) * turns / wall_time if wall_time else 0.0
+    first_error = next((r for r in results if isinstance(r, Exception)), None)
+    summary["first_error"] = str(first_error) if first_error else None
+    if server_pid:
+        rss_after = read_rss_kb(server_pid)
+        summary["server_memory"] = {
+            "rss_before_kb": rss_before.get("rss_kb"),
+            "rss_after_kb": rss_after["rss_kb"],
+            "peak_rss_kb": rss_after["peak_rss_kb"],
+            "rss_growth_kb": (
+                rss_after["rss_kb"] - rss_before["rss_kb"]
+                if rss_after["rss_kb"] is not None and rss_before.get("rss_kb") is not None else None
+            ),
+        }
+    return summary
+
+
+async def wait_until_up(url: str, process: Optional[subprocess.Popen], timeout: float = 30.0):
+    deadline = time.monotonic() + timeout
+    async with aiohttp.ClientSession() as http:
+        while time.monotonic() < deadline:
+            if process is not None and process.poll() is not None:
+                raise BenchmarkError(f"{url} exited with status {process.returncode} during startup")
+            try:
+                async with http.get(url) as response:
+                    if response.status < 500:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.2)
+    raise BenchmarkError(f"{url} did not come up within {timeout}s")
+
+
+def wait_for_port(port: int, process: subprocess.Popen, timeout: float = 10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise BenchmarkError(f"Process for port {port} exited with status {process.returncode} during startup")
+        try:
+            socket.create_connection(("127.0.0.1", port), timeout=1.0).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise BenchmarkError(f"Port {port} did not open within {timeout}s")
+
+
+def start_processes(args, workdir: str):
+    """Start the mock upstream and the backend; returns (base_url, processes, backend process)"""
+    env = {**os.environ, "PYTHONPATH": os.path.join(REPO_ROOT, "backend")}
+    processes = []
+
+    mock_port = free_port()
+    processes.append(subprocess.Popen([
+        sys.executable, "-m", "tools.mock_upstream",
+        "--port", str(mock_port),
+        "--latency", args.latency,
+        "--response-size", args.response_size,
+        "--seed", "1"
+    ], cwd=REPO_ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+
+    if args.store == "redis" and not env.get("CHAI_REDIS_URL"):
+        redis_port = free_port()
+        processes.append(subprocess.Popen([
+            sys.executable, "-m", "tools.resp_server", "--port", str(redis_port)
+        ], cwd=os.path.join(REPO_ROOT, "backend"), env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL))
+        env["CHAI_REDIS_URL"] = f"redis://127.0.0.1:{redis_port}"
+        wait_for_port(redis_port, processes[-1])
+
+    backend_env = {
+        **env,
+        "CHAI_API_BASE_URL": f"http://127.0.0.1:{mock_port}",
+        "CHAI_SESSION_STORE": args.store,
+        "CHAI_DATABASE_PATH": os.path.join(workdir, "bench.db"),
+        "CHAI_SPILL_DIR": os.path.join(workdir, "spill"),
+    }
+    # Measure the app, not the client-side pacing, unless asked to
+    backend_env.setdefault("CHAI_UPSTREAM_RATE", "1000")
+    backend_env.setdefault("CHAI_UPSTREAM_MAX_RATE", "1000")
+    backend_env.setdefault("CHAI_UPSTREAM_BURST", "1000")
+
+    backend_port = free_port()
+    backend = subprocess.Popen([
+        sys.executable, "-m", "uvicorn", "backend.app.main:app",
+        "--host", "127.0.0.1",
+        "--port", str(backend_port),
+        "--log-level", "warning"
+    ], cwd=REPO_ROOT, env=backend_env, stdout=subprocess.DEVNULL, stderr=None if args.verbose else subprocess.DEVNULL)
+    processes.append(backend)
+
+    return f"http://127.0.0.1:{backend_port}", f"http://127.0.0.1:{mock_port}/stats", processes, backend
+
+
+def compare(current: Dict, baseline: Dict):
+    """Print per-endpoint p95 and throughput changes against a previous run"""
+    for transport, run in current["runs"].items():
+        base_run = baseline.get("runs", {}).get(transport)
+        if base_run is None:
+            continue
+        print(f"\n{transport}: throughput {base_run['throughput_rps']:.1f} -> {run['throughput_rps']:.1f} req/s")
+        for endpoint, stats in run["endpoints"].items():
+            before = base_run["endpoints"].get(endpoint, {}).get("p95_ms")
+            after = stats["p95_ms"]
+            if before and after:
+                print(f"  {endpoint:<42} p95 {before:8.1f} -> {after:8.1f} ms ({100 * (after - before) / before:+.1f}%)")
+
+
+def print_report(results: Dict):
+    for transport, run in results["runs"].items():
+        print(f"\n== {transport}: {run['requests']} requests in {run['wall_time_s']:.2f}s "
+              f"({run['throughput_rps']:.1f} req/s, {run['turns_per_s']:.1f} turns/s, "
+              f"{run['errors']} errors, {run['failed_users']} failed users)")
+        if run["first_error"]:
+            print(f"   first error: {run['first_error']}")
+        print(f"   {'endpoint':<42} {'count':>6} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+        for endpoint, stats in run["endpoints"].items():
+            cells = [f"{stats[k]:9.1f}" if stats[k] is not None else f"{'-':>9}" for k in ("p50_ms", "p95_ms", "p99_ms")]
+            print(f"   {endpoint:<42} {stats['count']:>6} {' '.join(cells)}")
+        memory = run.get("server_memory")
+        if memory and memory["rss_after_kb"] is not None:
+            print(f"   server RSS {memory['rss_before_kb']} -> {memory['rss_after_kb']} kB "
+                  f"(growth {memory['rss_growth_kb']} kB, peak {memory['peak_rss_kb']} kB)")
+
+
+async def run(args) -> Dict:
+    transports = ["http", "ws"] if args.transport == "both" else [args.transport]
+    results = {
+        "revision": git_revision(),
+        "timestamp": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "compare", "verbose")},
+        "runs": {},
+    }
+
+    with tempfile.TemporaryDirectory() as workdir:
+        processes = []
+        try:
+            if args.server_url:
+                base_url, server_pid = args.server_url.rstrip("/"), args.server_pid
+                await wait_until_up(f"{base_url}/health", None)
+            else:
+                base_url, mock_stats_url, processes, backend = start_processes(args, workdir)
+                server_pid = backend.pid
+                await wait_until_up(mock_stats_url, processes[0])
+                await wait_until_up(f"{base_url}/health", backend)
+
+            if args.warmup:
+                await drive(base_url, min(args.users, 5), 1, "http", None)
+            for transport in transports:
+                results["runs"][transport] = await drive(base_url, args.users, args.turns, transport, server_pid)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end load benchmark for the chat backend")
+    parser.add_argument("--users", type=int, default=20, help="Concurrent virtual users")
+    parser.add_argument("--turns", type=int, default=10, help="Messages sent by each user")
+    parser.add_argument("--transport", choices=("http", "ws", "both"), default="both")
+    parser.add_argument("--store", choices=("sqlite", "spill", "memory", "redis"), default="sqlite",
+                        help="CHAI_SESSION_STORE for the backend under test; redis uses CHAI_REDIS_URL "
+                             "or a local tools.resp_server")
+    parser.add_argument("--latency", default="lognormal:0.05,0.5", help="Mock upstream latency distribution")
+    parser.add_argument("--response-size", default="medium", help="Mock upstream reply size profile")
+    parser.add_argument("--server-url", default=None, help="Benchmark an already running backend instead")
+    parser.add_argument("--server-pid", type=int, default=None, help="PID of --server-url, for RSS figures")
+    parser.add_argument("--no-warmup", dest="warmup", action="store_false")
+    parser.add_argument("--output", default=None, help="Write results as JSON to this file")
+    parser.add_argument("--compare", default=None, help="Previous --output file to compare against")
+    parser.add_argument("--verbose", action="store_true", help="Show the backend's log output")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print_report(results)
+
+    if args.compare:
+        with open(args.compare) as f:
+            compare(results, json.load(f))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+        print(f"\nResults written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
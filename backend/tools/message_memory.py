@@ -0,0 +1,89 @@
+"""
+Memory cost per message of a session's history, as a list of ChatMessage
+versus a MessageLog
+
+    PYTHONPATH=backend python -m tools.message_memory --messages 1000000
+
+Both layouts are filled with the same synthetic conversation (alternating
+user and bot turns, reply lengths drawn from a size profile of
+tools.mock_upstream) and measured with tracemalloc, so the numbers count
+every object the layout keeps alive, message text included.
+"""
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Iterator, Tuple
+
+from app.message_log import MessageLog
+from app.models import ChatMessage
+from tools.mock_upstream import SIZE_PROFILES
+
+_TEXT = "sure that sounds really fun honestly I think we could try it tomorrow " * 64
+
+
+def conversation(count: int, profile: str, seed: int) -> Iterator[Tuple[str, str, datetime]]:
+    rng = random.Random(seed)
+    low, high = SIZE_PROFILES[profile]
+    start = datetime(2024, 1, 1)
+    for i in range(count):
+        sender = "User" if i % 2 == 0 else "Assistant"
+        offset = rng.randrange(len(_TEXT) - high)
+        # Slicing makes a fresh str per message, as parsing a request would
+        content = _TEXT[offset:offset + rng.randint(low, high)]
+        yield sender, content, start + timedelta(seconds=3 * i)
+
+
+def as_list(messages) -> list:
+    return [ChatMessage(sender=s, content=c, timestamp=t) for s, c, t in messages]
+
+
+def as_log(messages) -> MessageLog:
+    log = MessageLog()
+    for s, c, t in messages:
+        log.add(s, c, t)
+    return log
+
+
+def measure(build: Callable, count: int, profile: str, seed: int) -> Dict:
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    store = build(conversation(count, profile, seed))
+    elapsed = time.perf_counter() - started
+    gc.collect()
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    text = sum(len(c.encode("utf-8")) for _, c, _ in conversation(count, profile, seed))
+    del store
+    return {
+        "bytes": size,
+        "bytes_per_message": round(size / count, 1),
+        "overhead_per_message": round((size - text) / count, 1),
+        "build_seconds": round(elapsed, 2),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bytes per stored message: ChatMessage list vs MessageLog")
+    parser.add_argument("--messages", type=int, default=1_000_000)
+    parser.add_argument("--size", default="short", choices=sorted(SIZE_PROFILES), help="Message length profile")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    before = measure(as_list, args.messages, args.size, args.seed)
+    after = measure(as_log, args.messages, args.size, args.seed)
+    print(json.dumps({
+        "messages": args.messages,
+        "size": args.size,
+        "chat_message_list": before,
+        "message_log": after,
+        "reduction": round(before["bytes"] / after["bytes"], 2),
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+"""
+Local stand-in for the CHAI /endpoints/onsite/chat endpoint
+
+Serves the same request and response shapes as the real upstream (plain
+JSON, or Server-Sent Events when the client accepts text/event-stream),
+with configurable latency, reply sizes and injected failures, so the
+backend can be load-tested without spending real quota:
+
+    PYTHONPATH=backend python -m tools.mock_upstream --port 9000 --latency lognormal:0.4,0.5
+    CHAI_API_BASE_URL=http://127.0.0.1:9000 ./run.sh
+
+GET /stats reports request counters; POST /stats/reset clears them.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import time
+from collections import Counter, deque
+from typing import Callable, Dict, Optional
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+ENDPOINT = "/endpoints/onsite/chat"
+
+# Reply length profiles, in characters: (low, high)
+SIZE_PROFILES = {
+    "short": (20, 120),
+    "medium": (200, 800),
+    "long": (1500, 4000),
+}
+
+_WORDS = (
+    "sure that sounds really fun honestly I think we could try it tomorrow "
+    "what do you like most about it tell me more I love hearing about your day"
+).split()
+
+
+def parse_distribution(spec: str, rng: random.Random) -> Callable[[], float]:
+    """
+    Build a sampler from a "kind:args" spec
+
+    Supported kinds: fixed:S, uniform:LOW,HIGH, normal:MEAN,STDDEV,
+    lognormal:MEDIAN,SIGMA and exponential:MEAN. Samples are never negative.
+    """
+    kind, _, raw_args = spec.partition(":")
+    args = [float(a) for a in raw_args.split(",") if a]
+    if kind == "fixed":
+        sample = lambda: args[0]
+    elif kind == "uniform":
+        sample = lambda: rng.uniform(args[0], args[1])
+    elif kind == "normal":
+        sample = lambda: rng.gauss(args[0], args[1])
+    elif kind == "lognormal":
+        # Parameterised by the median so the spec reads in seconds
+        sample = lambda: args[0] * rng.lognormvariate(0.0, args[1])
+    elif kind == "exponential":
+        sample = lambda: rng.expovariate(1 / args[0])
+    else:
+        raise ValueError(f"Unknown distribution: {spec}")
+    return lambda: max(0.0, sample())
+
+
+def parse_size(spec: str, rng: random.Random) -> Callable[[], int]:
+    """Build a reply-length sampler from a profile name or a distribution spec"""
+    if spec in SIZE_PROFILES:
+        low, high = SIZE_PROFILES[spec]
+        return lambda: rng.randint(low, high)
+    sample = parse_distribution(spec, rng)
+    return lambda: int(sample())
+
+
+class MockUpstream:
+    """The mock endpoint and its failure injection"""
+
+    def __init__(
+            self,
+            latency: str = "fixed:0.2",
+            response_size: str = "medium",
+            chunk_chars: int = 16,
+            chunk_delay: str = "fixed:0.02",
+            error_rate: float = 0.0,
+            throttle_rate: float = 0.0,
+            quota: Optional[float] = None,
+            retry_after: float = 1.0,
+            seed: Optional[int] = None
+    ):
+        self.rng = random.Random(seed)
+        self.latency = parse_distribution(latency, self.rng)
+        self.response_size = parse_size(response_size, self.rng)
+        self.chunk_chars = chunk_chars
+        self.chunk_delay = parse_distribution(chunk_delay, self.rng)
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        # Requests per second accepted before answering 429; None is unlimited
+        self.quota = quota
+        self.retry_after = retry_after
+        self._window: deque = deque()
+        self.counters: Counter = Counter()
+        self.in_flight = 0
+
+    def reply_for(self, body: Dict) -> str:
+        history = body.get("chat_history") or []
+        last = history[-1].get("message", "") if history else ""
+        size = self.response_size()
+        words = [f"({len(history)})", last[:60]]
+        length = sum(len(w) + 1 for w in words)
+        while length < size:
+            word = self.rng.choice(_WORDS)
+            words.append(word)
+            length += len(word) + 1
+        return " ".join(words)[:max(size, 1)]
+
+    def _over_quota(self) -> bool:
+        if self.quota is None:
+            return False
+        now = time.monotonic()
+        while self._window and self._window[0] <= now - 1:
+            self._window.popleft()
+        if len(self._window) >= self.quota:
+            return True
+        self._window.append(now)
+        return False
+
+    async def chat(self, request: web.Request) -> web.StreamResponse:
+        self.counters["requests"] += 1
+        if self._over_quota() or self.rng.random() < self.throttle_rate:
+            self.counters["429"] += 1
+            return web.json_response(
+                {"error": "Rate limit exceeded"},
+                status=429,
+                headers={"Retry-After": str(self.retry_after)}
+            )
+
+        body = await request.json()
+        self.in_flight += 1
+        try:
+            await asyncio.sleep(self.latency())
+            if self.rng.random() < self.error_rate:
+                self.counters["500"] += 1
+                return web.json_response({"error": "Injected failure"}, status=500)
+
+            reply = self.reply_for(body)
+            self.counters["200"] += 1
+            self.counters["reply_chars"] += len(reply)
+
+            if "text/event-stream" not in request.headers.get("Accept", ""):
+                return web.json_response({"model_output": reply})
+
+            self.counters["streams"] += 1
+            response = web.StreamResponse(headers={"Content-Type": "text/event-stream"})
+            await response.prepare(request)
+            for i in range(0, len(reply), self.chunk_chars):
+                delta = json.dumps({"delta": reply[i:i + self.chunk_chars]})
+                await response.write(f"data: {delta}\n\n".encode("utf-8"))
+                await asyncio.sleep(self.chunk_delay())
+            await response.write(b"data: [DONE]\n\n")
+            return response
+        finally:
+            self.in_flight -= 1
+
+    async def stats(self, request: web.Request) -> web.Response:
+        return web.json_response({**self.counters, "in_flight": self.in_flight})
+
+    async def reset(self, request: web.Request) -> web.Response:
+        self.counters.clear()
+        return web.json_response({"status": "reset"})
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(ENDPOINT, self.chat)
+        app.router.add_get("/stats", self.stats)
+        app.router.add_post("/stats/reset", self.reset)
+        return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Local mock of the CHAI chat endpoint")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9000)
+    parser.add_argument("--latency", default="fixed:0.2",
+                        help="Time to first byte: fixed:S, uniform:LO,HI, normal:MEAN,SD, lognormal:MEDIAN,SIGMA, exponential:MEAN")
+    parser.add_argument("--response-size", default="medium",
+                        help="Reply length in chars: short, medium, long, or a distribution spec")
+    parser.add_argument("--chunk-chars", type=int, default=16, help="Characters per streamed chunk")
+    parser.add_argument("--chunk-delay", default="fixed:0.02", help="Delay between streamed chunks")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with 500")
+    parser.add_argument("--throttle-rate", type=float, default=0.0, help="Fraction of requests answered with 429")
+    parser.add_argument("--quota", type=float, default=None, help="Requests per second before answering 429")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After sent with 429s, in seconds")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    mock = MockUpstream(
+        latency=args.latency,
+        response_size=args.response_size,
+        chunk_chars=args.chunk_chars,
+        chunk_delay=args.chunk_delay,
+        error_rate=args.error_rate,
+        throttle_rate=args.throttle_rate,
+        quota=args.quota,
+        retry_after=args.retry_after,
+        seed=args.seed
+    )
+    logger.info(f"Mock CHAI upstream on http://{args.host}:{args.port}{ENDPOINT}")
+    web.run_app(mock.app(), host=args.host, port=args.port, access_log=None)
+
+
+if __name__ == "__main__":
+    main()
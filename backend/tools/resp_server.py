@@ -0,0 +1,357 @@
+"""
+Local stand-in for a Redis server
+
+Implements just the RESP commands the shared session store uses (strings
+with NX/PX and expiry, hashes, lists, MULTI/EXEC, pub/sub), in memory and single-threaded like
+Redis itself, so multi-worker mode can run and be tested without
+installing Redis. There is no Lua: EVAL/EVALSHA only run the store's own
+scripts, each emulated by an equivalent Python method:
+
+    PYTHONPATH=backend python -m tools.resp_server --port 6390
+    CHAI_SESSION_STORE=redis CHAI_REDIS_URL=redis://127.0.0.1:6390 ./run.sh --workers 4
+
+RespServer can also be started inside a test process with start_in_thread().
+Nothing is persisted.
+"""
+import argparse
+import asyncio
+import hashlib
+import json
+import logging
+import threading
+import time
+from collections import defaultdict
+from typing import Any, Callable, Dict, List, Optional, Set
+
+from app.redis_store import RENEW_SCRIPT, UNLOCK_SCRIPT, WRITE_SCRIPT
+
+logger = logging.getLogger(__name__)
+
+
+class RedisError(Exception):
+    """An error reply"""
+
+
+WRONGTYPE = RedisError("WRONGTYPE Operation against a key holding the wrong kind of value")
+
+
+def _sha1(script: bytes) -> bytes:
+    return hashlib.sha1(script).hexdigest().encode("ascii")
+
+
+async def read_command(reader: asyncio.StreamReader) -> List[bytes]:
+    """Read one command, sent as an array of bulk strings; raises ConnectionError once the client is gone"""
+    line = await reader.readline()
+    if not line.endswith(b"\r\n"):
+        raise ConnectionError("Connection closed by client")
+    if line[:1] != b"*":
+        # Inline command, as typed into telnet
+        return line.split()
+    args = []
+    for _ in range(int(line[1:-2])):
+        header = await reader.readline()
+        if header[:1] != b"$":
+            raise ConnectionError(f"Expected a bulk string, got {header[:1]!r}")
+        args.append((await reader.readexactly(int(header[1:-2]) + 2))[:-2])
+    return args
+
+
+def encode_reply(value: Any) -> bytes:
+    if value is None:
+        return b"$-1\r\n"
+    if isinstance(value, RedisError):
+        return f"-{value}\r\n".encode("utf-8")
+    if isinstance(value, bool):
+        return b":%d\r\n" % int(value)
+    if isinstance(value, int):
+        return b":%d\r\n" % value
+    if isinstance(value, str):
+        return f"+{value}\r\n".encode("utf-8")
+    if isinstance(value, bytes):
+        return b"$%d\r\n%s\r\n" % (len(value), value)
+    return b"*%d\r\n" % len(value) + b"".join(encode_reply(item) for item in value)
+
+
+class RespServer:
+    """In-memory keyspace and pub/sub serving the RESP protocol"""
+
+    def __init__(self):
+        self.data: Dict[bytes, Any] = {}
+        self.expires: Dict[bytes, float] = {}
+        self.channels: Dict[bytes, Set[asyncio.StreamWriter]] = defaultdict(set)
+        self.commands = 0
+        self.scripts: Dict[bytes, Callable[[List[bytes], List[bytes]], Any]] = {
+            _sha1(WRITE_SCRIPT.encode("utf-8")): self._write_script,
+            _sha1(RENEW_SCRIPT.encode("utf-8")): self._renew_script,
+            _sha1(UNLOCK_SCRIPT.encode("utf-8")): self._unlock_script,
+        }
+
+    def _get(self, key: bytes, kind: type) -> Any:
+        deadline = self.expires.get(key)
+        if deadline is not None and deadline <= time.monotonic():
+            self.data.pop(key, None)
+            del self.expires[key]
+        value = self.data.get(key)
+        if value is not None and not isinstance(value, kind):
+            raise WRONGTYPE
+        return value
+
+    def _create(self, key: bytes, kind: type) -> Any:
+        value = self._get(key, kind)
+        if value is None:
+            value = self.data[key] = kind()
+        return value
+
+    def _delete(self, key: bytes) -> bool:
+        self.expires.pop(key, None)
+        return self.data.pop(key, None) is not None
+
+    # Each cmd_* takes the raw argument list and returns the reply
+
+    def cmd_ping(self, args):
+        return args[0] if args else "PONG"
+
+    def cmd_select(self, args):
+        return "OK"
+
+    def cmd_auth(self, args):
+        # Accepts any credentials, so URLs meant for a real server work unchanged
+        return "OK"
+
+    def cmd_flushdb(self, args):
+        self.data.clear()
+        self.expires.clear()
+        return "OK"
+
+    def cmd_get(self, args):
+        return self._get(args[0], bytes)
+
+    def cmd_set(self, args):
+        key, value, options = args[0], args[1], [a.upper() for a in args[2:]]
+        if b"NX" in options and self._get(key, object) is not None:
+            return None
+        self._delete(key)
+        self.data[key] = bytes(value)
+        for unit, scale in ((b"PX", 0.001), (b"EX", 1.0)):
+            if unit in options:
+                self.expires[key] = time.monotonic() + int(options[options.index(unit) + 1]) * scale
+        return "OK"
+
+    def cmd_del(self, args):
+        return sum(self._delete(key) for key in args if self._get(key, object) is not None)
+
+    def cmd_exists(self, args):
+        return sum(self._get(key, object) is not None for key in args)
+
+    def cmd_pexpire(self, args):
+        if self._get(args[0], object) is None:
+            return 0
+        self.expires[args[0]] = time.monotonic() + int(args[1]) / 1000
+        return 1
+
+    def cmd_incr(self, args):
+        value = int(self._get(args[0], bytes) or 0) + 1
+        self.data[args[0]] = str(value).encode("ascii")
+        return value
+
+    def cmd_hset(self, args):
+        fields = self._create(args[0], dict)
+        added = 0
+        for field, value in zip(args[1::2], args[2::2]):
+            added += field not in fields
+            fields[field] = bytes(value)
+        return added
+
+    def cmd_hget(self, args):
+        return (self._get(args[0], dict) or {}).get(args[1])
+
+    def cmd_hexists(self, args):
+        return args[1] in (self._get(args[0], dict) or {})
+
+    def cmd_hmget(self, args):
+        fields = self._get(args[0], dict) or {}
+        return [fields.get(field) for field in args[1:]]
+
+    def cmd_hgetall(self, args):
+        fields = self._get(args[0], dict) or {}
+        return [item for pair in fields.items() for item in pair]
+
+    def cmd_hkeys(self, args):
+        return list(self._get(args[0], dict) or {})
+
+    def cmd_hlen(self, args):
+        return len(self._get(args[0], dict) or {})
+
+    def cmd_hdel(self, args):
+        fields = self._get(args[0], dict) or {}
+        removed = sum(fields.pop(field, None) is not None for field in args[1:])
+        if not fields:
+            self._delete(args[0])
+        return removed
+
+    def cmd_hincrby(self, args):
+        fields = self._create(args[0], dict)
+        value = int(fields.get(args[1], b"0")) + int(args[2])
+        fields[args[1]] = str(value).encode("ascii")
+        return value
+
+    def cmd_rpush(self, args):
+        items = self._create(args[0], list)
+        items.extend(bytes(a) for a in args[1:])
+        return len(items)
+
+    def cmd_llen(self, args):
+        return len(self._get(args[0], list) or [])
+
+    def cmd_lrange(self, args):
+        items = self._get(args[0], list) or []
+        start, stop = int(args[1]), int(args[2])
+        if start < 0:
+            start = max(0, len(items) + start)
+        stop = len(items) + stop if stop < 0 else stop
+        return items[start:stop + 1]
+
+    def cmd_publish(self, args):
+        frame = encode_reply([b"message", args[0], args[1]])
+        subscribers = list(self.channels.get(args[0], ()))
+        for writer in subscribers:
+            writer.write(frame)
+        return len(subscribers)
+
+    def cmd_script(self, args):
+        subcommand = args[0].lower()
+        if subcommand == b"load":
+            sha = _sha1(args[1])
+            if sha not in self.scripts:
+                raise RedisError("ERR the stand-in only runs the session store's own scripts")
+            return sha
+        if subcommand == b"exists":
+            return [int(sha.lower() in self.scripts) for sha in args[1:]]
+        if subcommand == b"flush":
+            return "OK"
+        raise RedisError(f"ERR unknown SCRIPT subcommand '{subcommand.decode('utf-8')}'")
+
+    def cmd_eval(self, args):
+        return self.cmd_evalsha([_sha1(args[0]), *args[1:]])
+
+    def cmd_evalsha(self, args):
+        script = self.scripts.get(args[0].lower())
+        if script is None:
+            raise RedisError("NOSCRIPT No matching script. Please use EVAL.")
+        numkeys = int(args[1])
+        return script(args[2:2 + numkeys], args[2 + numkeys:])
+
+    # Python equivalents of the scripts in app.redis_store
+
+    def _write_script(self, keys, args):
+        if self._get(keys[0], object) is None:
+            return None
+        replies = []
+        for command in json.loads(args[0]):
+            reply = self.run(command[0].lower(), [arg.encode("utf-8") for arg in command[1:]])
+            if isinstance(reply, RedisError):
+                raise RedisError(f"ERR Error running script: {reply}")
+            replies.append(reply)
+        return replies
+
+    def _renew_script(self, keys, args):
+        if self._get(keys[0], bytes) != args[0]:
+            return 0
+        return self.cmd_pexpire([keys[0], args[1]])
+
+    def _unlock_script(self, keys, args):
+        if self._get(keys[0], bytes) != args[0]:
+            return 0
+        self._delete(keys[0])
+        self.cmd_publish(args[1:3])
+        return 1
+
+    def run(self, name: str, args: List[bytes]) -> Any:
+        handler = getattr(self, f"cmd_{name}", None)
+        if handler is None:
+            return RedisError(f"ERR unknown command '{name}'")
+        try:
+            return handler(args)
+        except RedisError as e:
+            return e
+        except (IndexError, ValueError):
+            return RedisError(f"ERR wrong arguments for '{name}' command")
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        subscribed: Set[bytes] = set()
+        # Commands queued since MULTI; run together, with nothing in between, on EXEC
+        transaction: Optional[List] = None
+        try:
+            while True:
+                try:
+                    command = await read_command(reader)
+                except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+                    break
+                if not command:
+                    continue
+                self.commands += 1
+                name, args = command[0].decode("ascii").lower(), command[1:]
+                if name == "multi":
+                    transaction = []
+                    writer.write(encode_reply("OK"))
+                elif name == "exec":
+                    replies = [self.run(*queued) for queued in transaction or ()]
+                    transaction = None
+                    writer.write(encode_reply(replies))
+                elif name == "discard":
+                    transaction = None
+                    writer.write(encode_reply("OK"))
+                elif transaction is not None:
+                    transaction.append((name, args))
+                    writer.write(encode_reply("QUEUED"))
+                elif name == "subscribe":
+                    for channel in args:
+                        subscribed.add(channel)
+                        self.channels[channel].add(writer)
+                        writer.write(encode_reply([b"subscribe", channel, len(subscribed)]))
+                elif name == "unsubscribe":
+                    for channel in args or list(subscribed):
+                        subscribed.discard(channel)
+                        self.channels[channel].discard(writer)
+                        writer.write(encode_reply([b"unsubscribe", channel, len(subscribed)]))
+                else:
+                    writer.write(encode_reply(self.run(name, args)))
+                await writer.drain()
+        finally:
+            for channel in subscribed:
+                self.channels[channel].discard(writer)
+            writer.close()
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 6390):
+        server = await asyncio.start_server(self.handle, host, port)
+        async with server:
+            await server.serve_forever()
+
+    def start_in_thread(self, host: str = "127.0.0.1", port: int = 6390) -> str:
+        """Serve from a daemon thread; returns the redis:// URL"""
+        started = threading.Event()
+
+        def run():
+            loop = asyncio.new_event_loop()
+            loop.run_until_complete(asyncio.start_server(self.handle, host, port))
+            started.set()
+            loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+        return f"redis://{host}:{port}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-memory stand-in for a Redis server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=6390)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    logger.info(f"RESP stand-in on redis://{args.host}:{args.port}")
+    asyncio.run(RespServer().serve(args.host, args.port))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,214 @@
+import json
+import threading
+import time
+from typing import Any, Dict, Hashable, Iterator, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from websockets.exceptions import ConnectionClosed, WebSocketException
+from websockets.sync.client import connect as ws_connect
+
+# (connect, read) timeouts in seconds; sending waits on the upstream bot
+DEFAULT_TIMEOUT = (3.05, 10)
+SEND_TIMEOUT = (3.05, 60)
+
+# Seconds to open a WebSocket, and to wait for each frame of a streamed reply
+WS_OPEN_TIMEOUT = 3.0
+WS_FRAME_TIMEOUT = 60.0
+
+# How long cached reads are served before asking the backend again
+SESSIONS_TTL = 5.0
+MESSAGES_TTL = 30.0
+
+
+class APIError(Exception):
+    """A backend call failed; the message is the response body or the transport error"""
+
+    def __init__(self, message: str, status: Optional[int] = None):
+        super().__init__(message)
+        self.status = status
+
+
+class StreamUnavailable(APIError):
+    """The WebSocket could not be opened or the turn could not be sent on it, so the server never saw the turn"""
+
+
+class TTLCache:
+    """Small thread-safe cache of API responses, keyed by tuples and dropped by key prefix"""
+
+    def __init__(self):
+        self._entries: Dict[Tuple, Tuple[float, Any]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: Tuple) -> Optional[Any]:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[key]
+                return None
+            return entry[1]
+
+    def put(self, key: Tuple, value: Any, ttl: float):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, value)
+
+    def invalidate(self, *prefix: Hashable):
+        """Drop every entry whose key starts with prefix"""
+        with self._lock:
+            for key in [k for k in self._entries if k[:len(prefix)] == prefix]:
+                del self._entries[key]
+
+
+class ChatAPI:
+    """
+    Client for the chat backend, shared by every rerun and browser tab
+
+    Requests go through one keep-alive requests.Session, so reruns reuse
+    pooled connections instead of opening a new one per call. Session lists
+    and message pages are cached briefly and dropped as soon as this client
+    changes the data behind them (create, send, clear, deactivate, delete).
+    """
+
+    def __init__(self, base_url: str, pool_size: int = 20):
+        self.base_url = base_url.rstrip("/")
+        self.cache = TTLCache()
+        self.http = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.http.mount("http://", adapter)
+        self.http.mount("https://", adapter)
+
+    def _request(self, method: str, path: str, timeout=DEFAULT_TIMEOUT, **kwargs) -> Any:
+        try:
+            response = self.http.request(method, f"{self.base_url}{path}", timeout=timeout, **kwargs)
+        except requests.RequestException as e:
+            raise APIError(str(e))
+        if response.status_code != 200:
+            raise APIError(response.text, response.status_code)
+        return response.json()
+
+    def list_sessions(self) -> list:
+        """Session summaries, newest first"""
+        cached = self.cache.get(("sessions",))
+        if cached is not None:
+            return cached
+        sessions = self._request("GET", "/chat/sessions/summaries")["sessions"]
+        self.cache.put(("sessions",), sessions, SESSIONS_TTL)
+        return sessions
+
+    def get_messages(self, session_id: str, limit: int = 200, before: Optional[int] = None) -> Dict:
+        """A page of a session's messages: the newest, or those before seq `before`"""
+        key = ("messages", session_id, limit, before)
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached
+        params = {"limit": limit}
+        if before is None:
+            params["tail"] = "true"
+        else:
+            params["before"] = before
+        page = self._request("GET", f"/chat/sessions/{session_id}/messages", params=params)
+        self.cache.put(key, page, MESSAGES_TTL)
+        return page
+
+    def create_session(self, payload: Dict) -> Dict:
+        session = self._request("POST", "/chat/create", json=payload)
+        self.cache.invalidate("sessions")
+        return session
+
+    def send_message(self, session_id: str, message: str) -> Dict:
+        try:
+            return self._request(
+                "POST", "/chat/send",
+                timeout=SEND_TIMEOUT,
+                json={"session_id": session_id, "message": message}
+            )
+        finally:
+            # The turn may have been committed even if the reply was lost
+            self.changed(session_id)
+
+    def clear_session(self, session_id: str):
+        self._request("POST", f"/chat/sessions/{session_id}/clear")
+        self.changed(session_id)
+
+    def deactivate_session(self, session_id: str):
+        self._request("POST", f"/chat/sessions/{session_id}/deactivate")
+        self.changed(session_id)
+
+    def delete_session(self, session_id: str):
+        self._request("DELETE", f"/chat/sessions/{session_id}")
+        self.changed(session_id)
+
+    def changed(self, session_id: str):
+        """Drop cached reads a turn or action on session_id made stale"""
+        self.cache.invalidate("sessions")
+        self.cache.invalidate("messages", session_id)
+
+
+class ChatSocket:
+    """
+    One browser tab's WebSocket to a chat session, for streaming replies
+
+    The connection is opened on first use and kept across turns, and reopened
+    if the server dropped it in between (an idle tab does not answer the
+    server's heartbeat pings, so it is eventually evicted).
+
+    Failing to connect or to send the turn raises StreamUnavailable, and the
+    turn can safely be sent over HTTP instead. Anything after that, an error
+    frame from the server or a connection lost mid-reply, raises a plain
+    APIError: by then the server may have committed the turn, so it must not
+    be sent again.
+    """
+
+    def __init__(self, ws_base_url: str, session_id: str):
+        self.url = f"{ws_base_url.rstrip('/')}/chat/{session_id}"
+        self.session_id = session_id
+        self._connection = None
+
+    def stream(self, message: str) -> Iterator[Dict]:
+        """Send one turn and yield its frames: "chunk" frames, then the final reply frame"""
+        try:
+            self._send({"message": message, "stream": True})
+        except (OSError, TimeoutError, WebSocketException) as e:
+            self.close()
+            raise StreamUnavailable(f"WebSocket unavailable: {e}")
+
+        try:
+            while True:
+                frame = json.loads(self._connection.recv(timeout=WS_FRAME_TIMEOUT))
+                kind = frame.get("type")
+                if kind == "ping":
+                    self._connection.send(json.dumps({"type": "pong"}))
+                    continue
+                if kind == "turn":
+                    # A turn sent from another tab
+                    continue
+                if "error" in frame:
+                    # The turn is over; the connection stays usable for the next one
+                    raise APIError(frame["error"])
+                yield frame
+                if kind != "chunk":
+                    return
+        except (OSError, TimeoutError, WebSocketException, ValueError) as e:
+            self.close()
+            raise APIError(f"WebSocket failed mid-reply: {e}")
+
+    def _send(self, frame: Dict):
+        """Send on the open connection, reconnecting once if the server has dropped it since the last turn"""
+        if self._connection is not None:
+            try:
+                self._connection.send(json.dumps(frame))
+                return
+            except ConnectionClosed:
+                self._connection = None
+        self._connection = ws_connect(self.url, open_timeout=WS_OPEN_TIMEOUT)
+        self._connection.send(json.dumps(frame))
+
+    def close(self):
+        if self._connection is not None:
+            try:
+                self._connection.close()
+            except (OSError, WebSocketException):
+                pass
+            self._connection = None
@@ -1,10 +1,13 @@
 import streamlit as st
-import requests
 from datetime import datetime
 
+from api_client import APIError, ChatAPI, ChatSocket, StreamUnavailable
+
 # Configuration
 API_BASE_URL = "http://localhost:8000/api"
 WS_BASE_URL = "ws://localhost:8000/ws"
+# Messages fetched per page, and rendered per "load earlier" step
+MESSAGE_PAGE_SIZE = 50
 
 # Page configuration
 st.set_page_config(
@@ -445,85 +448,158 @@ if "current_session_id" not in st.session_state:
     st.session_state.current_session_id = None
 if "messages" not in st.session_state:
     st.session_state.messages = []
+if "has_earlier" not in st.session_state:
+    st.session_state.has_earlier = False
+if "visible_messages" not in st.session_state:
+    st.session_state.visible_messages = MESSAGE_PAGE_SIZE
 if "sessions" not in st.session_state:
     st.session_state.sessions = []
 if "bots" not in st.session_state:
     st.session_state.bots = []
 if "is_typing" not in st.session_state:
     st.session_state.is_typing = False
+if "stream_replies" not in st.session_state:
+    st.session_state.stream_replies = True
+if "chat_socket" not in st.session_state:
+    st.session_state.chat_socket = None
 
 
 # Helper functions
+@st.cache_resource
+def get_api() -> ChatAPI:
+    """One pooled, caching API client for every rerun and browser tab"""
+    return ChatAPI(API_BASE_URL)
+
+
 def create_session(bot_name: str, user_name: str, personality: str, custom_prompt: str = None):
     """Create a new chat session"""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/chat/create",
-            json={
-                "bot_name": bot_name,
-                "user_name": user_name,
-                "personality": personality,
-                "custom_prompt": custom_prompt
-            }
-        )
-        if response.status_code == 200:
-            session = response.json()
-            st.session_state.current_session_id = session["id"]
-            st.session_state.messages = []
-            return session
-        else:
-            st.error(f"Failed to create session: {response.text}")
-            return None
-    except Exception as e:
-        st.error(f"Error creating session: {e}")
+        session = get_api().create_session({
+            "bot_name": bot_name,
+            "user_name": user_name,
+            "personality": personality,
+            "custom_prompt": custom_prompt
+        })
+        st.session_state.current_session_id = session["id"]
+        show_messages([])
+        return session
+    except APIError as e:
+        st.error(f"Failed to create session: {e}")
         return None
 
 
 def send_message(session_id: str, message: str):
     """Send a message to the bot"""
     try:
-        response = requests.post(
-            f"{API_BASE_URL}/chat/send",
-            json={
-                "session_id": session_id,
-                "message": message
-            }
-        )
-        if response.status_code == 200:
-            return response.json()
-        else:
-            st.error(f"Failed to send message: {response.text}")
-            return None
-    except Exception as e:
-        st.error(f"Error sending message: {e}")
+        return get_api().send_message(session_id, message)
+    except APIError as e:
+        st.error(f"Failed to send message: {e}")
         return None
 
 
 def load_sessions():
-    """Load all chat sessions"""
+    """Load all chat sessions (summaries only; messages are fetched per session)"""
     try:
-        response = requests.get(f"{API_BASE_URL}/chat/sessions")
-        if response.status_code == 200:
-            data = response.json()
-            st.session_state.sessions = data["sessions"]
-            return data["sessions"]
-        return []
-    except Exception as e:
+        sessions = get_api().list_sessions()
+        st.session_state.sessions = sessions
+        return sessions
+    except APIError as e:
         st.error(f"Error loading sessions: {e}")
         return []
 
 
-def load_session_messages(session_id: str):
-    """Load messages for a specific session"""
+def format_message(message: dict) -> dict:
+    """Copy of a message with its display time formatted once, so reruns never re-parse timestamps"""
+    return {**message, "time": datetime.fromisoformat(message["timestamp"]).strftime("%H:%M:%S")}
+
+
+def load_session_messages(session_id: str, before: int = None):
+    """Load a page of a session's messages (the newest, or those before seq) and whether older ones exist"""
     try:
-        response = requests.get(f"{API_BASE_URL}/chat/sessions/{session_id}/messages")
-        if response.status_code == 200:
-            data = response.json()
-            return data["messages"]
-        return []
-    except Exception as e:
+        page = get_api().get_messages(session_id, limit=MESSAGE_PAGE_SIZE, before=before)
+        return [format_message(m) for m in page["messages"]], page["has_earlier"]
+    except APIError as e:
         st.error(f"Error loading messages: {e}")
-        return []
+        return [], False
+
+
+def show_messages(messages: list, has_earlier: bool = False):
+    """Replace the displayed history, resetting the render window to the newest page"""
+    st.session_state.messages = messages
+    st.session_state.has_earlier = has_earlier
+    st.session_state.visible_messages = MESSAGE_PAGE_SIZE
+
+
+def load_earlier_messages():
+    """Widen the render window by a page, fetching that page first if it is not loaded yet"""
+    messages = st.session_state.messages
+    hidden = len(messages) - st.session_state.visible_messages
+    if hidden < MESSAGE_PAGE_SIZE and st.session_state.has_earlier and messages:
+        earlier, has_earlier = load_session_messages(
+            st.session_state.current_session_id,
+            before=messages[0]["seq"]
+        )
+        st.session_state.messages = earlier + messages
+        st.session_state.has_earlier = has_earlier
+    st.session_state.visible_messages += MESSAGE_PAGE_SIZE
+
+
+def get_socket(session_id: str) -> ChatSocket:
+    """This tab's WebSocket for session_id, replacing the one for any other session"""
+    socket = st.session_state.chat_socket
+    if socket is None or socket.session_id != session_id:
+        if socket is not None:
+            socket.close()
+        socket = st.session_state.chat_socket = ChatSocket(WS_BASE_URL, session_id)
+    return socket
+
+
+def stream_reply(session_id: str, message: str, placeholder):
+    """
+    Stream the bot's reply into placeholder over the WebSocket
+
+    Falls back to a plain HTTP send only if the turn never reached the server
+    over the socket. Returns the reply as a message dict, or None if the turn
+    failed.
+    """
+    text = ""
+    try:
+        for frame in get_socket(session_id).stream(message):
+            if frame.get("type") == "chunk":
+                text += frame["delta"]
+                placeholder.markdown(text + "▌")
+            else:
+                get_api().changed(session_id)
+                placeholder.markdown(frame["message"])
+                return format_message(
+                    {"sender": frame["sender"], "content": frame["message"], "timestamp": frame["timestamp"]}
+                )
+    except StreamUnavailable:
+        pass
+    except APIError as e:
+        # The server had the turn and may have committed it, so sending it again could duplicate it
+        get_api().changed(session_id)
+        placeholder.empty()
+        st.error(f"Failed to send message: {e}")
+        return None
+
+    placeholder.markdown("_Thinking..._")
+    response = send_message(session_id, message)
+    if not response:
+        placeholder.empty()
+        return None
+    placeholder.markdown(response["response"])
+    return format_message(
+        {"sender": response["bot_name"], "content": response["response"], "timestamp": response["timestamp"]}
+    )
+
+
+def session_action(action, session_id: str):
+    """Run a clear/deactivate/delete call, reporting failures"""
+    try:
+        action(session_id)
+    except APIError as e:
+        st.error(f"Request failed: {e}")
 
 
 # Personality descriptions for better UX
@@ -606,6 +682,12 @@ def main():
                     st.success(f"✅ Created session with {bot_name}")
                     st.rerun()
 
+        st.toggle(
+            "⚡ Stream replies",
+            key="stream_replies",
+            help="Show replies as they are written (WebSocket), instead of waiting for the whole reply"
+        )
+
         # Existing sessions
         st.subheader("Your Sessions")
         sessions = load_sessions()
@@ -620,11 +702,11 @@ def main():
                             use_container_width=True
                     ):
                         st.session_state.current_session_id = session['id']
-                        st.session_state.messages = load_session_messages(session['id'])
+                        show_messages(*load_session_messages(session['id']))
                         st.rerun()
                 with col2:
                     if st.button("🗑️", key=f"delete_{session['id']}"):
-                        requests.delete(f"{API_BASE_URL}/chat/sessions/{session['id']}")
+                        session_action(get_api().delete_session, session['id'])
                         st.rerun()
         else:
             st.info("No sessions yet. Create one to start chatting!")
@@ -635,18 +717,14 @@ def main():
             col1, col2 = st.columns(2)
             with col1:
                 if st.button("Clear Chat"):
-                    requests.post(
-                        f"{API_BASE_URL}/chat/sessions/{st.session_state.current_session_id}/clear"
-                    )
-                    st.session_state.messages = []
+                    session_action(get_api().clear_session, st.session_state.current_session_id)
+                    show_messages([])
                     st.rerun()
             with col2:
                 if st.button("End Session"):
-                    requests.post(
-                        f"{API_BASE_URL}/chat/sessions/{st.session_state.current_session_id}/deactivate"
-                    )
+                    session_action(get_api().deactivate_session, st.session_state.current_session_id)
                     st.session_state.current_session_id = None
-                    st.session_state.messages = []
+                    show_messages([])
                     st.rerun()
 
     # Main chat area
@@ -662,7 +740,7 @@ def main():
             col1, col2 = st.columns([1, 5])
             if st.button("← Back", type="secondary", help="Return to home page"):
                     st.session_state.current_session_id = None
-                    st.session_state.messages = []
+                    show_messages([])
                     st.rerun()
 
             with col2:
@@ -678,53 +756,62 @@ def main():
             # Chat messages container
             chat_container = st.container()
 
-            # Display messages
+            # Display only the newest messages; older ones are paged in on request
             with chat_container:
-                for message in st.session_state.messages:
+                messages = st.session_state.messages
+                visible = messages[-st.session_state.visible_messages:]
+                if len(visible) < len(messages) or st.session_state.has_earlier:
+                    st.button("⬆️ Load earlier messages", on_click=load_earlier_messages, use_container_width=True)
+                for message in visible:
                     with st.chat_message(
                             "user" if message["sender"] == current_session["user_name"] else "assistant"
                     ):
                         st.write(message["content"])
-                        st.caption(
-                            datetime.fromisoformat(message["timestamp"]).strftime("%H:%M:%S")
-                        )
+                        st.caption(message["time"])
 
             # Chat input
             if prompt := st.chat_input("Type your message..."):
                 # Add user message to display
-                user_message = {
+                user_message = format_message({
                     "sender": current_session["user_name"],
                     "content": prompt,
                     "timestamp": datetime.utcnow().isoformat()
-                }
+                })
                 st.session_state.messages.append(user_message)
 
                 # Display user message immediately
                 with st.chat_message("user"):
                     st.write(prompt)
 
-                # Send message and get response
-                with st.spinner("Thinking..."):
-                    response = send_message(st.session_state.current_session_id, prompt)
-
-                if response:
-                    # Add bot response to messages
-                    bot_message = {
-                        "sender": response["bot_name"],
-                        "content": response["response"],
-                        "timestamp": response["timestamp"]
-                    }
-                    st.session_state.messages.append(bot_message)
-
-                    # Display bot response
+                if st.session_state.stream_replies:
+                    # Render the reply as it streams in, without rerunning the page
                     with st.chat_message("assistant"):
-                        st.write(response["response"])
-                        st.caption(
-                            datetime.fromisoformat(response["timestamp"]).strftime("%H:%M:%S")
-                        )
-
-                # Rerun to update the chat
-                st.rerun()
+                        bot_message = stream_reply(st.session_state.current_session_id, prompt, st.empty())
+                        if bot_message:
+                            st.caption(bot_message["time"])
+                    if bot_message:
+                        st.session_state.messages.append(bot_message)
+                else:
+                    # Send message and get response
+                    with st.spinner("Thinking..."):
+                        response = send_message(st.session_state.current_session_id, prompt)
+
+                    if response:
+                        # Add bot response to messages
+                        bot_message = format_message({
+                            "sender": response["bot_name"],
+                            "content": response["response"],
+                            "timestamp": response["timestamp"]
+                        })
+                        st.session_state.messages.append(bot_message)
+
+                        # Display bot response
+                        with st.chat_message("assistant"):
+                            st.write(response["response"])
+                            st.caption(bot_message["time"])
+
+                    # Rerun to update the chat
+                    st.rerun()
     else:
         # Welcome screen
         st.markdown("""
@@ -1,6 +1,25 @@
 #!/bin/bash
 
 # CHAI Chat Interface - Run Script
+#
+# Usage: ./run.sh [--workers N]
+# More than one worker shares sessions through Redis (CHAI_REDIS_URL); a
+# local in-memory stand-in is started when no URL is given.
+
+WORKERS=1
+while [ $# -gt 0 ]; do
+    case "$1" in
+        --workers)
+            WORKERS="$2"
+            shift 2
+            ;;
+        *)
+            echo "Unknown option: $1"
+            echo "Usage: ./run.sh [--workers N]"
+            exit 1
+            ;;
+    esac
+done
 
 echo "🚀 Starting CHAI Chat Interface..."
 
@@ -8,9 +27,24 @@ echo "🚀 Starting CHAI Chat Interface..."
 echo "Installing dependencies..."
 pip install -r requirements.txt
 
+if [ "$WORKERS" -gt 1 ]; then
+    # Process-local stores can't be shared, and --reload only supports one worker
+    export CHAI_SESSION_STORE=redis
+    if [ -z "$CHAI_REDIS_URL" ]; then
+        echo "Starting local Redis stand-in..."
+        PYTHONPATH=$(pwd)/backend python -m tools.resp_server --port 6390 &
+        REDIS_PID=$!
+        export CHAI_REDIS_URL=redis://127.0.0.1:6390
+        sleep 1
+    fi
+    UVICORN_OPTS="--workers $WORKERS"
+else
+    UVICORN_OPTS="--reload"
+fi
+
 # Start backend
-echo "Starting backend..."
-PYTHONPATH=$(pwd)/backend uvicorn backend.app.main:app --reload --host 0.0.0.0 --port 8000 &
+echo "Starting backend with $WORKERS worker(s)..."
+PYTHONPATH=$(pwd)/backend uvicorn backend.app.main:app $UVICORN_OPTS --host 0.0.0.0 --port 8000 &
 BACKEND_PID=$!
 
 # Wait for backend to start
@@ -29,4 +63,4 @@ echo ""
 echo "Press Ctrl+C to stop..."
 
 # Wait for interrupt
-wait
\ No newline at end of file
+wait